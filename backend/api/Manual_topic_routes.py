@@ -2,14 +2,11 @@ import os
 import json
 import uuid
 import logging
-import threading
-import asyncio
-import traceback
 from flask import jsonify, request, g
 from auth.jwt_service import jwt_service
 from datetime import datetime 
-from linkedin_ai.pipeline import run_pipeline
 from database import db_manager
+from job_queue import job_queue
 from models import ManualTopic, User
 
 logger = logging.getLogger(__name__)
@@ -43,6 +40,7 @@ def register_manual_topic_routes(app):
         data = request.json
         topic = data.get('topic')
         brief_type = data.get('brief_type', 'active') # 'active', 'personal', or 'company'
+        stream = bool(data.get('stream', False)) # stream draft tokens to /api/jobs/<id>/events
 
         if not topic:
             return jsonify({"error": "Topic is required"}), 400
@@ -61,17 +59,18 @@ def register_manual_topic_routes(app):
                     logger.info(f"Saved new manual topic for user {user_id}")
 
             
-            logger.info(f"Running manual pipeline for user {user_id} with topic: {topic[:50]}...")
-            
-            result = asyncio.run(run_pipeline(user_id=user_id, manual_topic=topic, brief_type=brief_type))
-            
-            logger.info(f"Manual pipeline run finished for user {user_id} with status: {result.get('status')}")
-            
-            if result.get("status") == "success":
-                return jsonify({"success": True, "message": result.get("message")}), 200
-            else:
-                return jsonify({"success": False, "error": result.get("message")}), 500
+            # The LLM calls run in linkedin_ai.run_worker, the request only queues them
+            job_id = job_queue.enqueue(user_id, "manual_pipeline", {"topic": topic, "brief_type": brief_type, "stream": stream})
+            logger.info(f"Queued manual pipeline job {job_id} for user {user_id} with topic: {topic[:50]}...")
+
+            return jsonify({
+                "success": True,
+                "message": "Topic queued for the AI pipeline.",
+                "job_id": job_id,
+                "status_url": f"/api/jobs/{job_id}",
+                "events_url": f"/api/jobs/{job_id}/events"
+            }), 202
 
         except Exception as e:
-            logger.exception(f"Unhandled error in manual pipeline run for user {user_id}: {e}")
-            return jsonify({"error": "Pipeline crashed unexpectedly"}), 500
\ No newline at end of file
+            logger.exception(f"Failed to queue manual pipeline for user {user_id}: {e}")
+            return jsonify({"error": "Failed to queue pipeline run"}), 500
@@ -3,6 +3,10 @@ import logging
 from database import db_manager
 from models import User
 from auth.jwt_service import jwt_service
+from job_queue import job_queue
+from linkedin_ai.brief_digest import digest_enabled
+from linkedin_ai import topic_pool
+from linkedin_ai.brief_sections import sections_enabled, index_brief
 
 logger = logging.getLogger(__name__)
 
@@ -149,6 +153,23 @@ def register_brand_brief_routes(app):
         return _upload_brand_brief(g.user_id, "company")
 
 # Helper functions
+# Rebuild derived brief data in the background when the content actually changed
+def _on_brief_changed(user_id: str, brief_type: str, changed: bool, content: str):
+    if not changed:
+        return
+    try:
+        if digest_enabled():
+            job_queue.enqueue(user_id, "brief_digest", {"brief_type": brief_type})
+        if sections_enabled():
+            # Splitting is local and cheap, so the sections are ready before the next run
+            index_brief(content)
+        # Pooled topics were scored against the old brief
+        topic_pool.invalidate(user_id, brief_type)
+        topic_pool.queue_refill(user_id, brief_type)
+    except Exception as e:
+        # The pipeline builds anything missing on demand, so this must not fail the save
+        logger.error(f"Failed to queue brief refresh for user {user_id}: {e}")
+
 # Create/update brand brief
 def _create_or_update_brand_brief(user_id: str, brief_type: str):
     try:
@@ -168,11 +189,13 @@ def _create_or_update_brand_brief(user_id: str, brief_type: str):
                 return jsonify({'error': 'User not found'}), 404
             
             if brief_type == "personal":
-                user.update_personal_brand_brief(content, original_filename)
+                changed = user.update_personal_brand_brief(content, original_filename)
             else:  # company
-                user.update_company_brand_brief(content, original_filename)
+                changed = user.update_company_brand_brief(content, original_filename)
             
             logger.info(f"User {user_id} updated {brief_type} brand brief")
+            session.commit()
+            _on_brief_changed(user_id, brief_type, changed, content)
             
             return jsonify({
                 'message': f'{brief_type.capitalize()} brand brief saved successfully',
@@ -207,11 +230,13 @@ def _upload_brand_brief(user_id: str, brief_type: str):
                 return jsonify({'error': 'User not found'}), 404
             
             if brief_type == "personal":
-                user.update_personal_brand_brief(content, file.filename)
+                changed = user.update_personal_brand_brief(content, file.filename)
             else:  # company
-                user.update_company_brand_brief(content, file.filename)
+                changed = user.update_company_brand_brief(content, file.filename)
             
             logger.info(f"User {user_id} uploaded {brief_type} brand brief: {file.filename}")
+            session.commit()
+            _on_brief_changed(user_id, brief_type, changed, content)
             
             return jsonify({
                 'message': f'{brief_type.capitalize()} brand brief uploaded successfully',
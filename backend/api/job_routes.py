@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import logging
+from flask import jsonify, request, g, Response, stream_with_context
+from auth.jwt_service import jwt_service
+from job_queue import job_queue
+
+logger = logging.getLogger(__name__)
+
+# Seconds between DB polls while a job has no new events
+EVENT_POLL_INTERVAL = float(os.getenv("JOB_EVENT_POLL_INTERVAL", 0.5))
+# Seconds between SSE comments that keep proxies from closing an idle stream
+EVENT_KEEPALIVE_INTERVAL = 15
+# Seconds one event stream response may hold a web worker; the client then reconnects with Last-Event-ID
+EVENT_STREAM_MAX_SECONDS = float(os.getenv("JOB_EVENT_STREAM_MAX_SECONDS", 25))
+# Milliseconds EventSource waits before reconnecting
+EVENT_RECONNECT_MS = 500
+# Lifetime of the ?token= tokens handed out for EventSource clients
+EVENT_TOKEN_SECONDS = int(os.getenv("JOB_EVENT_TOKEN_SECONDS", 300))
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+def _sse(data: dict, event: str = None, event_id: int = None) -> str:
+    message = ""
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    if event:
+        message += f"event: {event}\n"
+    return message + f"data: {json.dumps(data, default=str)}\n\n"
+
+def _event_stream_user(job_id: str):
+    """User allowed to read the job's events: from the Authorization header, or a ?token= issued for this job."""
+    auth_header = request.headers.get('Authorization', '')
+    if auth_header.startswith('Bearer '):
+        payload = jwt_service.verify_token(auth_header.replace('Bearer ', ''))
+        return payload['user_id'] if payload and payload.get('type') == 'access' else None
+    token = request.args.get('token')
+    if token:
+        payload = jwt_service.verify_token(token)
+        if payload and payload.get('type') == 'job_events' and payload.get('job_id') == job_id:
+            return payload['user_id']
+    return None
+
+def register_job_routes(app):
+
+    @app.route('/api/jobs/<job_id>', methods=['GET'])
+    @jwt_service.require_auth
+    def get_job_status(job_id):
+        """Report the state and result of a queued pipeline job."""
+        user_id = g.user_id
+        try:
+            job = job_queue.get_job(job_id, user_id=user_id)
+            if not job:
+                return jsonify({'error': 'Job not found'}), 404
+
+            return jsonify({'job': job})
+        except Exception as e:
+            logger.error(f"Error fetching job {job_id} for user {user_id}: {e}")
+            return jsonify({'error': 'Failed to fetch job'}), 500
+
+    @app.route('/api/jobs/<job_id>/retry', methods=['POST'])
+    @jwt_service.require_auth
+    def retry_job(job_id):
+        """Re-queue a failed job; its pipeline run resumes from the last completed stage."""
+        user_id = g.user_id
+        try:
+            if not job_queue.requeue(job_id, user_id):
+                return jsonify({'error': 'Only failed jobs can be retried'}), 409
+
+            return jsonify({'success': True, 'job': job_queue.get_job(job_id, user_id=user_id)}), 202
+        except Exception as e:
+            logger.error(f"Error retrying job {job_id} for user {user_id}: {e}")
+            return jsonify({'error': 'Failed to retry job'}), 500
+
+    @app.route('/api/jobs/<job_id>/events-token', methods=['POST'])
+    @jwt_service.require_auth
+    def create_job_events_token(job_id):
+        """Short-lived token for opening the job's event stream with EventSource (?token=...)."""
+        user_id = g.user_id
+        if not job_queue.get_job(job_id, user_id=user_id):
+            return jsonify({'error': 'Job not found'}), 404
+        token = jwt_service.create_job_events_token(user_id, job_id, expire_seconds=EVENT_TOKEN_SECONDS)
+        return jsonify({'token': token, 'expires_in': EVENT_TOKEN_SECONDS})
+
+    @app.route('/api/jobs/<job_id>/events', methods=['GET'])
+    def stream_job_events(job_id):
+        """
+        Server-Sent Events stream with one event per pipeline stage, ending with an `end` event.
+
+        Each response lasts at most JOB_EVENT_STREAM_MAX_SECONDS so a long run doesn't hold a web
+        worker; EventSource then reconnects on its own and resumes after Last-Event-ID.
+        """
+        user_id = _event_stream_user(job_id)
+        if not user_id:
+            return jsonify({'error': 'Authentication required', 'code': 'MISSING_TOKEN'}), 401
+        if not job_queue.get_job(job_id, user_id=user_id):
+            return jsonify({'error': 'Job not found'}), 404
+
+        # Resume after the last event the client saw
+        try:
+            last_id = int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+        except ValueError:
+            return jsonify({'error': 'Invalid event id'}), 400
+
+        def generate():
+            nonlocal last_id
+            started = last_sent = time.monotonic()
+            yield f"retry: {EVENT_RECONNECT_MS}\n\n"
+            while True:
+                # Read the status before the events so nothing written before completion is missed
+                job = job_queue.get_job(job_id)
+                events = job_queue.get_events(job_id, after_id=last_id)
+
+                for event in events:
+                    yield _sse(event['data'], event=event['stage'], event_id=event['id'])
+                    last_id = event['id']
+                    last_sent = time.monotonic()
+
+                if not job or job['status'] in TERMINAL_STATUSES:
+                    yield _sse(job or {}, event='end')
+                    return
+
+                if time.monotonic() - started >= EVENT_STREAM_MAX_SECONDS:
+                    # Not an `end` event: the client reconnects and picks up from last_id
+                    return
+
+                if time.monotonic() - last_sent >= EVENT_KEEPALIVE_INTERVAL:
+                    yield ": keepalive\n\n"
+                    last_sent = time.monotonic()
+
+                time.sleep(EVENT_POLL_INTERVAL)
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
@@ -0,0 +1,10 @@
+from flask import Response
+from metrics import render_metrics
+
+def register_metrics_routes(app):
+
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        """Prometheus scrape endpoint, aggregated across worker processes."""
+        body, content_type = render_metrics()
+        return Response(body, mimetype=content_type)
@@ -0,0 +1,47 @@
+import os
+import hmac
+import logging
+from functools import wraps
+from flask import jsonify, request
+from linkedin_ai.usage import daily_usage, find_outliers
+
+logger = logging.getLogger(__name__)
+
+# Shared secret for the admin usage endpoints, sent as X-Admin-Key; the endpoints are off while unset
+ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+MAX_DAYS = 90
+
+def require_admin_key(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        key = request.headers.get('X-Admin-Key', '')
+        if not ADMIN_API_KEY or not hmac.compare_digest(key, ADMIN_API_KEY):
+            return jsonify({'error': 'Admin key required'}), 403
+        return f(*args, **kwargs)
+    return decorated
+
+def _days() -> int:
+    return max(1, min(MAX_DAYS, request.args.get('days', 7, type=int)))
+
+def register_usage_routes(app):
+
+    @app.route('/api/admin/usage/daily', methods=['GET'])
+    @require_admin_key
+    def get_daily_usage():
+        """LLM tokens, cost and latency per user, day and stage; ?days=7&user_id=..."""
+        try:
+            return jsonify({'usage': daily_usage(_days(), request.args.get('user_id'))})
+        except Exception as e:
+            logger.error(f"Error fetching daily LLM usage: {e}")
+            return jsonify({'error': 'Failed to fetch usage'}), 500
+
+    @app.route('/api/admin/usage/outliers', methods=['GET'])
+    @require_admin_key
+    def get_usage_outliers():
+        """Users and stages whose LLM cost is out of line with the posts they produce; ?days=7&factor=2"""
+        try:
+            factor = request.args.get('factor', 2.0, type=float)
+            return jsonify(find_outliers(_days(), factor))
+        except Exception as e:
+            logger.error(f"Error finding LLM usage outliers: {e}")
+            return jsonify({'error': 'Failed to analyse usage'}), 500
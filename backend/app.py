@@ -10,6 +10,9 @@ from api.Scheduler_routes import register_scheduler_routes
 from api.brand_brief_routes import register_brand_brief_routes
 from api.routes import register_routes
 from api.auth_routes import register_auth_routes
+from api.job_routes import register_job_routes
+from api.metrics_routes import register_metrics_routes
+from api.usage_routes import register_usage_routes
 from database import db_manager
 import models
 
@@ -57,6 +60,9 @@ register_scheduler_routes(app)
 register_routes(app)
 register_auth_routes(app)
 register_brand_brief_routes(app)
+register_job_routes(app)
+register_metrics_routes(app)
+register_usage_routes(app)
 
 # Serve React frontend in production
 @app.route('/', defaults={'path': ''})
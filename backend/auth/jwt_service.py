@@ -53,6 +53,18 @@ class JWTService:
         
         return jwt.encode(payload, self.secret_key, algorithm=self.algorithm)
     
+    def create_job_events_token(self, user_id: str, job_id: str, expire_seconds: int = 300) -> str:
+        """Short-lived token for one job's event stream, passed as ?token= by EventSource clients that can't set headers"""
+        payload = {
+            "user_id": user_id,
+            "job_id": job_id,
+            "exp": datetime.utcnow() + timedelta(seconds=expire_seconds),
+            "iat": datetime.utcnow(),
+            "type": "job_events"
+        }
+
+        return jwt.encode(payload, self.secret_key, algorithm=self.algorithm)
+
     def verify_token(self, token: str) -> Optional[Dict[str, Any]]:
         """Verify JWT token and return payload"""
         try:
@@ -0,0 +1,67 @@
+"""
+Compare two benchmark result files written by run_benchmarks.
+
+    python -m benchmarks.compare benchmarks/results/OLD.json benchmarks/results/NEW.json --threshold 10
+
+Exits with status 1 when throughput or the mean post score drops, or pipeline/stage p95
+latency, rewrite loops or peak RSS grow, by more than --threshold percent for any level present
+in both files. Scores and loops only move with --replay runs.
+"""
+import sys
+import json
+import argparse
+from typing import Any, Dict, List, Optional, Tuple
+
+def _load(path: str) -> Tuple[Dict[str, Any], Dict[Tuple[str, int], Dict[str, Any]]]:
+    with open(path) as f:
+        report = json.load(f)
+    return report, {(r["scenario"], r["users"]): r for r in report["results"]}
+
+def _change(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+def compare(old_path: str, new_path: str, threshold: float) -> List[str]:
+    old_report, old_results = _load(old_path)
+    new_report, new_results = _load(new_path)
+    print(f"old: {old_report['commit'].get('sha')}  new: {new_report['commit'].get('sha')}")
+    if old_report.get("config") != new_report.get("config"):
+        print("warning: the two runs used different benchmark settings")
+
+    regressions = []
+
+    def check(label: str, old: Optional[float], new: Optional[float], higher_is_better: bool = False):
+        change = _change(old, new)
+        if change is None:
+            return
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > threshold else ""
+        print(f"  {label:<40} {old:>10.3f} -> {new:>10.3f}  ({change:+.1f}%){flag}")
+        if flag:
+            regressions.append(label)
+
+    for key in sorted(set(old_results) & set(new_results)):
+        old, new = old_results[key], new_results[key]
+        print(f"\n{key[0]} x {key[1]} users")
+        check(f"{key[0]}/{key[1]} throughput/s", old["throughput_per_s"], new["throughput_per_s"], higher_is_better=True)
+        check(f"{key[0]}/{key[1]} pipeline p95", old["pipeline_latency"].get("p95"), new["pipeline_latency"].get("p95"))
+        for stage in sorted(set(old["stages"]) & set(new["stages"])):
+            check(f"{key[0]}/{key[1]} {stage} p95", old["stages"][stage].get("p95"), new["stages"][stage].get("p95"))
+        check(f"{key[0]}/{key[1]} post score mean", old.get("post_scores", {}).get("mean"), new.get("post_scores", {}).get("mean"),
+              higher_is_better=True)
+        check(f"{key[0]}/{key[1]} rewrite loops mean", old.get("rewrite_loops", {}).get("mean"), new.get("rewrite_loops", {}).get("mean"))
+        check(f"{key[0]}/{key[1]} loop lag p99", old["loop_lag"].get("p99"), new["loop_lag"].get("p99"))
+        check(f"{key[0]}/{key[1]} peak RSS MB", old["peak_rss_mb"], new["peak_rss_mb"])
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change counted as a regression")
+    args = parser.parse_args()
+    regressions = compare(args.old, args.new, args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) above {args.threshold}%")
+        sys.exit(1)
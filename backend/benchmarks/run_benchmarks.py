@@ -0,0 +1,322 @@
+"""
+End-to-end pipeline benchmarks against the fake LLM provider and local Notion/Make stand-ins.
+
+    cd backend
+    python -m benchmarks.run_benchmarks                                # pipeline + cron at 1, 10, 100, 1000 users
+    python -m benchmarks.run_benchmarks --users 1 10 --scenarios pipeline
+    python -m benchmarks.run_benchmarks --replay cassettes/ --replay-speed 10  # recorded production traffic
+    python -m benchmarks.compare benchmarks/results/OLD.json benchmarks/results/NEW.json
+
+Scenarios:
+    pipeline  N concurrent run_pipeline() calls, one per user
+    cron      N due users picked up by run_cron.run_jobs()
+
+With --replay the LLM answers come from cassettes recorded with LLM_RECORD_DIR (see
+linkedin_ai.cassettes) instead of fake templates, so output lengths, malformed JSON and evaluator
+scores follow real traffic. Latencies are the recorded ones divided by --replay-speed.
+
+Every (scenario, users) level runs in its own subprocess with a fresh SQLite database, so peak
+RSS and DB state don't carry over between levels. Results are written to benchmarks/results as
+JSON tagged with the git commit.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "benchmarks", "results")
+SCENARIOS = ("pipeline", "cron")
+DEFAULT_USERS = (1, 10, 100, 1000)
+LOOP_LAG_INTERVAL = 0.05
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": rank(50),
+        "p95": rank(95),
+        "p99": rank(99),
+        "max": ordered[-1],
+    }
+
+def git_commit() -> Dict[str, Any]:
+    try:
+        sha = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+        dirty = bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BACKEND_DIR, text=True).strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"sha": None, "dirty": None}
+    return {"sha": sha, "dirty": dirty}
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+async def monitor_loop_lag(samples: List[float]):
+    """Record how late the event loop wakes a sleeping task; high values mean something blocked the loop."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        samples.append(max(0.0, loop.time() - started - LOOP_LAG_INTERVAL))
+
+# ---- Child: one scenario at one concurrency level ----
+
+def _configure_child_env(args, port: int, db_path: str):
+    from benchmarks.stubs import IntegrationStubs
+    notion_url, make_url = IntegrationStubs.urls(port)
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "NOTION_API_URL": notion_url,
+        "MAKE_WEBHOOK_URL": make_url,
+        "NOTION_API_KEY": "benchmark",
+        "NOTION_DATABASE_ID": "benchmark",
+        "OPENAI_API_KEY": "benchmark",
+        "LLM_PROVIDER": "fake",
+        "LLM_FAKE_SEED": str(args.seed),
+        "LLM_FAKE_LATENCY": args.llm_latency,
+        "LLM_FAKE_ERROR_RATE": str(args.error_rate),
+        "LLM_FAKE_429_RATE": str(args.rate_limit_rate),
+        # The benchmark measures the pipeline, not the OpenAI key's limits
+        "OPENAI_RPM": str(args.rpm),
+        "OPENAI_TPM": str(args.rpm * 1000),
+    })
+    if args.replay:
+        os.environ.update({
+            "LLM_PROVIDER": "replay",
+            "LLM_REPLAY_PATH": os.path.abspath(args.replay),
+            "LLM_REPLAY_SPEED": str(args.replay_speed),
+            "LLM_REPLAY_SEED": str(args.seed),
+        })
+
+def _create_users(count: int, scheduled: bool) -> List[str]:
+    from database import db_manager
+    from models import User
+    now = datetime.now(timezone.utc)
+    user_ids = []
+    with db_manager.get_session() as session:
+        for i in range(count):
+            user = User(
+                email=f"bench-{i}@example.com",
+                password_hash="benchmark",
+                # Distinct briefs so prompts (and LLM cache keys) differ between users
+                personal_brand_brief_content=f"Brand brief {i}: a founder writing about product, hiring and leadership lessons #{i}.",
+                active_brand_brief="personal",
+                scheduler_active=scheduled,
+                scheduler_time=now.strftime("%H:%M"),
+                scheduler_frequency="daily",
+            )
+            session.add(user)
+            session.flush()
+            user_ids.append(user.id)
+    return user_ids
+
+async def _run_scenario(args) -> Dict[str, Any]:
+    import logging
+    from app import app
+    from database import db_manager
+    from metrics import add_stage_observer
+    from benchmarks.stubs import IntegrationStubs
+    from linkedin_ai.providers import Latency
+    from linkedin_ai.pipeline import run_pipeline
+    from linkedin_ai import run_cron
+
+    # Keep SQL echo and per-stage INFO logs out of the measurements
+    db_manager.engine.echo = False
+    logging.getLogger().setLevel(logging.WARNING)
+
+    stubs = IntegrationStubs(Latency(args.http_latency), seed=args.seed)
+    await stubs.start(args.port)
+
+    stage_timings: Dict[str, List[float]] = {}
+    stage_errors: Dict[str, int] = {}
+
+    def on_stage(stage: str, outcome: str, seconds: float):
+        stage_timings.setdefault(stage, []).append(seconds)
+        if outcome != "ok":
+            stage_errors[stage] = stage_errors.get(stage, 0) + 1
+
+    add_stage_observer(on_stage)
+    user_ids = _create_users(args.users, scheduled=args.scenario == "cron")
+
+    run_latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    async def timed_run(user_id: str):
+        started = time.perf_counter()
+        with app.app_context():
+            result = await run_pipeline(user_id=user_id)
+        run_latencies.append(time.perf_counter() - started)
+        statuses[result.get("status", "error")] = statuses.get(result.get("status", "error"), 0) + 1
+
+    lag_samples: List[float] = []
+    lag_monitor = asyncio.create_task(monitor_loop_lag(lag_samples))
+    started = time.perf_counter()
+    try:
+        if args.scenario == "pipeline":
+            await asyncio.gather(*(timed_run(user_id) for user_id in user_ids))
+        else:
+            await run_cron.run_jobs()
+    finally:
+        elapsed = time.perf_counter() - started
+        lag_monitor.cancel()
+        await stubs.stop()
+
+    from models import GeneratedPost
+    with db_manager.get_session() as session:
+        posts = session.query(GeneratedPost.score, GeneratedPost.generation_loops).all()
+    # Cron doesn't hand back per-run results; count the posts it saved instead
+    if args.scenario == "cron":
+        statuses = {"saved_posts": len(posts)}
+
+    completed = statuses.get("success", 0) + statuses.get("partial_success", 0) + statuses.get("saved_posts", 0)
+    return {
+        "scenario": args.scenario,
+        "users": args.users,
+        "seconds": elapsed,
+        "throughput_per_s": completed / elapsed if elapsed else 0.0,
+        "statuses": statuses,
+        "pipeline_latency": percentiles(run_latencies),
+        "stages": {
+            stage: dict(percentiles(timings), errors=stage_errors.get(stage, 0))
+            for stage, timings in sorted(stage_timings.items())
+        },
+        # Fake evaluations draw scores from a fixed weighted distribution, so these track real output only with --replay
+        "post_scores": percentiles([score for score, _ in posts]),
+        "rewrite_loops": percentiles([loops or 0 for _, loops in posts]),
+        "loop_lag": percentiles(lag_samples),
+        "peak_rss_mb": peak_rss_mb(),
+        "integration_calls": dict(stubs.counts),
+    }
+
+def run_child(args):
+    with tempfile.TemporaryDirectory(prefix="relay-bench-") as tmp:
+        port = free_port()
+        _configure_child_env(args, port, os.path.join(tmp, "bench.db"))
+        args.port = port
+        result = asyncio.run(_run_scenario(args))
+    with open(args.result_file, "w") as f:
+        json.dump(result, f)
+
+# ---- Parent: every scenario at every level, each in a fresh process ----
+
+def _child_command(args, scenario: str, users: int, result_file: str) -> List[str]:
+    return [
+        sys.executable, "-m", "benchmarks.run_benchmarks", "--child",
+        "--scenario", scenario, "--users", str(users), "--result-file", result_file,
+        "--seed", str(args.seed), "--llm-latency", args.llm_latency, "--http-latency", args.http_latency,
+        "--error-rate", str(args.error_rate), "--rate-limit-rate", str(args.rate_limit_rate), "--rpm", str(args.rpm),
+    ] + (["--replay", args.replay, "--replay-speed", str(args.replay_speed)] if args.replay else [])
+
+def _print_result(result: Dict[str, Any]):
+    pipeline = result["pipeline_latency"]
+    lag = result["loop_lag"]
+    print(f"\n{result['scenario']} x {result['users']} users: {result['seconds']:.2f}s, "
+          f"{result['throughput_per_s']:.2f} pipelines/s, statuses {result['statuses']}")
+    if pipeline.get("count"):
+        print(f"  pipeline       p50 {pipeline['p50']:.3f}s  p95 {pipeline['p95']:.3f}s  p99 {pipeline['p99']:.3f}s")
+    for stage, stats in result["stages"].items():
+        print(f"  {stage:<18} p50 {stats['p50']:.3f}s  p95 {stats['p95']:.3f}s  p99 {stats['p99']:.3f}s  n={stats['count']} errors={stats['errors']}")
+    scores = result.get("post_scores", {})
+    if scores.get("count"):
+        print(f"  post score     mean {scores['mean']:.2f}  p50 {scores['p50']:.1f}  rewrite loops mean {result['rewrite_loops']['mean']:.2f}")
+    if lag.get("count"):
+        print(f"  loop lag       p50 {lag['p50'] * 1000:.1f}ms  p99 {lag['p99'] * 1000:.1f}ms  max {lag['max'] * 1000:.1f}ms")
+    print(f"  peak RSS {result['peak_rss_mb']:.1f} MB")
+
+def run_parent(args):
+    results = []
+    for scenario in args.scenarios:
+        for users in args.users:
+            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+                result_file = f.name
+            try:
+                # The app logs every SQL statement at start-up; only show child output when it fails
+                proc = subprocess.run(_child_command(args, scenario, users, result_file), cwd=BACKEND_DIR,
+                                      stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+                if proc.returncode != 0:
+                    print(proc.stdout[-5000:], file=sys.stderr)
+                    print(f"{scenario} x {users} users failed with exit code {proc.returncode}", file=sys.stderr)
+                    continue
+                with open(result_file) as f:
+                    result = json.load(f)
+            finally:
+                os.unlink(result_file)
+            _print_result(result)
+            results.append(result)
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "seed": args.seed,
+            "llm_latency": args.llm_latency,
+            "http_latency": args.http_latency,
+            "error_rate": args.error_rate,
+            "rate_limit_rate": args.rate_limit_rate,
+            "rpm": args.rpm,
+            "replay": args.replay,
+            "replay_speed": args.replay_speed if args.replay else None,
+        },
+        "results": results,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    name = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}-{(commit['sha'] or 'unknown')[:10]}.json"
+    path = os.path.join(args.out, name)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {path}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmarks with a fake LLM")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--users", nargs="+", type=int, default=list(DEFAULT_USERS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--llm-latency", default="lognormal:0.5:0.4", help="Fake LLM latency distribution, e.g. fixed:0.1")
+    parser.add_argument("--http-latency", default="lognormal:0.08:0.3", help="Notion/Make stand-in latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of LLM calls failing with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of LLM calls failing with a 429")
+    parser.add_argument("--rpm", type=int, default=1000000, help="Requests per minute given to the rate limiter")
+    parser.add_argument("--replay", help="Cassette file or directory to answer LLM calls from instead of the fake provider")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="Divide recorded latencies by this (0 answers at once)")
+    parser.add_argument("--out", default=RESULTS_DIR, help="Directory for the JSON results")
+    # Internal: run a single level and write its result to --result-file
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        args.users = args.users[0]
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.child:
+        run_child(args)
+    else:
+        run_parent(args)
@@ -0,0 +1,48 @@
+import asyncio
+import random
+from aiohttp import web
+
+class IntegrationStubs:
+    """Local stand-ins for the Notion pages API and the Make webhook, with simulated latency."""
+
+    def __init__(self, latency=None, seed: int = 0):
+        # latency: object with sample(rng) -> seconds (see linkedin_ai.providers.Latency), or None for no delay
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.counts = {"notion": 0, "make": 0}
+        self.runner = None
+        self.port = None
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency.sample(self.rng))
+
+    async def notion_pages(self, request: web.Request) -> web.Response:
+        await request.json()
+        await self._delay()
+        self.counts["notion"] += 1
+        return web.json_response({"object": "page", "id": f"stub-page-{self.counts['notion']}"})
+
+    async def make_webhook(self, request: web.Request) -> web.Response:
+        await request.json()
+        await self._delay()
+        self.counts["make"] += 1
+        return web.Response(text="Accepted")
+
+    async def start(self, port: int, host: str = "127.0.0.1"):
+        app = web.Application()
+        app.router.add_post("/notion/v1/pages", self.notion_pages)
+        app.router.add_post("/make", self.make_webhook)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.port = port
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    @staticmethod
+    def urls(port: int, host: str = "127.0.0.1"):
+        """(NOTION_API_URL, MAKE_WEBHOOK_URL) for stubs listening on port."""
+        return f"http://{host}:{port}/notion/v1", f"http://{host}:{port}/make"
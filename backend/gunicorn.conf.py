@@ -0,0 +1,7 @@
+import os
+from prometheus_client import multiprocess
+
+# Drop the live gauges of a dead worker so /metrics stops counting its in-flight pipelines
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,206 @@
+import os
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, List
+from sqlalchemy import update, or_, and_
+from database import db_manager
+from models import PipelineJob, PipelineJobEvent
+
+logger = logging.getLogger(__name__)
+
+# Seconds a claimed job stays invisible to other workers without a heartbeat
+VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", 300))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+# Base delay before a failed job is retried, doubled on every attempt
+RETRY_DELAY = int(os.getenv("JOB_RETRY_DELAY", 30))
+
+class JobQueue:
+    """DB-backed job queue shared by the API (producer) and run_worker (consumer)."""
+
+    def __init__(self, visibility_timeout: int = VISIBILITY_TIMEOUT, max_attempts: int = MAX_ATTEMPTS, retry_delay: int = RETRY_DELAY):
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    # Add a job to the queue and return its id
+    def enqueue(self, user_id: str, kind: str, payload: Dict[str, Any] = None, max_attempts: int = None, delay: float = 0) -> str:
+        with db_manager.get_session() as session:
+            job = PipelineJob(
+                user_id=user_id,
+                kind=kind,
+                payload=json.dumps(payload or {}),
+                status="queued",
+                max_attempts=max_attempts or self.max_attempts,
+                run_after=datetime.utcnow() + timedelta(seconds=delay),
+            )
+            session.add(job)
+            session.flush()
+            job_id = job.id
+
+        logger.info(f"Enqueued {kind} job {job_id} for user {user_id}")
+        return job_id
+
+    # Claim up to `limit` runnable jobs for this worker
+    def claim(self, worker_id: str, limit: int = 1) -> List[Dict[str, Any]]:
+        now = datetime.utcnow()
+        locked_until = now + timedelta(seconds=self.visibility_timeout)
+        claimable = or_(
+            and_(PipelineJob.status == "queued", PipelineJob.run_after <= now),
+            and_(PipelineJob.status == "running", PipelineJob.locked_until < now),
+        )
+        claimed = []
+
+        with db_manager.get_session() as session:
+            # Crash recovery: jobs whose worker died on the last attempt are given up on
+            session.execute(
+                update(PipelineJob)
+                .where(
+                    PipelineJob.status == "running",
+                    PipelineJob.locked_until < now,
+                    PipelineJob.attempts >= PipelineJob.max_attempts,
+                )
+                .values(status="failed", error="Worker lost the job on its final attempt", finished_at=now, locked_by=None)
+                .execution_options(synchronize_session=False)
+            )
+
+            candidates = session.query(PipelineJob.id)\
+                .filter(claimable)\
+                .order_by(PipelineJob.created_at)\
+                .limit(limit)\
+                .with_for_update(skip_locked=True)\
+                .all()
+
+            for (job_id,) in candidates:
+                # Conditional update so two workers can never claim the same row
+                res = session.execute(
+                    update(PipelineJob)
+                    .where(PipelineJob.id == job_id, claimable)
+                    .values(
+                        status="running",
+                        locked_by=worker_id,
+                        locked_until=locked_until,
+                        attempts=PipelineJob.attempts + 1,
+                        started_at=now,
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                if res.rowcount != 1:
+                    continue
+
+                job = session.query(PipelineJob).filter(PipelineJob.id == job_id).first()
+                claimed.append({
+                    "id": job.id,
+                    "user_id": job.user_id,
+                    "kind": job.kind,
+                    "payload": json.loads(job.payload or "{}"),
+                    "attempts": job.attempts,
+                    "max_attempts": job.max_attempts,
+                })
+
+        for job in claimed:
+            logger.info(f"Worker {worker_id} claimed {job['kind']} job {job['id']} (attempt {job['attempts']}/{job['max_attempts']})")
+        return claimed
+
+    # Extend the visibility timeout of a job this worker still holds
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        with db_manager.get_session() as session:
+            res = session.execute(
+                update(PipelineJob)
+                .where(PipelineJob.id == job_id, PipelineJob.locked_by == worker_id, PipelineJob.status == "running")
+                .values(locked_until=datetime.utcnow() + timedelta(seconds=self.visibility_timeout))
+                .execution_options(synchronize_session=False)
+            )
+            return res.rowcount == 1
+
+    # Mark a job as finished and store its result
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        with db_manager.get_session() as session:
+            res = session.execute(
+                update(PipelineJob)
+                .where(PipelineJob.id == job_id, PipelineJob.locked_by == worker_id, PipelineJob.status == "running")
+                .values(
+                    status="succeeded",
+                    result=json.dumps(result, default=str),
+                    error=None,
+                    locked_by=None,
+                    locked_until=None,
+                    finished_at=datetime.utcnow(),
+                )
+                .execution_options(synchronize_session=False)
+            )
+            if res.rowcount != 1:
+                logger.warning(f"Worker {worker_id} lost job {job_id} before completing it")
+            return res.rowcount == 1
+
+    # Record a failure; the job is re-queued with backoff until it runs out of attempts
+    def fail(self, job_id: str, worker_id: str, error: str, result: Dict[str, Any] = None, retry: bool = True) -> bool:
+        now = datetime.utcnow()
+        with db_manager.get_session() as session:
+            job = session.query(PipelineJob)\
+                .filter(PipelineJob.id == job_id, PipelineJob.locked_by == worker_id, PipelineJob.status == "running")\
+                .first()
+            if not job:
+                logger.warning(f"Worker {worker_id} lost job {job_id} before failing it")
+                return False
+
+            job.error = error
+            job.result = json.dumps(result, default=str) if result else None
+            job.locked_by = None
+            job.locked_until = None
+
+            if retry and job.attempts < job.max_attempts:
+                job.status = "queued"
+                job.run_after = now + timedelta(seconds=self.retry_delay * (2 ** (job.attempts - 1)))
+                logger.warning(f"Job {job_id} failed (attempt {job.attempts}/{job.max_attempts}), retrying at {job.run_after}: {error}")
+            else:
+                job.status = "failed"
+                job.finished_at = now
+                logger.error(f"Job {job_id} failed permanently after {job.attempts} attempts: {error}")
+            return True
+
+    # Put a failed job back in the queue for a fresh set of attempts
+    def requeue(self, job_id: str, user_id: str) -> bool:
+        with db_manager.get_session() as session:
+            job = session.query(PipelineJob)\
+                .filter(PipelineJob.id == job_id, PipelineJob.user_id == user_id, PipelineJob.status == "failed")\
+                .first()
+            if not job:
+                return False
+
+            job.status = "queued"
+            job.attempts = 0
+            job.error = None
+            job.run_after = datetime.utcnow()
+            job.finished_at = None
+            logger.info(f"Job {job_id} re-queued by user {user_id}")
+            return True
+
+    # Get a job's state, optionally scoped to its owner
+    def get_job(self, job_id: str, user_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        with db_manager.get_session() as session:
+            query = session.query(PipelineJob).filter(PipelineJob.id == job_id)
+            if user_id:
+                query = query.filter(PipelineJob.user_id == user_id)
+            job = query.first()
+            return job.to_dict() if job else None
+
+    # Append a progress event for a job (see linkedin_ai.pipeline progress callbacks)
+    def add_event(self, job_id: str, stage: str, data: Dict[str, Any] = None) -> int:
+        with db_manager.get_session() as session:
+            event = PipelineJobEvent(job_id=job_id, stage=stage, data=json.dumps(data or {}, default=str))
+            session.add(event)
+            session.flush()
+            return event.id
+
+    # Events recorded after `after_id`, oldest first
+    def get_events(self, job_id: str, after_id: int = 0) -> List[Dict[str, Any]]:
+        with db_manager.get_session() as session:
+            events = session.query(PipelineJobEvent)\
+                .filter(PipelineJobEvent.job_id == job_id, PipelineJobEvent.id > after_id)\
+                .order_by(PipelineJobEvent.id)\
+                .all()
+            return [event.to_dict() for event in events]
+
+# Global instance
+job_queue = JobQueue()
@@ -0,0 +1,351 @@
+"""
+Offline batch execution of LLM calls for scheduled runs.
+
+Inside `async with BatchCollector(provider):` every complete()/stream_completion() call is
+queued instead of sent. Once no new request has arrived for BATCH_COLLECT_IDLE seconds (every
+pipeline is waiting on the model), the queued requests are submitted as one JSONL batch. When
+the batch finishes, each waiting pipeline gets its response and moves on to its next stage,
+whose requests form the next batch. Requests and results are stored in llm_batches /
+llm_batch_requests, so a resumed pipeline run picks up a batch it submitted before a crash.
+"""
+import os
+import json
+import uuid
+import asyncio
+import hashlib
+import logging
+from collections import defaultdict
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from openai.types.chat import ChatCompletion
+from database import db_manager
+from models import LLMBatch, LLMBatchRequest, PipelineRun
+from .checkpoints import current_run
+from .llm_cache import cache_key
+from .providers import openai_client
+
+logger = logging.getLogger(__name__)
+
+# "openai" for the Batch API, "local" for the file-based stand-in
+BATCH_PROVIDER = os.getenv("LLM_BATCH_PROVIDER", "openai")
+BATCH_DIR = os.getenv("LLM_BATCH_DIR", "./llm_batches")
+# Seconds without a new request before the collected requests are submitted
+BATCH_COLLECT_IDLE = float(os.getenv("LLM_BATCH_COLLECT_IDLE", 2))
+# The Batch API accepts at most 50,000 requests per batch
+BATCH_MAX_REQUESTS = int(os.getenv("LLM_BATCH_MAX_REQUESTS", 50000))
+BATCH_POLL_INTERVAL = float(os.getenv("LLM_BATCH_POLL_INTERVAL", 60))
+# Seconds between touches of the runs waiting on a batch, so the cron can tell them from abandoned ones
+BATCH_RUN_HEARTBEAT = float(os.getenv("LLM_BATCH_RUN_HEARTBEAT", 60))
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+# Provider batch states
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"  # finished, possibly with some requests missing from the output
+FAILED = "failed"
+
+_batch: ContextVar[Optional["BatchCollector"]] = ContextVar("llm_batch", default=None)
+
+def current_batch() -> Optional["BatchCollector"]:
+    """The collector LLM calls in this task are queued on, or None for real-time calls."""
+    return _batch.get()
+
+class BatchRequestError(Exception):
+    """A request in a batch failed or was missing from the batch output"""
+    pass
+
+class BatchProvider:
+    """Submits a list of Batch API input lines and returns their output lines keyed by custom_id."""
+
+    name = "base"
+    poll_interval = BATCH_POLL_INTERVAL
+
+    async def submit(self, lines: List[Dict[str, Any]], stages: Optional[Dict[str, str]] = None) -> str:
+        """Submit input lines and return the provider's batch id. `stages` maps custom_id to pipeline stage."""
+        raise NotImplementedError
+
+    async def status(self, external_id: str) -> str:
+        """One of IN_PROGRESS, COMPLETED or FAILED."""
+        raise NotImplementedError
+
+    async def results(self, external_id: str) -> Dict[str, Dict[str, Any]]:
+        """Output lines of a finished batch, keyed by custom_id."""
+        raise NotImplementedError
+
+class OpenAIBatchProvider(BatchProvider):
+    """OpenAI Batch API: half the price of real-time calls and separate rate limits, results within 24h."""
+
+    name = "openai"
+
+    def __init__(self, client, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    async def submit(self, lines: List[Dict[str, Any]], stages: Optional[Dict[str, str]] = None) -> str:
+        data = "\n".join(json.dumps(line) for line in lines).encode("utf-8")
+        input_file = await self.client.files.create(file=("batch.jsonl", data), purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    async def status(self, external_id: str) -> str:
+        batch = await self.client.batches.retrieve(external_id)
+        if batch.status == "failed":
+            return FAILED
+        # Expired and cancelled batches still return the requests that did finish
+        if batch.status in ("completed", "expired", "cancelled"):
+            return COMPLETED
+        return IN_PROGRESS
+
+    async def results(self, external_id: str) -> Dict[str, Dict[str, Any]]:
+        batch = await self.client.batches.retrieve(external_id)
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await self.client.files.content(file_id)
+            for line in content.text.splitlines():
+                if line.strip():
+                    output = json.loads(line)
+                    results[output["custom_id"]] = output
+        return results
+
+class LocalFileBatchProvider(BatchProvider):
+    """
+    Stand-in for tests and development. Writes the input JSONL to `directory`, answers each line
+    with `respond(body, stage)` when first polled, and writes the output JSONL in the Batch API format.
+    """
+
+    name = "local"
+    poll_interval = 0.1
+
+    def __init__(self, respond: Callable[[Dict[str, Any], Optional[str]], Awaitable[Any]], directory: str = BATCH_DIR):
+        self.respond = respond
+        self._stages: Dict[str, str] = {}
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, external_id: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{external_id}.{kind}.jsonl")
+
+    async def submit(self, lines: List[Dict[str, Any]], stages: Optional[Dict[str, str]] = None) -> str:
+        external_id = f"local_batch_{uuid.uuid4().hex}"
+        with open(self._path(external_id, "input"), "w") as f:
+            f.writelines(json.dumps(line) + "\n" for line in lines)
+        self._stages.update(stages or {})
+        return external_id
+
+    async def _answer(self, line: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = await self.respond(line["body"], self._stages.get(line["custom_id"]))
+            if hasattr(response, "model_dump"):
+                response = response.model_dump(mode="json")
+            return {"custom_id": line["custom_id"], "response": {"status_code": 200, "body": response}, "error": None}
+        except Exception as e:
+            return {"custom_id": line["custom_id"], "response": None, "error": {"code": type(e).__name__, "message": str(e)}}
+
+    async def status(self, external_id: str) -> str:
+        output_path = self._path(external_id, "output")
+        if not os.path.exists(output_path):
+            with open(self._path(external_id, "input")) as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            outputs = await asyncio.gather(*(self._answer(line) for line in lines))
+            with open(output_path, "w") as f:
+                f.writelines(json.dumps(output) + "\n" for output in outputs)
+        return COMPLETED
+
+    async def results(self, external_id: str) -> Dict[str, Dict[str, Any]]:
+        with open(self._path(external_id, "output")) as f:
+            outputs = [json.loads(line) for line in f if line.strip()]
+        return {output["custom_id"]: output for output in outputs}
+
+def create_batch_provider(llm_provider, name: str = BATCH_PROVIDER) -> BatchProvider:
+    """Provider selected by LLM_BATCH_PROVIDER; the local one answers through `llm_provider` in real time."""
+    if name == "openai":
+        return OpenAIBatchProvider(openai_client())
+    if name == "local":
+        return LocalFileBatchProvider(llm_provider.complete)
+    raise ValueError(f"Unknown batch provider '{name}'")
+
+# (status, response, error) of a stored request
+def _parse_output(output: Optional[Dict[str, Any]]) -> Tuple[str, Optional[str], Optional[str]]:
+    if not output:
+        return "failed", None, "Missing from batch output"
+    response = output.get("response") or {}
+    if output.get("error") or response.get("status_code") != 200:
+        return "failed", None, json.dumps(output.get("error") or response.get("body"), default=str)
+    return "done", json.dumps(response["body"]), None
+
+class BatchCollector:
+    """Collects LLM requests from concurrently running pipelines and submits them in batches."""
+
+    def __init__(self, provider: BatchProvider, collect_idle: float = BATCH_COLLECT_IDLE, max_requests: int = BATCH_MAX_REQUESTS):
+        self.provider = provider
+        self.collect_idle = collect_idle
+        self.max_requests = max_requests
+        self._round: Dict[str, Dict[str, Any]] = {}
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._occurrences: Dict[Tuple[Optional[str], str], int] = defaultdict(int)
+        self._watchers: Dict[str, asyncio.Task] = {}
+        self._last_added = 0.0
+        self._flusher: Optional[asyncio.Task] = None
+        self._token = None
+
+    async def __aenter__(self) -> "BatchCollector":
+        self._flusher = asyncio.create_task(self._flush_when_idle())
+        self._token = _batch.set(self)
+        return self
+
+    async def __aexit__(self, *exc):
+        _batch.reset(self._token)
+        tasks = [self._flusher, *self._watchers.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for future in self._futures.values():
+            if not future.done():
+                future.cancel()
+
+    # Same run, same request and same occurrence -> same id, also after the run is resumed
+    def _custom_id(self, params: Dict[str, Any]) -> str:
+        run_id = current_run.get()
+        key = cache_key(params)
+        occurrence = self._occurrences[(run_id, key)]
+        self._occurrences[(run_id, key)] += 1
+        return hashlib.sha256(f"{run_id}:{key}:{occurrence}".encode("utf-8")).hexdigest()
+
+    async def request(self, params: Dict[str, Any], stage: Optional[str] = None) -> ChatCompletion:
+        """Queue a chat completion request and wait for its result from a batch."""
+        loop = asyncio.get_running_loop()
+        custom_id = self._custom_id(params)
+        future = loop.create_future()
+        self._futures[custom_id] = future
+
+        with db_manager.get_session() as session:
+            stored = session.query(LLMBatchRequest)\
+                .filter(LLMBatchRequest.custom_id == custom_id, LLMBatchRequest.status != "failed")\
+                .order_by(LLMBatchRequest.id.desc())\
+                .first()
+            stored = stored and (stored.status, stored.response, stored.batch_id)
+
+        if stored and stored[0] == "done":
+            logger.info(f"Reusing batch result for {stage} ({custom_id[:12]})")
+            future.set_result(ChatCompletion.model_validate_json(stored[1]))
+        elif stored:
+            self._watch(stored[2])
+        else:
+            self._round[custom_id] = {"params": params, "stage": stage, "run_id": current_run.get()}
+            self._last_added = loop.time()
+
+        try:
+            return await future
+        finally:
+            self._futures.pop(custom_id, None)
+
+    async def _flush_when_idle(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(min(self.collect_idle / 4, 0.5))
+            if not self._round:
+                continue
+            if len(self._round) >= self.max_requests or loop.time() - self._last_added >= self.collect_idle:
+                await self.flush()
+
+    async def flush(self):
+        """Submit the collected requests as one batch."""
+        requests = dict(list(self._round.items())[:self.max_requests])
+        for custom_id in requests:
+            del self._round[custom_id]
+
+        lines = [{"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_URL, "body": request["params"]}
+                 for custom_id, request in requests.items()]
+        try:
+            external_id = await self.provider.submit(lines, stages={custom_id: request["stage"] for custom_id, request in requests.items()})
+            with db_manager.get_session() as session:
+                batch = LLMBatch(provider=self.provider.name, external_id=external_id, request_count=len(lines))
+                session.add(batch)
+                session.flush()
+                batch_id = batch.id
+                for custom_id, request in requests.items():
+                    session.add(LLMBatchRequest(
+                        batch_id=batch_id,
+                        run_id=request["run_id"],
+                        custom_id=custom_id,
+                        stage=request["stage"],
+                        params=json.dumps(request["params"]),
+                    ))
+        except Exception as e:
+            logger.error(f"Failed to submit batch of {len(lines)} requests: {e}")
+            for custom_id in requests:
+                self._resolve(custom_id, "failed", None, f"Batch submission failed: {e}")
+            return
+
+        stages = sorted({request["stage"] or "unknown" for request in requests.values()})
+        logger.info(f"Submitted {self.provider.name} batch {external_id} with {len(lines)} requests ({', '.join(stages)})")
+        self._watch(batch_id)
+
+    def _watch(self, batch_id: str):
+        if batch_id not in self._watchers:
+            self._watchers[batch_id] = asyncio.create_task(self._poll(batch_id))
+
+    async def _poll(self, batch_id: str):
+        with db_manager.get_session() as session:
+            external_id = session.query(LLMBatch.external_id).filter(LLMBatch.id == batch_id).scalar()
+
+        loop = asyncio.get_running_loop()
+        touched = 0.0
+        while True:
+            try:
+                status = await self.provider.status(external_id)
+                if status != IN_PROGRESS:
+                    break
+            except Exception as e:
+                logger.warning(f"Failed to poll batch {external_id}, retrying: {e}")
+            if loop.time() - touched >= BATCH_RUN_HEARTBEAT:
+                self._touch_runs(batch_id)
+                touched = loop.time()
+            await asyncio.sleep(self.provider.poll_interval)
+
+        results = {}
+        if status == COMPLETED:
+            try:
+                results = await self.provider.results(external_id)
+            except Exception as e:
+                logger.error(f"Failed to fetch results of batch {external_id}: {e}")
+
+        outcomes = []
+        with db_manager.get_session() as session:
+            batch = session.query(LLMBatch).filter(LLMBatch.id == batch_id).first()
+            for request in batch.requests:
+                request.status, request.response, request.error = _parse_output(results.get(request.custom_id))
+                outcomes.append((request.custom_id, request.status, request.response, request.error))
+            batch.status = "completed" if status == COMPLETED else "failed"
+            batch.completed_at = datetime.utcnow()
+
+        failed = sum(1 for outcome in outcomes if outcome[1] == "failed")
+        logger.info(f"Batch {external_id} finished: {len(outcomes) - failed} done, {failed} failed")
+        for outcome in outcomes:
+            self._resolve(*outcome)
+
+    def _touch_runs(self, batch_id: str):
+        """Bump updated_at of the runs waiting on a batch; runs nobody touches for a while are resumed by the cron."""
+        try:
+            with db_manager.get_session() as session:
+                run_ids = session.query(LLMBatchRequest.run_id).filter(LLMBatchRequest.batch_id == batch_id)
+                session.query(PipelineRun)\
+                    .filter(PipelineRun.id.in_(run_ids), PipelineRun.status == "running")\
+                    .update({PipelineRun.updated_at: datetime.utcnow()}, synchronize_session=False)
+        except Exception as e:
+            logger.warning(f"Failed to touch the runs waiting on batch {batch_id}: {e}")
+
+    def _resolve(self, custom_id: str, status: str, response: Optional[str], error: Optional[str]):
+        future = self._futures.get(custom_id)
+        if not future or future.done():
+            return
+        if status == "done":
+            future.set_result(ChatCompletion.model_validate_json(response))
+        else:
+            future.set_exception(BatchRequestError(error))
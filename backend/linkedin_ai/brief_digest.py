@@ -0,0 +1,108 @@
+import os
+import hashlib
+import logging
+from collections import OrderedDict
+from sqlalchemy.exc import IntegrityError
+from database import db_manager
+from models import BriefDigest
+from metrics import timed_stage
+from .client import complete
+
+logger = logging.getLogger(__name__)
+
+DIGEST_MODEL = "gpt-4o-mini"
+DIGEST_MAX_WORDS = 250
+# Comma separated stages whose prompts get the digest instead of the full brief,
+# e.g. "get_topic,evaluate_post,rewrite_post". Empty keeps the full brief everywhere.
+DIGEST_STAGES = {s.strip() for s in os.getenv("BRIEF_DIGEST_STAGES", "").split(",") if s.strip()}
+# Briefs shorter than this are already cheap and are used as-is
+DIGEST_MIN_CHARS = int(os.getenv("BRIEF_DIGEST_MIN_CHARS", 1500))
+# Digests kept in process memory, least recently used evicted first
+DIGEST_MEMORY_MAX_ENTRIES = int(os.getenv("BRIEF_DIGEST_MAX_ENTRIES", 500))
+
+# content hash -> digest, in front of the brief_digests table
+_digests: "OrderedDict[str, str]" = OrderedDict()
+
+def _remember(content_hash: str, digest: str):
+    _digests[content_hash] = digest
+    _digests.move_to_end(content_hash)
+    while len(_digests) > DIGEST_MEMORY_MAX_ENTRIES:
+        _digests.popitem(last=False)
+
+def brief_hash(content: str) -> str:
+    return hashlib.sha256((content or "").strip().encode("utf-8")).hexdigest()
+
+def digest_enabled() -> bool:
+    return bool(DIGEST_STAGES)
+
+@timed_stage("brief_digest")
+async def build_brief_digest(brief: str) -> str:
+    prompt = f"""
+    Condense the brand brief below into a digest of at most {DIGEST_MAX_WORDS} words that a LinkedIn ghostwriter and editor can work from.
+
+    Keep, as short bullet points under these headings:
+    - Identity: who the brand is
+    - Voice & tone
+    - Audience
+    - Goals
+    - Themes to write about
+    - Do / Don't (including banned words or phrases, quoted exactly)
+
+    Drop everything else. Do not invent anything that is not in the brief.
+    Return only the digest text.
+
+    Brand Brief:
+    {brief}
+    """
+    response = await complete(
+        "brief_digest",
+        model=DIGEST_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0,
+    )
+    return response.choices[0].message.content.strip()
+
+async def get_brief_digest(brief: str) -> str:
+    """
+    Digest of a brief, built once per distinct content and reused afterwards.
+
+    Falls back to the full brief when it is short or the digest can't be built.
+    """
+    if not brief or len(brief) < DIGEST_MIN_CHARS:
+        return brief
+
+    content_hash = brief_hash(brief)
+    if content_hash in _digests:
+        _digests.move_to_end(content_hash)
+        return _digests[content_hash]
+
+    with db_manager.get_session() as session:
+        stored = session.query(BriefDigest).filter(BriefDigest.content_hash == content_hash).first()
+        if stored:
+            _remember(content_hash, stored.digest)
+            return stored.digest
+
+    try:
+        digest = await build_brief_digest(brief)
+    except Exception as e:
+        logger.error(f"Failed to build brief digest, using the full brief: {e}")
+        return brief
+    if not digest:
+        return brief
+
+    try:
+        with db_manager.get_session() as session:
+            session.add(BriefDigest(
+                content_hash=content_hash,
+                digest=digest,
+                model=DIGEST_MODEL,
+                source_chars=len(brief),
+                digest_chars=len(digest),
+            ))
+    except IntegrityError:
+        # Another run built the same digest first; either copy is fine
+        logger.info(f"Brief digest {content_hash[:12]} was stored concurrently")
+
+    logger.info(f"Built brief digest {content_hash[:12]}: {len(brief)} -> {len(digest)} chars")
+    _remember(content_hash, digest)
+    return digest
@@ -0,0 +1,226 @@
+"""
+Brand brief sections and per-stage selection.
+
+Prompts used to carry the whole brief, so their size grew with every brief a customer uploaded.
+A brief is split into sections (voice, audience, goals, banned phrases, ...) when it is saved,
+and each prompt gets only the sections that matter to its stage and topic, up to the stage's
+token budget. Relevance to the topic is TF-IDF cosine similarity over the brief's own sections,
+computed locally. Briefs that already fit the budget are used whole.
+"""
+import os
+import re
+import json
+import math
+import logging
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional
+from sqlalchemy.exc import IntegrityError
+from database import db_manager
+from models import BriefSection
+from metrics import record_brief_selection
+from .brief_digest import DIGEST_STAGES, brief_hash, get_brief_digest
+
+logger = logging.getLogger(__name__)
+
+SECTIONS_ENABLED = os.getenv("BRIEF_SECTIONS", "true").lower() == "true"
+
+# Prompt tokens the brief may take per stage; briefs within budget are not cut
+DEFAULT_BUDGETS = {
+    "get_topic": 800,
+    "generate_post": 1200,
+    "evaluate_post": 800,
+    "rewrite_post": 800,
+}
+DEFAULT_BUDGET = int(os.getenv("BRIEF_SECTION_DEFAULT_BUDGET", 1000))
+# JSON object of stage -> tokens overriding the defaults above, e.g. {"generate_post": 1500}
+STAGE_BUDGETS = {**DEFAULT_BUDGETS, **json.loads(os.getenv("BRIEF_SECTION_BUDGETS", "{}"))}
+# Sections longer than this are split into their paragraphs so one of them can't take the whole budget
+MAX_SECTION_TOKENS = int(os.getenv("BRIEF_SECTION_MAX_TOKENS", 300))
+# Section indexes kept in process memory, least recently used evicted first
+INDEX_MEMORY_MAX_ENTRIES = int(os.getenv("BRIEF_SECTION_INDEX_MAX_ENTRIES", 500))
+
+# Heading keywords per kind, checked in this order ("Tone to avoid" is banned, not voice)
+KIND_KEYWORDS = (
+    ("banned", ("avoid", "banned", "don't", "dont", "do not", "never", "forbidden", "off-limits")),
+    ("voice", ("voice", "tone", "style", "writing", "personality")),
+    ("audience", ("audience", "reader", "customer", "persona", "icp")),
+    ("goals", ("goal", "objective", "mission", "purpose", "kpi", "outcome")),
+    ("themes", ("topic", "theme", "pillar", "content", "expertise", "subject")),
+    ("identity", ("about", "who", "bio", "background", "company", "identity", "overview")),
+)
+# Kinds each stage always wants, whatever the topic
+STAGE_KINDS = {
+    "get_topic": {"identity", "themes", "audience", "goals"},
+    "generate_post": {"voice", "banned", "audience"},
+    "evaluate_post": {"voice", "banned", "audience", "goals"},
+    "rewrite_post": {"voice", "banned"},
+}
+
+HEADING = re.compile(r"^(#{1,6}\s+.+|[A-Z][\w &/'()-]{1,60}:|[A-Z0-9][A-Z0-9 &/'()-]{2,60})$")
+WORD = re.compile(r"[a-z][a-z0-9']+")
+STOPWORDS = {
+    "the", "and", "for", "are", "but", "not", "you", "your", "our", "with", "that", "this", "have", "from",
+    "they", "their", "will", "what", "about", "into", "more", "than", "them", "its", "can", "how", "who",
+    "was", "were", "has", "all", "any", "out", "also", "just", "like", "over", "some", "such",
+}
+
+def sections_enabled() -> bool:
+    return SECTIONS_ENABLED
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4
+
+def _kind(heading: str, content: str) -> str:
+    label = (heading or content.split("\n", 1)[0][:80]).lower()
+    for kind, keywords in KIND_KEYWORDS:
+        if any(re.search(rf"\b{re.escape(keyword)}", label) for keyword in keywords):
+            return kind
+    return "other"
+
+def _clean_heading(line: str) -> str:
+    return line.strip().lstrip("#").strip().rstrip(":").strip()
+
+def split_brief(brief: str) -> List[Dict[str, Any]]:
+    """Split a brief into sections at its headings (markdown, "Label:" or ALL CAPS lines), or at paragraphs if it has none."""
+    raw = []
+    heading, lines = "", []
+    for line in (brief or "").strip().splitlines():
+        if HEADING.match(line.strip()) and len(line.split()) <= 8:
+            if lines or heading:
+                raw.append((heading, "\n".join(lines).strip()))
+            heading, lines = _clean_heading(line), []
+        else:
+            lines.append(line)
+    raw.append((heading, "\n".join(lines).strip()))
+
+    if not any(h for h, _ in raw):
+        raw = [("", paragraph) for paragraph in re.split(r"\n\s*\n", brief or "")]
+
+    sections = []
+    for heading, content in raw:
+        if not content.strip():
+            continue
+        parts = [content]
+        if estimate_tokens(content) > MAX_SECTION_TOKENS:
+            parts = [p for p in re.split(r"\n\s*\n", content) if p.strip()]
+        for part in parts:
+            part = part.strip()
+            sections.append({
+                "position": len(sections),
+                "heading": heading,
+                "kind": _kind(heading, part),
+                "content": part,
+                "tokens": estimate_tokens(f"{heading}:\n{part}\n\n"),
+            })
+    return sections
+
+def _terms(text: str) -> List[str]:
+    return [w for w in WORD.findall(text.lower()) if w not in STOPWORDS]
+
+class SectionIndex:
+    """TF-IDF vectors of one brief's sections."""
+
+    def __init__(self, sections: List[Dict[str, Any]]):
+        self.sections = sections
+        counts = [Counter(_terms(f"{s['heading']} {s['content']}")) for s in sections]
+        df = Counter(term for count in counts for term in count)
+        total = len(sections)
+        self.idf = {term: math.log((1 + total) / (1 + n)) + 1 for term, n in df.items()}
+        self.vectors = [self._vector(count) for count in counts]
+
+    def _vector(self, counts: Counter) -> Dict[str, float]:
+        vector = {term: n * self.idf.get(term, 0) for term, n in counts.items()}
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1
+        return {term: v / norm for term, v in vector.items()}
+
+    def similarities(self, query: str) -> List[float]:
+        q = self._vector(Counter(_terms(query or "")))
+        return [sum(weight * vector.get(term, 0) for term, weight in q.items()) for vector in self.vectors]
+
+# content hash -> index, in front of the brief_sections table
+_indexes: "OrderedDict[str, SectionIndex]" = OrderedDict()
+
+def _remember(content_hash: str, index: SectionIndex) -> SectionIndex:
+    _indexes[content_hash] = index
+    _indexes.move_to_end(content_hash)
+    while len(_indexes) > INDEX_MEMORY_MAX_ENTRIES:
+        _indexes.popitem(last=False)
+    return index
+
+def index_brief(brief: str) -> SectionIndex:
+    """Split and store a brief's sections once per distinct content; later calls reuse them."""
+    content_hash = brief_hash(brief)
+    if content_hash in _indexes:
+        _indexes.move_to_end(content_hash)
+        return _indexes[content_hash]
+
+    with db_manager.get_session() as session:
+        rows = session.query(BriefSection).filter(BriefSection.content_hash == content_hash)\
+            .order_by(BriefSection.position).all()
+        sections = [{"position": r.position, "heading": r.heading or "", "kind": r.kind,
+                     "content": r.content, "tokens": r.tokens or estimate_tokens(r.content)} for r in rows]
+
+    if not sections:
+        sections = split_brief(brief)
+        try:
+            with db_manager.get_session() as session:
+                for section in sections:
+                    session.add(BriefSection(content_hash=content_hash, **section))
+        except IntegrityError:
+            # Another run split the same brief first; both splits are identical
+            logger.info(f"Brief sections {content_hash[:12]} were stored concurrently")
+        logger.info(f"Split brief {content_hash[:12]} into {len(sections)} sections")
+
+    return _remember(content_hash, SectionIndex(sections))
+
+def stage_budget(stage: str) -> int:
+    return int(STAGE_BUDGETS.get(stage, DEFAULT_BUDGET))
+
+def select_sections(brief: str, stage: str, topic: Optional[str] = None) -> str:
+    """
+    The part of the brief a stage's prompt should carry: sections of the kinds the stage always
+    needs first, then the ones closest to the topic, in brief order and within the stage's budget.
+    """
+    budget = stage_budget(stage)
+    if not SECTIONS_ENABLED or not brief or estimate_tokens(brief) <= budget:
+        return brief
+
+    index = index_brief(brief)
+    wanted = STAGE_KINDS.get(stage, set())
+    similarities = index.similarities(topic)
+    ranked = sorted(
+        zip(index.sections, similarities),
+        key=lambda item: (-((1.0 if item[0]["kind"] in wanted else 0.0) + item[1]), item[0]["position"]),
+    )
+
+    chosen, used = [], 0
+    for section, _ in ranked:
+        if used + section["tokens"] <= budget:
+            chosen.append(section)
+            used += section["tokens"]
+    if not chosen:
+        # Nothing fits whole; the best section cut to the budget beats an empty brief
+        return ranked[0][0]["content"][:budget * 4] if ranked else brief[:budget * 4]
+
+    chosen.sort(key=lambda s: s["position"])
+    text, heading = [], None
+    for section in chosen:
+        if section["heading"] and section["heading"] != heading:
+            text.append(f"{section['heading']}:\n{section['content']}")
+        else:
+            text.append(section["content"])
+        heading = section["heading"]
+
+    record_brief_selection(stage, estimate_tokens(brief), used)
+    logger.info(f"Brief for {stage}: {len(chosen)} of {len(index.sections)} sections, ~{used} of ~{estimate_tokens(brief)} tokens")
+    return "\n\n".join(text)
+
+async def brief_for_stage(brief: str, stage: str, topic: Optional[str] = None) -> str:
+    """The brief text a stage's prompt should use: the digest for BRIEF_DIGEST_STAGES, otherwise the selected sections."""
+    if stage in DIGEST_STAGES:
+        return await get_brief_digest(brief)
+    try:
+        return select_sections(brief, stage, topic)
+    except Exception as e:
+        logger.error(f"Failed to select brief sections for {stage}, using the full brief: {e}")
+        return brief
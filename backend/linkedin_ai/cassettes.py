@@ -0,0 +1,291 @@
+"""
+Record and replay real LLM traffic.
+
+With LLM_RECORD_DIR set, every LLM call is appended to a JSONL cassette in that directory. Each
+entry holds the stage, the request, the response (or the API error) and the latency. A hedged
+call is one entry with the winning response, however many requests it sent. Emails, phone numbers, URLs, @handles and the current user's name are scrubbed from
+prompts and responses before anything is written. LLM_RECORD_RATE records only a share of calls.
+
+LLM_PROVIDER=replay serves a cassette back instead of calling the API. A request is answered by
+the recorded call with the same (scrubbed) request if there is one, otherwise by a recorded call
+of the same stage picked with LLM_REPLAY_SEED. Recorded latencies are kept, or divided by
+LLM_REPLAY_SPEED (0 answers at once). Benchmarks use it with --replay, so pipeline changes can be
+measured against real output lengths, malformed JSON and score distributions offline.
+"""
+import os
+import re
+import json
+import glob
+import time
+import random
+import asyncio
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+import openai
+from openai.types.chat import ChatCompletion
+from database import db_manager
+from models import User
+from .llm_cache import cache_key
+from .providers import LLM_PROVIDER, LLMProvider, FakeProvider, create_provider
+from .usage import current_user
+
+logger = logging.getLogger(__name__)
+
+RECORD_DIR = os.getenv("LLM_RECORD_DIR", "")
+# Share of calls recorded, to keep cassettes small on busy days
+RECORD_RATE = float(os.getenv("LLM_RECORD_RATE", 1.0))
+
+EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+URL = re.compile(r"https?://\S+|www\.\S+")
+HANDLE = re.compile(r"(?<![\w@])@\w{2,}")
+PHONE = re.compile(r"\+?\d[\d\s().-]{7,}\d")
+# Name parts shorter than this are too likely to be ordinary words
+MIN_NAME_LENGTH = 3
+
+# Set while a call is recorded above the hedger, so its hedged copies aren't recorded again
+_recording: ContextVar[bool] = ContextVar("llm_recording", default=False)
+
+# user id -> names and email scrubbed from that user's traffic
+_user_terms: Dict[str, List[str]] = {}
+
+def _terms_for(user_id: Optional[str]) -> List[str]:
+    if not user_id:
+        return []
+    if user_id not in _user_terms:
+        terms = []
+        try:
+            with db_manager.get_session() as session:
+                user = session.query(User).filter(User.id == user_id).first()
+                if user:
+                    terms = [t for t in (user.first_name, user.last_name, user.email) if t and len(t) >= MIN_NAME_LENGTH]
+        except Exception as e:
+            logger.warning(f"Could not load names to scrub for user {user_id}: {e}")
+        _user_terms[user_id] = terms
+    return _user_terms[user_id]
+
+def scrub(text: str, terms: List[str] = ()) -> str:
+    """Replace personal data in text with placeholders."""
+    if not text:
+        return text
+    # Emails and URLs first, so a name inside one doesn't leave the rest of it behind
+    text = EMAIL.sub("[EMAIL]", text)
+    text = URL.sub("[URL]", text)
+    for term in terms:
+        text = re.sub(rf"\b{re.escape(term)}\b", "[NAME]", text, flags=re.IGNORECASE)
+    text = HANDLE.sub("[HANDLE]", text)
+    # Only digit runs long enough to be phone numbers, not years or date ranges
+    return PHONE.sub(lambda m: "[PHONE]" if sum(c.isdigit() for c in m.group()) >= 9 else m.group(), text)
+
+def scrub_params(params: Dict[str, Any], terms: List[str] = ()) -> Dict[str, Any]:
+    messages = [dict(m, content=scrub(m["content"], terms)) if isinstance(m.get("content"), str) else m
+                for m in params.get("messages", [])]
+    return dict(params, messages=messages)
+
+class RecordingProvider(LLMProvider):
+    """Passes calls to another provider and appends each one to a cassette file."""
+
+    def __init__(self, inner: LLMProvider, directory: str = RECORD_DIR, rate: float = RECORD_RATE):
+        self.inner = inner
+        self.name = inner.name
+        self.rate = rate
+        os.makedirs(directory, exist_ok=True)
+        # One file per process and day, so workers never write to the same file
+        self.path = os.path.join(directory, f"{datetime.now(timezone.utc):%Y%m%d}-{os.getpid()}.jsonl")
+        logger.info(f"Recording LLM calls to {self.path}")
+
+    def _write(self, stage: Optional[str], params: Dict[str, Any], latency: float, stream: bool = False,
+               response: Optional[ChatCompletion] = None, text: Optional[str] = None,
+               error: Optional[Exception] = None, first_token: Optional[float] = None):
+        try:
+            terms = _terms_for(current_user.get())
+            scrubbed = scrub_params(params, terms)
+            entry = {
+                "stage": stage,
+                "key": cache_key(scrubbed),
+                "params": scrubbed,
+                "stream": stream,
+                "latency": round(latency, 4),
+                "recorded_at": datetime.now(timezone.utc).isoformat(),
+            }
+            if response is not None:
+                entry["response"] = response.model_dump(mode="json")
+                for choice in entry["response"].get("choices", []):
+                    message = choice.get("message") or {}
+                    message["content"] = scrub(message.get("content"), terms)
+            if text is not None:
+                entry["text"] = scrub(text, terms)
+                entry["first_token"] = round(first_token or latency, 4)
+            if error is not None:
+                entry["error"] = {"type": type(error).__name__, "status": getattr(error, "status_code", None),
+                                  "message": scrub(str(error), terms)[:500]}
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        except Exception as e:
+            logger.warning(f"Failed to record {stage} call: {e}")
+
+    async def record(self, stage: Optional[str], params: Dict[str, Any], call: Callable[[], Awaitable[ChatCompletion]]) -> ChatCompletion:
+        """Await call() and record it as one call, however many hedged requests it sends."""
+        token = _recording.set(True)
+        try:
+            if random.random() >= self.rate:
+                return await call()
+            started = time.perf_counter()
+            try:
+                response = await call()
+            except openai.APIStatusError as e:
+                self._write(stage, params, time.perf_counter() - started, error=e)
+                raise
+            self._write(stage, params, time.perf_counter() - started, response=response)
+            return response
+        finally:
+            _recording.reset(token)
+
+    async def complete(self, params: Dict[str, Any], stage: Optional[str] = None) -> ChatCompletion:
+        if _recording.get():
+            return await self.inner.complete(params, stage=stage)
+        return await self.record(stage, params, lambda: self.inner.complete(params, stage=stage))
+
+    async def stream(self, params: Dict[str, Any], stage: Optional[str] = None) -> AsyncIterator[str]:
+        if random.random() >= self.rate:
+            return await self.inner.stream(params, stage=stage)
+        started = time.perf_counter()
+        try:
+            deltas = await self.inner.stream(params, stage=stage)
+        except openai.APIStatusError as e:
+            self._write(stage, params, time.perf_counter() - started, stream=True, error=e)
+            raise
+        return self._recorded(deltas, stage, params, started)
+
+    async def _recorded(self, deltas: AsyncIterator[str], stage: Optional[str], params: Dict[str, Any], started: float) -> AsyncIterator[str]:
+        parts, first_token = [], None
+        async for delta in deltas:
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            parts.append(delta)
+            yield delta
+        self._write(stage, params, time.perf_counter() - started, stream=True, text="".join(parts), first_token=first_token)
+
+async def recorded(provider: LLMProvider, stage: Optional[str], params: Dict[str, Any],
+                   call: Callable[[], Awaitable[ChatCompletion]]) -> ChatCompletion:
+    """Await call(), recording it once when `provider` is a RecordingProvider."""
+    if isinstance(provider, RecordingProvider):
+        return await provider.record(stage, params, call)
+    return await call()
+
+def load_cassettes(path: str) -> List[Dict[str, Any]]:
+    """Entries of a cassette file, or of every *.jsonl file in a directory."""
+    files = sorted(glob.glob(os.path.join(path, "*.jsonl"))) if os.path.isdir(path) else [path]
+    entries = []
+    for file in files:
+        with open(file) as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    return entries
+
+class ReplayProvider(LLMProvider):
+    """Answers from recorded calls, with their recorded latency divided by `speed`."""
+
+    name = "replay"
+
+    def __init__(self, entries: List[Dict[str, Any]], speed: float = 1.0, seed: int = 0, errors: bool = True):
+        if not errors:
+            entries = [e for e in entries if not e.get("error")]
+        if not entries:
+            raise ValueError("The cassette has no calls to replay")
+        self.speed = speed
+        self._rng = random.Random(seed)
+        self._by_key: Dict[str, List[Dict[str, Any]]] = {}
+        self._by_stage: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        self._next: Dict[str, int] = {}
+        for entry in entries:
+            self._by_key.setdefault(entry["key"], []).append(entry)
+            self._by_stage.setdefault(entry.get("stage"), []).append(entry)
+        self.calls = 0
+        self.exact_hits = 0
+
+    @classmethod
+    def from_env(cls) -> "ReplayProvider":
+        path = os.getenv("LLM_REPLAY_PATH") or RECORD_DIR
+        if not path:
+            raise ValueError("LLM_PROVIDER=replay needs LLM_REPLAY_PATH (a cassette file or directory)")
+        entries = load_cassettes(path)
+        logger.warning(f"Replaying {len(entries)} recorded LLM calls from {path}; no real model is called")
+        return cls(
+            entries,
+            speed=float(os.getenv("LLM_REPLAY_SPEED", 1)),
+            seed=int(os.getenv("LLM_REPLAY_SEED", 0)),
+            errors=os.getenv("LLM_REPLAY_ERRORS", "true").lower() == "true",
+        )
+
+    def _pick(self, params: Dict[str, Any], stage: Optional[str]) -> Dict[str, Any]:
+        self.calls += 1
+        key = cache_key(scrub_params(params, _terms_for(current_user.get())))
+        same_request = self._by_key.get(key)
+        if same_request:
+            # Repeats of one request get its recorded answers in order, e.g. a 429 then the retry's success
+            index = self._next.get(key, 0)
+            self._next[key] = index + 1
+            self.exact_hits += 1
+            return same_request[index % len(same_request)]
+        same_stage = self._by_stage.get(stage)
+        if not same_stage:
+            raise LookupError(f"The cassette has no recorded {stage} calls")
+        return self._rng.choice(same_stage)
+
+    async def _wait(self, seconds: float):
+        if self.speed > 0 and seconds > 0:
+            await asyncio.sleep(seconds / self.speed)
+
+    @staticmethod
+    def _raise(error: Dict[str, Any]):
+        status = error.get("status") or 500
+        error_class = {400: openai.BadRequestError, 429: openai.RateLimitError}.get(
+            status, openai.InternalServerError if status >= 500 else openai.APIStatusError)
+        raise FakeProvider._error(error_class, status, f"Replayed: {error.get('message', '')}")
+
+    @staticmethod
+    def _text(entry: Dict[str, Any]) -> str:
+        if "text" in entry:
+            return entry["text"]
+        return entry["response"]["choices"][0]["message"].get("content") or ""
+
+    async def complete(self, params: Dict[str, Any], stage: Optional[str] = None) -> ChatCompletion:
+        entry = self._pick(params, stage)
+        await self._wait(entry.get("latency", 0))
+        if entry.get("error"):
+            self._raise(entry["error"])
+        if "response" in entry:
+            return ChatCompletion.model_validate(entry["response"])
+        # A recorded stream answering a non-streaming request
+        return ChatCompletion.model_validate({
+            "id": f"replay-{self.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": params.get("model", "replay"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": self._text(entry)}}],
+        })
+
+    async def stream(self, params: Dict[str, Any], stage: Optional[str] = None) -> AsyncIterator[str]:
+        entry = self._pick(params, stage)
+        latency = entry.get("latency", 0)
+        first_token = entry.get("first_token", latency)
+        await self._wait(first_token)
+        if entry.get("error"):
+            self._raise(entry["error"])
+        return self._words(self._text(entry), max(0.0, latency - first_token))
+
+    async def _words(self, text: str, seconds: float) -> AsyncIterator[str]:
+        words = text.split(" ")
+        for i, word in enumerate(words):
+            await self._wait(seconds / len(words))
+            yield word if i == 0 else " " + word
+
+def build_provider(name: str = LLM_PROVIDER) -> LLMProvider:
+    """The provider for LLM_PROVIDER (openai, fake or replay), recording to LLM_RECORD_DIR when it is set."""
+    if name == "replay":
+        return ReplayProvider.from_env()
+    provider = create_provider(name)
+    if RECORD_DIR:
+        return RecordingProvider(provider)
+    return provider
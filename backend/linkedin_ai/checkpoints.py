@@ -0,0 +1,92 @@
+import json
+import logging
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+from database import db_manager
+from models import PipelineRun, PipelineRunStage
+
+logger = logging.getLogger(__name__)
+
+# Pipeline results that leave the run resumable: crashes, and posts that were saved but not delivered
+RESUMABLE_STATUSES = ("error", "partial_success")
+
+# Id of the pipeline run the current task belongs to, for code below the pipeline (e.g. batch requests)
+current_run: ContextVar[Optional[str]] = ContextVar("current_pipeline_run", default=None)
+
+class RunCheckpoints:
+    """
+    Stage outputs of one pipeline run, saved to pipeline_run_stages as each stage completes.
+
+    Opening the checkpoints of an unfinished run loads what it already produced, so
+    `run(...)` returns stored outputs instead of paying for the same LLM calls again.
+    """
+
+    def __init__(self, run_id: str, outputs: Dict[str, Any] = None, resumed: bool = False):
+        self.run_id = run_id
+        self.outputs = outputs or {}
+        self.resumed = resumed
+
+    @classmethod
+    def open(cls, user_id: str, manual_topic: Optional[str] = None, brief_type: str = "active",
+             job_id: Optional[str] = None, run_id: Optional[str] = None) -> "RunCheckpoints":
+        """Resume the given run (or the job's unfinished run), otherwise start a new one."""
+        with db_manager.get_session() as session:
+            query = session.query(PipelineRun).filter(PipelineRun.user_id == user_id, PipelineRun.status != "completed")
+            run = None
+            if run_id:
+                run = query.filter(PipelineRun.id == run_id).first()
+            elif job_id:
+                run = query.filter(PipelineRun.job_id == job_id).order_by(PipelineRun.created_at.desc()).first()
+
+            if run:
+                run.status = "running"
+                run.attempts += 1
+                outputs = {stage.stage: json.loads(stage.output) for stage in run.stages}
+                logger.info(f"Resuming pipeline run {run.id} (attempt {run.attempts}) with stages: {list(outputs)}")
+                current_run.set(run.id)
+                return cls(run.id, outputs, resumed=True)
+
+            if run_id:
+                logger.warning(f"Pipeline run {run_id} is finished or unknown, starting a new run")
+            run = PipelineRun(user_id=user_id, job_id=job_id, manual_topic=manual_topic, brief_type=brief_type)
+            session.add(run)
+            session.flush()
+            current_run.set(run.id)
+            return cls(run.id)
+
+    def has(self, stage: str) -> bool:
+        return stage in self.outputs
+
+    def get(self, stage: str, default: Any = None) -> Any:
+        return self.outputs.get(stage, default)
+
+    def save(self, stage: str, output: Any):
+        # Round-trip through JSON so a fresh value looks exactly like a resumed one
+        encoded = json.dumps(output, default=str)
+        self.outputs[stage] = json.loads(encoded)
+        with db_manager.get_session() as session:
+            session.add(PipelineRunStage(run_id=self.run_id, stage=stage, output=encoded))
+
+    async def run(self, stage: str, func: Callable, *args, **kwargs) -> Any:
+        """Return the stored output of `stage`, or await func(*args, **kwargs) and store it. None is never stored."""
+        if stage in self.outputs:
+            logger.info(f"Run {self.run_id}: reusing checkpoint for {stage}")
+            return self.outputs[stage]
+
+        output = await func(*args, **kwargs)
+        if output is not None:
+            self.save(stage, output)
+            return self.outputs[stage]
+        return output
+
+    def finish(self, result: Dict[str, Any]):
+        """Mark the run completed, or failed so the next attempt can resume it."""
+        status = "failed" if result.get("status") in RESUMABLE_STATUSES else "completed"
+        try:
+            with db_manager.get_session() as session:
+                run = session.query(PipelineRun).filter(PipelineRun.id == self.run_id).first()
+                if run:
+                    run.status = status
+                    run.result = json.dumps(result, default=str)
+        except Exception as e:
+            logger.error(f"Failed to record outcome of pipeline run {self.run_id}: {e}")
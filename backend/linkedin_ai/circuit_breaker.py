@@ -0,0 +1,128 @@
+"""
+Circuit breakers for the pipeline's external dependencies (OpenAI, Notion, Make).
+
+After FAILURE_THRESHOLD failures in a row a breaker opens and calls fail at once with
+CircuitOpenError instead of waiting on a dead service. After RESET_TIMEOUT seconds it lets one
+probe through (half-open); a successful probe closes it again and a failed one re-opens it.
+State is per process, like the hedge budget. The calls run in run_worker and run_cron, so the
+state is exposed through the relay_circuit_state gauge (the worst state across processes) on
+/metrics rather than by the web process.
+"""
+import os
+import time
+import logging
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+from metrics import record_circuit_state, record_circuit_rejection
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Consecutive failures that open a breaker
+FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+# Seconds an open breaker waits before letting a probe through
+RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 60))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose breaker is open"""
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"Circuit breaker for {name} is open, retry in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.last_error: Optional[str] = None
+        self._probing = False
+        self._lock = threading.Lock()
+        record_circuit_state(name, CLOSED)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"Circuit breaker for {self.name}: {self.state} -> {state}")
+            self.state = state
+            record_circuit_state(self.name, state)
+
+    def retry_in(self) -> float:
+        """Seconds until an open breaker lets a probe through."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now; in half-open state only one probe at a time does."""
+        with self._lock:
+            if self.state == OPEN and self.retry_in() <= 0:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state(CLOSED)
+
+    def record_failure(self, error: Any = None):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error) if error is not None else None
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+            self._probing = False
+
+    def check(self):
+        """Raise CircuitOpenError unless a call may go ahead now."""
+        if not self.allow():
+            record_circuit_rejection(self.name)
+            raise CircuitOpenError(self.name, self.retry_in())
+
+    async def call(self, func: Callable[[], Awaitable[Any]], is_failure: Callable[[Exception], bool] = lambda e: True) -> Any:
+        """
+        Await func() through the breaker. Exceptions for which is_failure() is False (e.g. a bad
+        request) mean the dependency is up, so they don't count against it.
+        """
+        self.check()
+        try:
+            result = await func()
+        except Exception as e:
+            if is_failure(e):
+                self.record_failure(e)
+            else:
+                self.record_success()
+            raise
+        except BaseException:
+            # Cancelled (e.g. a lost hedge); says nothing about the dependency
+            with self._lock:
+                self._probing = False
+            raise
+        self.record_success()
+        return result
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_in": round(self.retry_in(), 1),
+            "last_error": self.last_error,
+        }
+
+breakers: Dict[str, CircuitBreaker] = {name: CircuitBreaker(name) for name in ("openai", "notion", "make")}
+
+def get_breaker(name: str) -> CircuitBreaker:
+    return breakers[name]
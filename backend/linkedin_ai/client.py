@@ -1,9 +1,100 @@
-from openai import AsyncOpenAI
+import time
+import asyncio
+from typing import Any, Callable, Optional
+import openai
 from dotenv import load_dotenv
-import os
+from .llm_cache import llm_cache
+from .rate_limiter import rate_limiter, estimate_tokens
+from .hedging import hedger, with_deadline
+from .circuit_breaker import get_breaker
+from .batch import current_batch
+from .usage import record_response, record_stream
+from .providers import LLMProvider
+from .cassettes import build_provider, recorded
 
 # Load environment variables
 load_dotenv()
 
-# Single OpenAI client instance
-client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
\ No newline at end of file
+# Backend every stage's LLM calls go to (LLM_PROVIDER=openai|fake|replay, recorded when LLM_RECORD_DIR is set).
+# The OpenAI client is only built when LLM_PROVIDER=openai (see providers.openai_client).
+_provider: LLMProvider = build_provider()
+
+openai_breaker = get_breaker("openai")
+
+def _is_outage(error: Exception) -> bool:
+    """Errors that say the API is down; rate limits and bad requests don't trip the breaker."""
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError, asyncio.TimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+def get_provider() -> LLMProvider:
+    return _provider
+
+def set_provider(provider: LLMProvider) -> LLMProvider:
+    """Swap the LLM backend (e.g. a FakeProvider in benchmarks) and return the previous one."""
+    global _provider
+    previous, _provider = _provider, provider
+    return previous
+
+async def complete(stage: str, use_cache: bool = False, cache_ttl: Optional[int] = None,
+                   cache_validate: Optional[Callable[[Any], Any]] = None, **params):
+    """
+    Chat completion for a pipeline stage; every non-streaming LLM call in linkedin_ai goes through here.
+
+    Deterministic stages (scoring, evaluation) pass use_cache=True so identical requests are
+    answered from the LLM cache. Creative stages leave it off to get fresh output. cache_validate,
+    usually the caller's parser, keeps completions it raises on out of the cache.
+
+    Real-time calls fail with asyncio.TimeoutError after the stage's deadline and may be hedged
+    (see linkedin_ai.hedging). Billed calls are recorded in the usage ledger (linkedin_ai.usage).
+    """
+    batch = current_batch()
+
+    async def create():
+        started = time.perf_counter()
+        # Batch mode (scheduled runs) queues the request for the next batch instead of calling the API now
+        if batch:
+            response = await batch.request(params, stage=stage)
+            record_response(stage, params, response, time.perf_counter() - started, source="batch")
+            return response
+        # A hedged duplicate still takes its share of the rate limits
+        send = lambda: openai_breaker.call(lambda: _provider.complete(params, stage=stage), is_failure=_is_outage)
+        hedged = lambda: hedger.run(stage, send,
+                                    before_hedge=lambda: rate_limiter.acquire(estimate_tokens(params)))
+        # Recorded above the hedger, so a hedged duplicate isn't a second cassette entry
+        attempt = lambda: recorded(_provider, stage, params, hedged)
+        response = await with_deadline(stage, rate_limiter.call(attempt, params, stage=stage))
+        record_response(stage, params, response, time.perf_counter() - started)
+        return response
+
+    if use_cache:
+        return await llm_cache.get_or_create(params, create, stage=stage, ttl=cache_ttl, validate=cache_validate,
+                                             provider=_provider.name)
+    return await create()
+
+async def stream_completion(on_chunk: Callable[[str], None], stage: Optional[str] = None, **params) -> str:
+    """Run a chat completion with stream=True, passing each text delta to on_chunk and returning the full text."""
+    batch = current_batch()
+    started = time.perf_counter()
+    if batch:
+        # Batches can't stream; the whole text arrives as one chunk
+        response = await batch.request(params, stage=stage)
+        record_response(stage, params, response, time.perf_counter() - started, source="batch")
+        text = response.choices[0].message.content or ""
+        on_chunk(text)
+        return text
+
+    async def consume() -> str:
+        # Errors such as 429 arrive before the first chunk, so only opening the stream is retried
+        open_stream = lambda: openai_breaker.call(lambda: _provider.stream(params, stage=stage), is_failure=_is_outage)
+        deltas = await rate_limiter.call(open_stream, params, stage=stage)
+        parts = []
+        async for delta in deltas:
+            parts.append(delta)
+            on_chunk(delta)
+        text = "".join(parts)
+        record_stream(stage, params, text, time.perf_counter() - started)
+        return text
+
+    # Half-streamed text can't be swapped for a faster copy, so streams get a deadline but no hedging
+    return await with_deadline(stage, consume())
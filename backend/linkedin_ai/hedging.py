@@ -0,0 +1,128 @@
+"""
+Per-stage deadlines and hedged requests for LLM calls.
+
+Every real-time call made through client.complete / stream_completion is bounded by its stage's
+deadline, so one stuck completion can't stall a run for minutes. With LLM_HEDGE=true a
+non-streaming request that hasn't answered by its stage's observed p95 latency is sent a second
+time. Whichever response comes first wins and the other is cancelled. Hedges spend from a budget
+of LLM_HEDGE_BUDGET per request, so they can add at most that share of extra calls.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+from metrics import record_llm_hedge, record_llm_deadline
+
+logger = logging.getLogger(__name__)
+
+# Seconds a stage's LLM call (retries included) may take before it fails with a timeout
+DEFAULT_DEADLINES = {
+    "generate_best_topic": 60,
+    "score_topics": 45,
+    "generate_post": 90,
+    "rewrite_post": 90,
+    "rewrite_post_edits": 45,
+    "evaluate_post": 60,
+    "evaluate_post_cheap": 30,
+    "generate_punchline": 30,
+    "brief_digest": 90,
+}
+DEFAULT_DEADLINE = float(os.getenv("LLM_DEFAULT_DEADLINE", 120))
+# JSON object of stage -> seconds overriding the defaults above, e.g. {"generate_post": 45}
+STAGE_DEADLINES = {**DEFAULT_DEADLINES, **json.loads(os.getenv("LLM_STAGE_DEADLINES", "{}"))}
+
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "false").lower() == "true"
+# Extra requests allowed per request made; 0.05 caps hedging at 5% more calls
+HEDGE_BUDGET = float(os.getenv("LLM_HEDGE_BUDGET", 0.05))
+# Unspent budget can build up to this many hedges for a burst of slow calls
+HEDGE_BURST = float(os.getenv("LLM_HEDGE_BURST", 10))
+# Latencies remembered per stage, and how many are needed before its p95 is trusted
+LATENCY_WINDOW = int(os.getenv("LLM_HEDGE_WINDOW", 200))
+MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+HEDGE_PERCENTILE = 0.95
+
+def stage_deadline(stage: Optional[str]) -> float:
+    return float(STAGE_DEADLINES.get(stage, DEFAULT_DEADLINE))
+
+class Hedger:
+    """Rolling per-stage latencies and the hedge budget shared by every call in the process."""
+
+    def __init__(self, enabled: bool = HEDGE_ENABLED, budget: float = HEDGE_BUDGET, burst: float = HEDGE_BURST,
+                 window: int = LATENCY_WINDOW, min_samples: int = MIN_SAMPLES):
+        self.enabled = enabled
+        self.budget = budget
+        self.burst = burst
+        self.window = window
+        self.min_samples = min_samples
+        self.credit = 0.0
+        self._latencies: Dict[str, Deque[float]] = {}
+
+    def observe(self, stage: str, seconds: float):
+        self._latencies.setdefault(stage, deque(maxlen=self.window)).append(seconds)
+
+    def hedge_delay(self, stage: str) -> Optional[float]:
+        """Observed p95 latency of the stage, or None while there are too few samples."""
+        samples = self._latencies.get(stage)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * HEDGE_PERCENTILE))]
+
+    def _take_credit(self) -> bool:
+        if self.credit >= 1:
+            self.credit -= 1
+            return True
+        return False
+
+    async def run(self, stage: str, create: Callable[[], Awaitable[Any]],
+                  before_hedge: Optional[Callable[[], Awaitable[None]]] = None) -> Any:
+        """Await create(), starting a second create() if the first is slower than the stage's p95."""
+        self.credit = min(self.burst, self.credit + self.budget)
+        started = time.perf_counter()
+        delay = self.hedge_delay(stage) if self.enabled else None
+
+        primary = asyncio.ensure_future(create())
+        tasks = {primary}
+        hedged = False
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self._take_credit():
+                    if before_hedge:
+                        await before_hedge()
+                    if not primary.done():
+                        logger.info(f"{stage} call slower than its p95 ({delay:.1f}s), sending a hedged request")
+                        tasks.add(asyncio.ensure_future(create()))
+                        hedged = True
+
+            # The first success wins; a failure only counts once every copy has failed
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.observe(stage, time.perf_counter() - started)
+                        if hedged:
+                            record_llm_hedge(stage, "primary" if task is primary else "hedge")
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+async def with_deadline(stage: Optional[str], awaitable: Awaitable[Any]) -> Any:
+    """Await `awaitable`, failing with asyncio.TimeoutError once the stage's deadline passes."""
+    deadline = stage_deadline(stage)
+    try:
+        return await asyncio.wait_for(awaitable, timeout=deadline)
+    except asyncio.TimeoutError:
+        record_llm_deadline(stage or "unknown")
+        logger.error(f"{stage or 'LLM'} call missed its {deadline:.0f}s deadline")
+        raise
+
+# Global instance
+hedger = Hedger()
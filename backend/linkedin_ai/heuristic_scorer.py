@@ -0,0 +1,181 @@
+import os
+import re
+import random
+import logging
+from typing import Any, Dict, List, Optional, Tuple, Union
+from thefuzz import fuzz
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from metrics import timed_stage, record_heuristic_decision
+from .post_evaluator import evaluate_with_cascade, EVALUATION_JUDGE
+from .judge_agreement import record_agreement
+
+logger = logging.getLogger(__name__)
+
+# "off": always ask the LLM judge; "shadow": score locally and record agreement but always ask the judge;
+# "on": rejected (and, with HEURISTIC_FAST_TRACK_AT set, fast-tracked) drafts skip the judge.
+# Defaults to shadow so agreement with the judge is measured before any draft skips it.
+HEURISTIC_MODE = os.getenv("HEURISTIC_MODE", "shadow")
+# Local scores below this are rejected without asking the judge
+REJECT_BELOW = float(os.getenv("HEURISTIC_REJECT_BELOW", 4))
+# Local scores at or above this are accepted without asking the judge; unset never fast-tracks
+FAST_TRACK_AT = float(os.getenv("HEURISTIC_FAST_TRACK_AT")) if os.getenv("HEURISTIC_FAST_TRACK_AT") else None
+# Share of short-circuited drafts still sent to the judge, so agreement keeps being measured
+AUDIT_RATE = float(os.getenv("HEURISTIC_AUDIT_RATE", 0.1))
+
+SCORER_NAME = "heuristic"
+LINKEDIN_MAX_CHARS = 3000
+MIN_WORDS = 50
+MAX_WORDS = 350
+MAX_PARAGRAPH_WORDS = 80
+MAX_HASHTAGS = 5
+# LinkedIn cuts posts off after roughly this many characters ("...see more")
+HOOK_MAX_CHARS = 200
+# A rewrite this similar to the previous version is not worth judging again
+NEAR_IDENTICAL_RATIO = 98
+
+CTA_PHRASES = (
+    "comment", "share", "let me know", "what do you think", "thoughts", "follow", "dm me",
+    "reach out", "tell me", "join", "agree", "your take", "repost", "save this",
+)
+MARKDOWN = re.compile(r"^\s*(#{1,6}\s|\*\*|title:)|\*\*", re.IGNORECASE | re.MULTILINE)
+HASHTAG = re.compile(r"(?<!\w)#\w+")
+
+_sentiment = SentimentIntensityAnalyzer()
+
+def _topic_text(topic: Union[str, Dict[str, Any]]) -> str:
+    return topic.get("topic", "") if isinstance(topic, dict) else (topic or "")
+
+@timed_stage("heuristic_score")
+def score_post(post: str, brand_brief: str = "", topic: Union[str, Dict[str, Any]] = "", previous_post: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Score a post 0-10 from local checks only (structure, length, hook, CTA, sentiment and
+    similarity to the topic, brief and previous version).
+
+    Returns {"score", "decision", "issues", "checks"}; decision is "reject", "accept" or "judge".
+    """
+    post = (post or "").strip()
+    if not post:
+        return {"score": 0.0, "decision": "reject", "issues": ["The post is empty."], "checks": {}}
+
+    issues: List[str] = []
+    hard_fail = False
+    penalty = 0.0
+
+    words = len(post.split())
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", post) if p.strip()]
+    first_line = post.splitlines()[0].strip()
+    last_paragraph = paragraphs[-1].lower()
+    hashtags = len(HASHTAG.findall(post))
+    sentiment = _sentiment.polarity_scores(post)["compound"]
+    topic_similarity = fuzz.token_set_ratio(_topic_text(topic).lower(), post.lower()) if _topic_text(topic) else None
+    brief_similarity = fuzz.token_set_ratio(brand_brief.lower(), post.lower()) if brand_brief else None
+    previous_similarity = fuzz.ratio(previous_post, post) if previous_post else None
+
+    if len(post) > LINKEDIN_MAX_CHARS:
+        hard_fail = True
+        issues.append(f"The post is {len(post)} characters; LinkedIn allows {LINKEDIN_MAX_CHARS}. Cut it down substantially.")
+    if previous_similarity is not None and previous_similarity >= NEAR_IDENTICAL_RATIO:
+        hard_fail = True
+        issues.append("The rewrite is almost identical to the previous version; make substantive changes.")
+
+    if words < MIN_WORDS:
+        penalty += 4
+        issues.append(f"The post is only {words} words; develop the idea to at least {MIN_WORDS}.")
+    elif words > MAX_WORDS:
+        penalty += 2
+        issues.append(f"The post is {words} words; tighten it to under {MAX_WORDS}.")
+
+    if len(paragraphs) < 3:
+        penalty += 1.5
+        issues.append("The post reads as a wall of text; split it into short paragraphs.")
+    elif any(len(p.split()) > MAX_PARAGRAPH_WORDS for p in paragraphs):
+        penalty += 1
+        issues.append(f"Some paragraphs are over {MAX_PARAGRAPH_WORDS} words; break them up.")
+
+    if MARKDOWN.search(post):
+        penalty += 1
+        issues.append("Remove titles and markdown formatting; LinkedIn shows them literally.")
+    if hashtags > MAX_HASHTAGS:
+        penalty += 1
+        issues.append(f"Use at most {MAX_HASHTAGS} hashtags (found {hashtags}).")
+
+    if len(first_line) > HOOK_MAX_CHARS:
+        penalty += 1.5
+        issues.append("The opening line is too long to work as a hook above the 'see more' cut-off.")
+    elif len(first_line.split()) > 20:
+        penalty += 0.5
+        issues.append("Shorten the opening line into a punchier hook.")
+
+    if "?" not in last_paragraph and not any(phrase in last_paragraph for phrase in CTA_PHRASES):
+        penalty += 1.5
+        issues.append("End with a clear call to action or question for the reader.")
+
+    if sentiment < -0.5:
+        penalty += 1
+        issues.append("The tone is strongly negative; reframe it constructively.")
+
+    if topic_similarity is not None and topic_similarity < 40:
+        penalty += 1.5
+        issues.append("The post drifts away from its topic.")
+    if brief_similarity is not None and brief_similarity < 30:
+        penalty += 1
+        issues.append("The post has little in common with the brand brief.")
+
+    score = 0.0 if hard_fail else round(max(0.0, 10.0 - penalty), 1)
+    if hard_fail or score < REJECT_BELOW:
+        decision = "reject"
+    elif FAST_TRACK_AT is not None and score >= FAST_TRACK_AT:
+        decision = "accept"
+    else:
+        decision = "judge"
+
+    return {
+        "score": score,
+        "decision": decision,
+        "issues": issues,
+        "checks": {
+            "words": words,
+            "paragraphs": len(paragraphs),
+            "hashtags": hashtags,
+            "sentiment": sentiment,
+            "topic_similarity": topic_similarity,
+            "brief_similarity": brief_similarity,
+            "previous_similarity": previous_similarity,
+        },
+    }
+
+async def screen_and_evaluate(post: str, brand_brief: str, topic: Union[str, Dict[str, Any]], brief_type: str = "personal",
+                              previous_post: Optional[str] = None, previous_score: Optional[float] = None,
+                              pass_score: float = 7) -> Tuple[int, str, str]:
+    """
+    Drop-in replacement for evaluate_post that runs the local checks before the LLM cascade.
+
+    Clearly broken drafts are rejected (and very clean ones fast-tracked, if enabled) without an
+    LLM call; their issues become the rewrite feedback. Whenever the judge does run, its score is
+    compared with the local verdict and the agreement is recorded.
+    """
+    if HEURISTIC_MODE == "off":
+        return await evaluate_with_cascade(post, brand_brief, topic, brief_type, pass_score)
+
+    verdict = score_post(post, brand_brief, topic, previous_post)
+    record_heuristic_decision(verdict["decision"])
+
+    short_circuit = HEURISTIC_MODE == "on" and verdict["decision"] in ("reject", "accept")
+    if short_circuit and random.random() >= AUDIT_RATE:
+        score = int(verdict["score"])
+        near_identical = (verdict["checks"].get("previous_similarity") or 0) >= NEAR_IDENTICAL_RATIO
+        if near_identical and previous_score is not None:
+            # The text barely changed, so neither did its quality
+            score = int(previous_score)
+        if verdict["decision"] == "reject":
+            feedback = " ".join(verdict["issues"])
+            reasoning = "Rejected by local checks before LLM evaluation."
+        else:
+            feedback = "The post passed every local check."
+            reasoning = "Fast-tracked by local checks without LLM evaluation."
+        logger.info(f"Heuristic {verdict['decision']} (score {verdict['score']}) without LLM evaluation: {verdict['issues']}")
+        return score, feedback, reasoning
+
+    score, feedback, reasoning = await evaluate_with_cascade(post, brand_brief, topic, brief_type, pass_score)
+    record_agreement(SCORER_NAME, EVALUATION_JUDGE, verdict["decision"], verdict["score"], score, pass_score)
+    return score, feedback, reasoning
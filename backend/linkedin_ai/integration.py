@@ -1,8 +1,11 @@
 from datetime import datetime, timezone
+import asyncio
 import aiohttp
 import logging
 import os
 from dotenv import load_dotenv
+from metrics import timed_stage
+from .circuit_breaker import get_breaker, CircuitOpenError
 
 load_dotenv()  # Load environment variables from .env
 
@@ -10,6 +13,11 @@ MAKE_WEBHOOK_URL = os.getenv("MAKE_WEBHOOK_URL")
 NOTION_API_KEY = os.getenv("NOTION_API_KEY")
 NOTION_DATABASE_ID = os.getenv("NOTION_DATABASE_ID")
 NOTION_VERSION = os.getenv("NOTION_API_VERSION", "2022-06-28")
+# Overridable so benchmarks can point Notion calls at a local stand-in
+NOTION_API_URL = os.getenv("NOTION_API_URL", "https://api.notion.com/v1")
+# Request timeouts (seconds), kept below the pipeline's stage timeouts so a hung call counts against the breaker
+NOTION_REQUEST_TIMEOUT = float(os.getenv("NOTION_REQUEST_TIMEOUT", 30))
+MAKE_REQUEST_TIMEOUT = float(os.getenv("MAKE_REQUEST_TIMEOUT", 20))
 
 # Validate required variables
 _missing = []
@@ -28,6 +36,21 @@ headers = {
     "Notion-Version": NOTION_VERSION
 }
 
+notion_breaker = get_breaker("notion")
+make_breaker = get_breaker("make")
+
+class DependencyError(Exception):
+    """The service answered with a status that means it is unavailable (429 or 5xx)"""
+    pass
+
+def _unavailable(status: int) -> bool:
+    return status == 429 or status >= 500
+
+# Failures that mean the service is down rather than that it refused the post; they are raised to
+# the caller, which can defer the delivery. Any other failure is logged and returned as False.
+OUTAGE_ERRORS = (CircuitOpenError, DependencyError, aiohttp.ClientError, asyncio.TimeoutError)
+
+@timed_stage("make")
 async def send_to_make(result: dict):
     # Handle both dict and string topic formats
     topic = result.get("topic", "")
@@ -40,21 +63,31 @@ async def send_to_make(result: dict):
     }
 
     logging.info(f"Sending to Make: {payload}")
-    
-    try:
-        async with aiohttp.ClientSession() as session:
+
+    async def post() -> bool:
+        timeout = aiohttp.ClientTimeout(total=MAKE_REQUEST_TIMEOUT)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
             async with session.post(MAKE_WEBHOOK_URL, json=payload) as resp:
                 if resp.status != 200:
                     text = await resp.text()
                     logging.error(f"Make error: {resp.status}, {text}")
+                    if _unavailable(resp.status):
+                        raise DependencyError(f"Make returned {resp.status}")
                     return False
                 else:
                     logging.info("Make success")
                     return True
+
+    try:
+        return await make_breaker.call(post)
+    except OUTAGE_ERRORS:
+        # Left to the caller, which can defer the delivery
+        raise
     except Exception as e:
         logging.exception(f"Make integration failed: {e}")
         return False
 
+@timed_stage("notion")
 async def save_to_notion(result: dict, is_manual: bool = False):
     # Handle both dict and string topic formats
     topic = result.get('topic', 'Untitled')
@@ -83,17 +116,25 @@ async def save_to_notion(result: dict, is_manual: bool = False):
         }
     }
 
-    try:
-        timeout = aiohttp.ClientTimeout(total=30)
+    async def post() -> bool:
+        timeout = aiohttp.ClientTimeout(total=NOTION_REQUEST_TIMEOUT)
         async with aiohttp.ClientSession(timeout = timeout) as session:
-            async with session.post("https://api.notion.com/v1/pages", headers=headers, json=notion_payload) as resp:
+            async with session.post(f"{NOTION_API_URL}/pages", headers=headers, json=notion_payload) as resp:
                 text = await resp.text()
                 if resp.status not in (200, 201):
                     logging.error(f"Notion error: {resp.status}, {text}\nPayload: {notion_payload}")
+                    if _unavailable(resp.status):
+                        raise DependencyError(f"Notion returned {resp.status}")
                     return False
                 else:
                     logging.info(f"Notion success: {text}")
                     return True
+
+    try:
+        return await notion_breaker.call(post)
+    except OUTAGE_ERRORS:
+        # Left to the caller, which can defer the delivery
+        raise
     except Exception as e:
         logging.exception(f"Notion integration failed: {e}")
         return False
\ No newline at end of file
@@ -0,0 +1,56 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+from sqlalchemy import func
+from database import db_manager
+from models import JudgeAgreement
+from metrics import record_judge_agreement
+from .checkpoints import current_run
+
+logger = logging.getLogger(__name__)
+
+def verdict_agrees(decision: str, scorer_score: float, judge_score: float, pass_score: float) -> bool:
+    """A reject agrees with a failing judge score, an accept with a passing one, otherwise both scores must fall on the same side."""
+    if decision == "reject":
+        return judge_score < pass_score
+    if decision == "accept":
+        return judge_score >= pass_score
+    return (scorer_score >= pass_score) == (judge_score >= pass_score)
+
+def record_agreement(scorer: str, judge: str, decision: str, scorer_score: float, judge_score: float, pass_score: float) -> bool:
+    """Store how a cheap scorer's verdict compares with the LLM judge on the same post."""
+    agreed = verdict_agrees(decision, scorer_score, judge_score, pass_score)
+    record_judge_agreement(scorer, agreed)
+    try:
+        with db_manager.get_session() as session:
+            session.add(JudgeAgreement(
+                run_id=current_run.get(),
+                scorer=scorer,
+                judge=judge,
+                decision=decision,
+                scorer_score=scorer_score,
+                judge_score=judge_score,
+                agreed=agreed,
+            ))
+    except Exception as e:
+        logger.warning(f"Failed to record {scorer} agreement with {judge}: {e}")
+    return agreed
+
+def agreement_summary(scorer: str, days: int = 7) -> Dict[str, Any]:
+    """Agreement rate of a scorer with the judge per decision over the last `days` days, for tuning its thresholds."""
+    since = datetime.utcnow() - timedelta(days=days)
+    with db_manager.get_session() as session:
+        rows = session.query(JudgeAgreement.decision, JudgeAgreement.agreed, func.count(JudgeAgreement.id))\
+            .filter(JudgeAgreement.scorer == scorer, JudgeAgreement.created_at >= since)\
+            .group_by(JudgeAgreement.decision, JudgeAgreement.agreed)\
+            .all()
+
+    summary: Dict[str, Dict[str, Optional[float]]] = {}
+    for decision, agreed, count in rows:
+        entry = summary.setdefault(decision, {"agreed": 0, "total": 0})
+        entry["total"] += count
+        if agreed:
+            entry["agreed"] += count
+    for entry in summary.values():
+        entry["rate"] = entry["agreed"] / entry["total"] if entry["total"] else None
+    return summary
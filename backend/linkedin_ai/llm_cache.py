@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+from openai.types.chat import ChatCompletion
+from database import db_manager
+from models import LLMCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Seconds a cached completion stays valid
+DEFAULT_TTL = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+# Completions kept in process memory, least recently used evicted first
+MEMORY_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 1000))
+# Rows kept in llm_cache_entries; pruned by last use every PRUNE_EVERY writes
+DB_MAX_ENTRIES = int(os.getenv("LLM_CACHE_DB_MAX_ENTRIES", 50000))
+PRUNE_EVERY = 100
+
+def cache_key(params: Dict[str, Any], provider: Optional[str] = None) -> str:
+    """
+    Hash of the model, sampling parameters and prompt of a chat completion request, and of the
+    provider that answers it, so fake or replayed completions are never served to real runs.
+    """
+    canonical = json.dumps(params, sort_keys=True, default=str, separators=(",", ":"))
+    if provider:
+        canonical = f"{provider}:{canonical}"
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """Content-addressed cache of chat completions: an in-memory LRU in front of the llm_cache_entries table."""
+
+    def __init__(self, max_entries: int = MEMORY_MAX_ENTRIES, db_max_entries: int = DB_MAX_ENTRIES, ttl: int = DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.db_max_entries = db_max_entries
+        self.ttl = ttl
+        self._memory: "OrderedDict[str, tuple[float, ChatCompletion]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, expires_at: float, response: ChatCompletion):
+        self._memory[key] = (expires_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Optional[ChatCompletion]:
+        entry = self._memory.get(key)
+        if entry:
+            expires_at, response = entry
+            if expires_at > time.time():
+                self._memory.move_to_end(key)
+                return response
+            del self._memory[key]
+
+        try:
+            with db_manager.get_session() as session:
+                row = session.query(LLMCacheEntry).filter(LLMCacheEntry.key == key).first()
+                if not row:
+                    return None
+                if row.expires_at <= datetime.utcnow():
+                    session.delete(row)
+                    return None
+                row.hits += 1
+                row.last_used_at = datetime.utcnow()
+                response = ChatCompletion.model_validate_json(row.response)
+                expires_at = time.time() + (row.expires_at - datetime.utcnow()).total_seconds()
+        except Exception as e:
+            logger.warning(f"LLM cache read failed, calling the model: {e}")
+            return None
+
+        self._remember(key, expires_at, response)
+        return response
+
+    def set(self, key: str, response: ChatCompletion, stage: str = None, ttl: int = None):
+        ttl = ttl or self.ttl
+        self._remember(key, time.time() + ttl, response)
+        try:
+            with db_manager.get_session() as session:
+                session.merge(LLMCacheEntry(
+                    key=key,
+                    stage=stage,
+                    model=response.model,
+                    response=response.model_dump_json(),
+                    hits=0,
+                    last_used_at=datetime.utcnow(),
+                    expires_at=datetime.utcnow() + timedelta(seconds=ttl),
+                ))
+        except Exception as e:
+            logger.warning(f"LLM cache write failed: {e}")
+            return
+
+        self._writes += 1
+        if self._writes % PRUNE_EVERY == 0:
+            self.prune()
+
+    def delete(self, key: str):
+        self._memory.pop(key, None)
+        try:
+            with db_manager.get_session() as session:
+                session.query(LLMCacheEntry).filter(LLMCacheEntry.key == key).delete(synchronize_session=False)
+        except Exception as e:
+            logger.warning(f"LLM cache delete failed: {e}")
+
+    def prune(self) -> int:
+        """Delete expired rows, then the least recently used ones above db_max_entries."""
+        try:
+            with db_manager.get_session() as session:
+                removed = session.query(LLMCacheEntry)\
+                    .filter(LLMCacheEntry.expires_at <= datetime.utcnow())\
+                    .delete(synchronize_session=False)
+
+                overflow = session.query(LLMCacheEntry).count() - self.db_max_entries
+                if overflow > 0:
+                    stale = session.query(LLMCacheEntry.key)\
+                        .order_by(LLMCacheEntry.last_used_at)\
+                        .limit(overflow)\
+                        .subquery()
+                    removed += session.query(LLMCacheEntry)\
+                        .filter(LLMCacheEntry.key.in_(stale.select()))\
+                        .delete(synchronize_session=False)
+        except Exception as e:
+            logger.warning(f"LLM cache prune failed: {e}")
+            return 0
+
+        if removed:
+            logger.info(f"Pruned {removed} LLM cache entries")
+        return removed
+
+    async def get_or_create(self, params: Dict[str, Any], create: Callable[[], Awaitable[ChatCompletion]],
+                            stage: str = None, ttl: int = None,
+                            validate: Callable[[ChatCompletion], Any] = None, provider: str = None) -> ChatCompletion:
+        """
+        Return the cached completion for params, or call create() once even if several callers miss together.
+
+        validate (e.g. the caller's JSON parser) must not raise for a completion to be cached, so
+        a malformed answer is retried next time instead of being served until it expires.
+        """
+        key = cache_key(params, provider)
+        cached = self.get(key)
+        if cached is not None and not self._valid(cached, validate):
+            logger.warning(f"Dropping invalid cached completion for {stage or params.get('model')} ({key[:12]})")
+            self.delete(key)
+            cached = None
+        if cached is not None:
+            self.hits += 1
+            logger.info(f"LLM cache hit for {stage or params.get('model')} ({key[:12]})")
+            return cached
+
+        if key in self._in_flight:
+            return await asyncio.shield(self._in_flight[key])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            response = await create()
+            if self._valid(response, validate):
+                self.set(key, response, stage=stage, ttl=ttl)
+            future.set_result(response)
+            return response
+        except Exception as e:
+            future.set_exception(e)
+            # Don't warn about an exception nobody else was waiting for
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._in_flight[key]
+
+    @staticmethod
+    def _valid(response: ChatCompletion, validate: Optional[Callable[[ChatCompletion], Any]]) -> bool:
+        if validate is None:
+            return True
+        try:
+            validate(response)
+            return True
+        except Exception:
+            return False
+
+# Global instance
+llm_cache = LLMCache()
@@ -1,18 +1,29 @@
 from asyncio.log import logger
 import os
+import time
 import asyncio
 import logging
-from typing import Optional
+from typing import Optional, Callable, Dict, Any, Union
 from datetime import datetime
 from database import db_manager
 from models import User, GeneratedPost
+from job_queue import job_queue
 from brand_brief_service import brand_brief_service
+from metrics import timed_stage, PIPELINES_IN_FLIGHT, record_evaluation_outcome, record_pipeline_result
 from .topic_generator import get_topic
 from .post_generator import generate_post
-from .post_evaluator import evaluate_post
+from .heuristic_scorer import screen_and_evaluate
 from .post_rewriter import rewrite_post
 from .punchline_generator import generate_punchline
-from .integration import send_to_make, save_to_notion
+from .integration import send_to_make, save_to_notion, OUTAGE_ERRORS
+from .stage_graph import Stage, StageGraph, StageError, SKIP
+from .checkpoints import RunCheckpoints
+from .brief_sections import brief_for_stage
+from .brief_digest import brief_hash
+from .batch import current_batch
+from .circuit_breaker import CircuitOpenError
+from .rewrite_budget import rewrite_budget, ConvergenceCheck
+from .usage import current_user, link_run_to_post
 
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, "data")
@@ -23,10 +34,50 @@ logger = logging.getLogger(__name__)
 MAX_LOOPS = 3
 MIN_SCORE = 7
 
+# Best-of-N drafting: drafts generated and scored concurrently per run (1 keeps the single-draft flow)
+DRAFT_CANDIDATES = int(os.getenv("PIPELINE_DRAFT_CANDIDATES", 1))
+# A candidate scoring at least this is taken straight away and the drafts still running are cancelled
+DRAFT_ACCEPT_SCORE = float(os.getenv("PIPELINE_DRAFT_ACCEPT_SCORE", MIN_SCORE))
+
+# Stages that put the brand brief in their prompt
+PROMPT_STAGES = ("get_topic", "generate_post", "evaluate_post", "rewrite_post")
+
+# Timeouts (seconds) for the delivery stages that run after the rewrite loop
+PUNCHLINE_TIMEOUT = 60
+NOTION_TIMEOUT = 45
+MAKE_TIMEOUT = 30
+
+# Attempts of a deferred delivery job; retries back off from JOB_RETRY_DELAY, doubling each time
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", 6))
+# Seconds before the first attempt of a delivery deferred by an error other than an open breaker
+DELIVERY_RETRY_DELAY = float(os.getenv("DELIVERY_RETRY_DELAY", 60))
+# Output of a delivery stage whose target was down and that was queued as a deliver_post job.
+# It is truthy so the stage is checkpointed and a resumed run doesn't deliver the post twice.
+DEFERRED = "deferred"
+
+# Called as progress(stage, data) after every pipeline stage
+ProgressCallback = Callable[[str, Dict[str, Any]], None]
+
 class PipelineError(Exception):
     """Custom exception for pipeline-related errors"""
     pass
 
+def _report(progress: Optional[ProgressCallback], stage: str, **data):
+    """Forward a stage event to the progress callback; a broken listener must never break the run."""
+    if not progress:
+        return
+    try:
+        progress(stage, data)
+    except Exception as e:
+        logger.warning(f"Progress callback failed for stage {stage}: {e}")
+
+def _chunk_reporter(progress: Optional[ProgressCallback], stage: str, **data) -> Optional[Callable[[str], None]]:
+    """on_chunk callback that reports streamed tokens as `stage` events."""
+    if not progress:
+        return None
+    return lambda text: _report(progress, stage, text=text, **data)
+
+@timed_stage("save_post_db")
 def save_post_to_db(user_id: str, result: dict) -> Optional[str]:
     """
     Saves the generated post result to the database for a specific user.
@@ -65,7 +116,163 @@ def save_post_to_db(user_id: str, result: dict) -> Optional[str]:
         logging.error(f"Failed to save post to database for user {user_id}: {e}")
         return None
 
-async def run_pipeline(user_id: str, manual_topic: Optional[str] = None, brief_type: str = "active"):
+@timed_stage("save_punchline_db")
+def save_punchline_to_db(post_id: str, punchline: str) -> bool:
+    """
+    Stores the punchline on an already saved post.
+    """
+    try:
+        with db_manager.get_session() as session:
+            post = session.query(GeneratedPost).filter(GeneratedPost.id == post_id).first()
+            if not post:
+                return False
+            post.punchline = punchline
+            return True
+    except Exception as e:
+        logging.error(f"Failed to save punchline for post {post_id}: {e}")
+        return False
+
+def _save_post_stage(user_id: str, result: dict) -> str:
+    post_id = save_post_to_db(user_id, result)
+    if not post_id:
+        raise PipelineError("Failed to save post to database.")
+    return post_id
+
+async def _punchline_stage(final_post: str) -> str:
+    logging.info("generating punchline")
+    # In batch mode the punchline waits for its batch, which takes far longer than a real-time call
+    timeout = None if current_batch() else PUNCHLINE_TIMEOUT
+    return await asyncio.wait_for(generate_punchline(final_post), timeout=timeout)
+
+def defer_delivery(user_id: str, post_id: str, target: str, is_manual: bool, error: Exception) -> Optional[str]:
+    """Queue a deliver_post job for when the target is reachable again (when its circuit breaker lets calls through, if open)."""
+    delay = error.retry_in if isinstance(error, CircuitOpenError) else DELIVERY_RETRY_DELAY
+    try:
+        job_id = job_queue.enqueue(user_id, "deliver_post", {"post_id": post_id, "target": target, "is_manual": is_manual},
+                                   max_attempts=DELIVERY_MAX_ATTEMPTS, delay=delay)
+        logger.warning(f"{target} is unavailable ({error}); delivery of post {post_id} deferred to job {job_id}")
+        return job_id
+    except Exception as e:
+        logger.error(f"Failed to defer {target} delivery of post {post_id}: {e}")
+        return None
+
+async def deliver_post(post_id: str, target: str, is_manual: bool = False) -> bool:
+    """Send a saved post to Notion or Make; raises one of OUTAGE_ERRORS while the target is still down."""
+    with db_manager.get_session() as session:
+        post = session.query(GeneratedPost).filter(GeneratedPost.id == post_id).first()
+        if not post:
+            raise PipelineError(f"Post {post_id} not found")
+        result = {
+            "post_id": post.id,
+            "topic": post.topic,
+            "original_post": post.original_post,
+            "final_post": post.final_post,
+            "punchline": post.punchline or "",
+            "score": post.score,
+            "feedback": post.feedback or "",
+            "loops": post.generation_loops,
+        }
+    if target == "notion":
+        return await save_to_notion(result, is_manual=is_manual)
+    if target == "make":
+        return await send_to_make(result)
+    raise PipelineError(f"Unknown delivery target '{target}'")
+
+async def _notion_stage(user_id: str, result: dict, post_id: str, punchline: str, is_manual: bool) -> Union[bool, str]:
+    logging.info("Saving result to Notion.")
+    try:
+        return await save_to_notion(dict(result, post_id=post_id, punchline=punchline), is_manual=is_manual)
+    except OUTAGE_ERRORS as e:
+        return DEFERRED if defer_delivery(user_id, post_id, "notion", is_manual, e) else False
+
+async def _make_stage(user_id: str, topic: dict, final_post: str, score: float, post_id: str, is_manual: bool) -> Union[bool, str]:
+    logging.info("Sending post to Make.")
+    try:
+        return await send_to_make({
+            "topic": topic,
+            "final_post": final_post
+            # Will add image part here after Visulizer integration
+        })
+    except OUTAGE_ERRORS as e:
+        return DEFERRED if defer_delivery(user_id, post_id, "make", is_manual, e) else False
+
+# Everything after the rewrite loop. Nothing is delivered before the post is in the DB,
+# and the punchline LLM call overlaps with the DB save and the Make webhook.
+DELIVERY_GRAPH = StageGraph([
+    Stage("save_post", _save_post_stage, inputs=("user_id", "result"), outputs=("post_id",)),
+    Stage("punchline", _punchline_stage, inputs=("final_post",), outputs=("punchline",),
+          on_error=SKIP, default=""),
+    Stage("save_punchline", save_punchline_to_db, inputs=("post_id", "punchline"), outputs=("punchline_saved",),
+          on_error=SKIP, default=False),
+    Stage("notion", _notion_stage, inputs=("user_id", "result", "post_id", "punchline", "is_manual"), outputs=("notion_success",),
+          timeout=NOTION_TIMEOUT, on_error=SKIP, default=False),
+    Stage("make", _make_stage, inputs=("user_id", "topic", "final_post", "score", "post_id", "is_manual"), outputs=("make_success",),
+          timeout=MAKE_TIMEOUT, on_error=SKIP, default=False, when=lambda score, **_: score >= MIN_SCORE),
+], initial=("user_id", "result", "topic", "final_post", "score", "is_manual"))
+
+async def _best_of_n_draft(topic: dict, prompt_briefs: Dict[str, str], brief_type: str, progress: Optional[ProgressCallback], stream_tokens: bool):
+    """Draft DRAFT_CANDIDATES posts at once, score each as soon as it is written and return the best one."""
+
+    async def draft_candidate(index: int):
+        on_chunk = _chunk_reporter(progress, "draft_chunk", candidate=index) if stream_tokens else None
+        post_data = await generate_post(topic, prompt_briefs["generate_post"], brief_type, on_chunk=on_chunk)
+        if not post_data or not post_data.get("post"):
+            raise PipelineError(f"Draft candidate {index} was not generated")
+
+        post = post_data["post"]
+        score, feedback, reasoning = await screen_and_evaluate(post, prompt_briefs["evaluate_post"], topic, brief_type, pass_score=MIN_SCORE)
+        logging.info(f"Draft candidate {index} scored {score}")
+        _report(progress, "candidate", candidate=index, post=post, score=score, feedback=feedback)
+        return index, post, score, feedback, reasoning
+
+    tasks = [asyncio.create_task(draft_candidate(i)) for i in range(DRAFT_CANDIDATES)]
+    best = None
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            try:
+                candidate = await next_done
+            except Exception as e:
+                logger.warning(f"Draft candidate failed: {e}")
+                continue
+
+            if best is None or candidate[2] > best[2]:
+                best = candidate
+            if best[2] >= DRAFT_ACCEPT_SCORE:
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    if best is None:
+        raise PipelineError("All draft candidates failed")
+    return best
+
+async def run_pipeline(user_id: str, manual_topic: Optional[str] = None, brief_type: str = "active", progress: Optional[ProgressCallback] = None,
+                       stream_tokens: bool = False, job_id: Optional[str] = None, run_id: Optional[str] = None):
+    """
+    Runs the pipeline with every stage output checkpointed to pipeline_run_stages.
+
+    Passing the job_id (or run_id) of a run that failed resumes it from its last completed stage.
+    """
+    try:
+        checkpoints = RunCheckpoints.open(user_id, manual_topic, brief_type, job_id=job_id, run_id=run_id)
+    except Exception as e:
+        logging.exception(f"Could not open pipeline run for user {user_id}: {e}")
+        return {"status": "error", "message": "Pipeline crashed unexpectedly"}
+
+    # LLM usage below is charged to this user (see linkedin_ai.usage)
+    current_user.set(user_id)
+    started = time.perf_counter()
+    with PIPELINES_IN_FLIGHT.track_inprogress():
+        result = await _run_pipeline(checkpoints, user_id, manual_topic, brief_type, progress, stream_tokens)
+    record_pipeline_result(result.get("status", "error"), time.perf_counter() - started)
+    checkpoints.finish(result)
+    result["run_id"] = checkpoints.run_id
+    return result
+
+async def _run_pipeline(checkpoints: RunCheckpoints, user_id: str, manual_topic: Optional[str], brief_type: str,
+                        progress: Optional[ProgressCallback], stream_tokens: bool):
     try:
         if brief_type == "active":
             with db_manager.get_session() as session:
@@ -84,36 +291,84 @@ async def run_pipeline(user_id: str, manual_topic: Optional[str] = None, brief_t
             raise PipelineError(f"Please create your {brief_type} brand brief first")
         
         logger.info(f"Using {brief_type} brand brief for user {user_id}")
+        _report(progress, "started", brief_type=brief_type, manual=manual_topic is not None, run_id=checkpoints.run_id, resumed=checkpoints.resumed)
+
+        # Stages listed in BRIEF_DIGEST_STAGES get the cached brief digest; the rest get the brief
+        # sections relevant to them, which for the post stages depends on the topic
+        prompt_briefs = {"get_topic": await brief_for_stage(brand_brief_content, "get_topic")}
 
-        topic = await get_topic(brand_brief_content, manual_topic, brief_type)
+        topic = await checkpoints.run("topic", get_topic, prompt_briefs["get_topic"], manual_topic, brief_type, user_id=user_id,
+                                      pool_hash=brief_hash(brand_brief_content))
         logging.info(f"Topic generated: {topic}")
+        _report(progress, "topic", topic=topic)
 
-        post_data = await generate_post(topic, brand_brief_content, brief_type)
-        original_post = post_data["post"]
-        post = post_data["post"]
-        logging.info(f"Post generated: {post[:60]}...")
+        for stage in PROMPT_STAGES[1:]:
+            prompt_briefs[stage] = await brief_for_stage(brand_brief_content, stage, topic["topic"])
+
+        if DRAFT_CANDIDATES > 1:
+            # Only the best candidate goes on to the rewrite loop
+            candidate, post, score, feedback, reasoning = await checkpoints.run("draft", _best_of_n_draft, topic, prompt_briefs, brief_type, progress, stream_tokens)
+            original_post = post
+            logging.info(f"Best of {DRAFT_CANDIDATES} drafts is candidate {candidate} with score {score}")
+            _report(progress, "draft", post=post, candidate=candidate)
+        else:
+            # With stream_tokens, draft and rewrite tokens are reported as *_chunk events while they are generated
+            on_draft_chunk = _chunk_reporter(progress, "draft_chunk") if stream_tokens else None
+            post_data = await checkpoints.run("draft", generate_post, topic, prompt_briefs["generate_post"], brief_type, on_chunk=on_draft_chunk)
+            original_post = post_data["post"]
+            post = post_data["post"]
+            logging.info(f"Post generated: {post[:60]}...")
+            _report(progress, "draft", post=post)
 
-        score, feedback, reasoning = await evaluate_post(post, brand_brief_content, topic, brief_type)
-        logging.info(f"Initial evaluation score: {score}, feedback: {feedback}, topic: {topic}")
+            # Local checks reject broken drafts before they reach the LLM judge
+            score, feedback, reasoning = await checkpoints.run("evaluate:0", screen_and_evaluate, post, prompt_briefs["evaluate_post"], topic, brief_type,
+                                                               pass_score=MIN_SCORE)
+            logging.info(f"Initial evaluation score: {score}, feedback: {feedback}, topic: {topic}")
+        _report(progress, "evaluation", loop=0, score=score, feedback=feedback, reasoning=reasoning)
 
         loops = 0
-        while score < MIN_SCORE and loops < MAX_LOOPS:
+        budget = MAX_LOOPS
+        if score < MIN_SCORE:
+            # Checkpointed so a resumed run replays the same number of loops
+            if checkpoints.has("rewrite_budget"):
+                budget = checkpoints.get("rewrite_budget")
+            else:
+                budget = rewrite_budget(user_id, MAX_LOOPS, MIN_SCORE)
+                checkpoints.save("rewrite_budget", budget)
+        convergence = ConvergenceCheck(score)
+        best = (post, score, feedback, reasoning)
+        while score < MIN_SCORE and loops < budget:
             logging.info(f"Rewriting post, loop {loops+1}")
-            post = await rewrite_post(post, feedback, topic, brand_brief_content, brief_type)
+            on_rewrite_chunk = _chunk_reporter(progress, "rewrite_chunk", loop=loops + 1) if stream_tokens else None
+            previous_post, previous_score = post, score
+            try:
+                post = await checkpoints.run(f"rewrite:{loops + 1}", rewrite_post, post, feedback, topic, prompt_briefs["rewrite_post"], brief_type, on_chunk=on_rewrite_chunk)
+            except Exception as e:
+                # Same handling in both rewrite modes: keep the best post so far and stop rewriting
+                logging.error(f"Rewrite loop {loops + 1} failed, keeping the best post so far: {e}")
+                break
             logging.info(f"Rewritten post: {post[:60]}...")
-            score, feedback, reasoning = await evaluate_post(post, brand_brief_content, topic, brief_type)
+            _report(progress, "rewrite", loop=loops + 1, post=post)
+            score, feedback, reasoning = await checkpoints.run(f"evaluate:{loops + 1}", screen_and_evaluate, post, prompt_briefs["evaluate_post"], topic, brief_type,
+                                                               previous_post=previous_post, previous_score=previous_score, pass_score=MIN_SCORE)
             logging.info(f"Re-evaluation score: {score}, feedback: {feedback}")
             loops += 1
+            _report(progress, "evaluation", loop=loops, score=score, feedback=feedback, reasoning=reasoning)
+            if score > best[1]:
+                best = (post, score, feedback, reasoning)
+            if score < MIN_SCORE and convergence.update(previous_post, post, score):
+                break
+
+        if score < best[1]:
+            # A later rewrite scored worse; keep the best version instead
+            post, score, feedback, reasoning = best
 
-        logging.info("generating punchline")
-        punchline = await generate_punchline(post)
-        logging.info(f"punchline generated: {punchline}")
+        record_evaluation_outcome(score, loops)
 
         result = {
             "topic": topic,
             "original_post": original_post,
             "final_post": post,
-            "punchline": punchline,
             "brief_type": brief_type,
             "score": score,
             "feedback": feedback,
@@ -121,32 +376,51 @@ async def run_pipeline(user_id: str, manual_topic: Optional[str] = None, brief_t
             "loops": loops,
         }
 
-        post_id = save_post_to_db(user_id, result)
+        # Punchline, DB save, Notion and Make only need the final post, so they run as a stage graph
+        def on_stage_done(stage: str, status: str, outputs: Dict[str, Any]):
+            if stage == "punchline":
+                logging.info(f"punchline generated: {outputs.get('punchline')}")
+                _report(progress, "punchline", punchline=outputs.get("punchline"))
+            elif stage == "save_post":
+                _report(progress, "saved", success=True, post_id=outputs.get("post_id"))
+            elif stage == "notion":
+                _report(progress, "notion", success=outputs.get("notion_success") is True,
+                        deferred=outputs.get("notion_success") == DEFERRED)
+            elif stage == "make" and status != "skipped":
+                _report(progress, "make", success=outputs.get("make_success") is True,
+                        deferred=outputs.get("make_success") == DEFERRED)
 
-        if not post_id:
+        try:
+            values, stage_report = await DELIVERY_GRAPH.run({
+                "user_id": user_id,
+                "result": result,
+                "topic": topic,
+                "final_post": post,
+                "score": score,
+                "is_manual": manual_topic is not None,
+            }, on_stage_done=on_stage_done, checkpoints=checkpoints)
+        except StageError as e:
+            if e.stage != "save_post":
+                raise
             # Handle failure to save to DB
+            _report(progress, "saved", success=False)
             return {"status": "error", "message": "Failed to save post to database."}
 
-        # Add the new post_id to the result for integration
-        result["post_id"] = post_id
-        final_post = result["final_post"]
-
-        logging.info("Saving result to Notion.")
-        notion_success = await save_to_notion(result, is_manual=manual_topic is not None)
+        logging.info(f"Delivery stages finished: {stage_report}")
+        link_run_to_post(checkpoints.run_id, values["post_id"])
+        notion_success = values["notion_success"]
+        make_success = values["make_success"]
 
         if score >= MIN_SCORE:
-            logging.info("Sending post to Make.")
-            
-            make_success = await send_to_make({
-                "topic": topic,
-                "final_post": final_post
-                # Will add image part here after Visulizer integration
-            })
-            
             if make_success and notion_success:
+                deferred = [name for name, value in (("Notion", notion_success), ("Make", make_success)) if value == DEFERRED]
+                if deferred:
+                    logging.info(f"Pipeline finished; delivery to {' and '.join(deferred)} is queued.")
+                    return {"status": "success", "message": f"Post saved; delivery to {' and '.join(deferred)} is queued."}
                 logging.info("Pipeline finished successfully.")
                 return {"status": "success", "message": "Post scheduled and saved."}
             else:
+                # The run is left resumable; resuming it repeats only the deliveries that failed
                 logging.warning("Pipeline finished with integration issues.")
                 return {"status": "partial_success", "message": "Post generated but integration failed."}
         else:
@@ -0,0 +1,122 @@
+"""
+Targeted rewrites: instead of regenerating the whole post, the model returns a few edit
+operations (new hook, new body paragraph k, new CTA) that are applied locally. Output tokens,
+and so latency, scale with what the feedback asks to change rather than with the post length.
+"""
+import os
+import json
+import logging
+from typing import Any, Dict, List
+from metrics import timed_stage
+from .client import complete
+
+logger = logging.getLogger(__name__)
+
+EDIT_MODEL = os.getenv("REWRITE_EDIT_MODEL", "gpt-4o-mini")
+# More edits than this is a rewrite in disguise; the full rewrite does that better
+MAX_EDITS = 3
+
+REPLACE_HOOK = "replace_hook"
+REPLACE_PARAGRAPH = "replace_paragraph"
+REPLACE_CTA = "replace_cta"
+
+class EditError(Exception):
+    """The model's edits could not be applied to the post"""
+    pass
+
+def split_post(post: str) -> Dict[str, Any]:
+    """Split a post into hook (first paragraph), body paragraphs and CTA (last paragraph)."""
+    paragraphs = [p.strip() for p in post.strip().split("\n\n") if p.strip()]
+    if len(paragraphs) < 3:
+        raise EditError("The post has too few paragraphs to edit in place")
+    return {"hook": paragraphs[0], "body": paragraphs[1:-1], "cta": paragraphs[-1]}
+
+def join_post(parts: Dict[str, Any]) -> str:
+    return "\n\n".join([parts["hook"], *parts["body"], parts["cta"]])
+
+def apply_edits(post: str, edits: List[Dict[str, Any]]) -> str:
+    """Apply edit operations to a post; raises EditError if any of them is malformed or changes nothing."""
+    if not edits:
+        raise EditError("No edits returned")
+    if len(edits) > MAX_EDITS:
+        raise EditError(f"{len(edits)} edits returned, at most {MAX_EDITS} are applied in place")
+
+    parts = split_post(post)
+    for edit in edits:
+        text = (edit.get("text") or "").strip()
+        if not text:
+            raise EditError(f"Edit {edit} has no text")
+        if "\n\n" in text and edit.get("op") != REPLACE_PARAGRAPH:
+            raise EditError("A hook or CTA edit must be a single paragraph")
+
+        op = edit.get("op")
+        if op == REPLACE_HOOK:
+            parts["hook"] = text
+        elif op == REPLACE_CTA:
+            parts["cta"] = text
+        elif op == REPLACE_PARAGRAPH:
+            try:
+                index = int(edit.get("index"))
+            except (TypeError, ValueError):
+                raise EditError(f"Paragraph edit {edit} has no valid index")
+            if not 1 <= index <= len(parts["body"]):
+                raise EditError(f"Paragraph {index} does not exist; the post has {len(parts['body'])} body paragraphs")
+            parts["body"][index - 1] = text
+        else:
+            raise EditError(f"Unknown edit operation '{op}'")
+
+    edited = join_post(parts)
+    if edited == join_post(split_post(post)):
+        raise EditError("The edits leave the post unchanged")
+    return edited
+
+@timed_stage("rewrite_post_edits")
+async def edit_post(post: str, feedback: str, topic: str, brand_brief: str, brief_type: str = "personal") -> str:
+    """Ask for targeted edits that address the feedback and return the edited post; raises EditError if they don't apply."""
+    parts = split_post(post)
+    body = "\n\n".join(f"[{i}] {paragraph}" for i, paragraph in enumerate(parts["body"], start=1))
+    prompt = f"""
+    You are a senior brand copywriter editing a LinkedIn post for a {brief_type} brand. Address the editor's
+    feedback with the smallest set of targeted edits instead of rewriting the post.
+
+    Hook:
+    {parts["hook"]}
+
+    Body paragraphs:
+    {body}
+
+    Call to action:
+    {parts["cta"]}
+
+    Feedback from Evaluator:
+    {feedback}
+
+    Topic:
+    {topic}
+
+    Brand Brief:
+    {brand_brief}
+
+    Allowed edits (at most {MAX_EDITS}):
+    - {{"op": "{REPLACE_HOOK}", "text": "new hook"}}
+    - {{"op": "{REPLACE_PARAGRAPH}", "index": 2, "text": "new text for body paragraph 2"}}
+    - {{"op": "{REPLACE_CTA}", "text": "new call to action"}}
+
+    Keep the voice of the post. No hashtags, emojis or markdown.
+    Return ONLY a JSON object: {{"edits": [ ... ]}}
+    """
+    response = await complete(
+        "rewrite_post_edits",
+        model=EDIT_MODEL,
+        messages=[{"role": "user", "content": prompt}],
+        response_format={"type": "json_object"}
+    )
+    try:
+        edits = json.loads(response.choices[0].message.content).get("edits")
+    except (ValueError, AttributeError) as e:
+        raise EditError(f"Edits are not valid JSON: {e}")
+    if not isinstance(edits, list):
+        raise EditError("Edits are not a list")
+    edited = apply_edits(post, edits)
+    logger.info(f"Applied {len(edits)} edits: {[edit.get('op') for edit in edits]}")
+    return edited
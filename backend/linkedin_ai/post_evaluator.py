@@ -1,10 +1,29 @@
 from typing import Tuple
+import os
 import json
+import random
 import logging
-from .client import client
+from metrics import timed_stage, record_evaluation_judge
+from .client import complete
+from .brief_digest import get_brief_digest
+from .judge_agreement import record_agreement
 
-async def evaluate_post(post: str, brand_brief: str, topic: str, brief_type: str = "personal") -> Tuple[int, str, str]:
-    prompt = f"""You are a senior editorial reviewer at a top {brief_type.lower()} brand agency. Your job is to rigorously evaluate a draft LinkedIn post and provide a clear numeric score and highly actionable, specific feedback to help the writer reach a publish-ready standard.
+# The judge whose score decides whether a post passes
+EVALUATION_MODEL = os.getenv("EVALUATION_MODEL", "gpt-3.5-turbo")
+# Cheaper model that scores first; the judge only runs when its score is within CASCADE_MARGIN
+# of the pass score. Empty disables the cascade.
+CASCADE_MODEL = os.getenv("EVALUATION_CASCADE_MODEL", "")
+CASCADE_MARGIN = float(os.getenv("EVALUATION_CASCADE_MARGIN", 1))
+# "digest" gives the cheap model the short brief digest instead of the full brief
+CASCADE_BRIEF = os.getenv("EVALUATION_CASCADE_BRIEF", "full")
+# Share of clear-cut cheap verdicts still checked by the judge, to keep measuring agreement
+CASCADE_AUDIT_RATE = float(os.getenv("EVALUATION_CASCADE_AUDIT_RATE", 0.05))
+
+# Name under which agreement with whatever evaluate_with_cascade uses is recorded
+EVALUATION_JUDGE = f"{CASCADE_MODEL}>{EVALUATION_MODEL}" if CASCADE_MODEL else EVALUATION_MODEL
+
+def _evaluation_prompt(post: str, brand_brief: str, topic: str, brief_type: str) -> str:
+    return f"""You are a senior editorial reviewer at a top {brief_type.lower()} brand agency. Your job is to rigorously evaluate a draft LinkedIn post and provide a clear numeric score and highly actionable, specific feedback to help the writer reach a publish-ready standard.
 
 {brief_type.lower()} BRAND Brief: 
 {brand_brief}
@@ -41,22 +60,71 @@ Output a JSON object:
 }}
 
 DO NOT return strings like '6/10' or 'Score: 6'. Only return a clean numeric score."""
-    response = await client.chat.completions.create(
-        model="gpt-3.5-turbo",
+
+def _parse_evaluation(response) -> Tuple[int, str, str]:
+    data = json.loads(response.choices[0].message.content.strip())
+
+    score = int(data.get("score", 0))
+    reasoning = data.get("reasoning", "No reasoning provided.")
+    feedback = data.get("feedback", "No feedback provided.")
+
+    return score, feedback, reasoning
+
+async def _score(stage: str, model: str, prompt: str) -> Tuple[int, str, str]:
+    # Re-evaluating the same text (retries, re-runs) is answered from the LLM cache; answers
+    # that don't parse are not cached
+    response = await complete(
+        stage,
+        use_cache=True,
+        cache_validate=_parse_evaluation,
+        model=model,
         messages=[{"role": "user", "content": prompt}]
     )
 
-    lines = response.choices[0].message.content.strip()
-
     try:
-        data = json.loads(lines)
-        
-        score = int(data.get("score", 0))
-        reasoning = data.get("reasoning", "No reasoning provided.")
-        feedback = data.get("feedback", "No feedback provided.")
-    
-        return score, feedback, reasoning
-    
+        return _parse_evaluation(response)
     except Exception as e:
         logging.error("Failed to parse evaluation response as JSON.")
-        raise
\ No newline at end of file
+        raise
+
+@timed_stage("evaluate_post")
+async def evaluate_post(post: str, brand_brief: str, topic: str, brief_type: str = "personal") -> Tuple[int, str, str]:
+    record_evaluation_judge(EVALUATION_MODEL)
+    return await _score("evaluate_post", EVALUATION_MODEL, _evaluation_prompt(post, brand_brief, topic, brief_type))
+
+@timed_stage("evaluate_post_cheap")
+async def evaluate_post_cheap(post: str, brand_brief: str, topic: str, brief_type: str = "personal") -> Tuple[int, str, str]:
+    if CASCADE_BRIEF == "digest":
+        brand_brief = await get_brief_digest(brand_brief)
+    return await _score("evaluate_post_cheap", CASCADE_MODEL, _evaluation_prompt(post, brand_brief, topic, brief_type))
+
+async def evaluate_with_cascade(post: str, brand_brief: str, topic: str, brief_type: str = "personal", pass_score: float = 7) -> Tuple[int, str, str]:
+    """
+    evaluate_post behind a cheap first pass. Posts the cheap model scores clearly above or below
+    pass_score keep its verdict; only borderline ones (and a small audit sample) go to the judge,
+    and every judged post records whether the two agreed.
+    """
+    if not CASCADE_MODEL:
+        return await evaluate_post(post, brand_brief, topic, brief_type)
+
+    try:
+        cheap = await evaluate_post_cheap(post, brand_brief, topic, brief_type)
+    except Exception as e:
+        logging.warning(f"Cheap evaluation with {CASCADE_MODEL} failed, asking the judge: {e}")
+        return await evaluate_post(post, brand_brief, topic, brief_type)
+
+    cheap_score = cheap[0]
+    if cheap_score < pass_score - CASCADE_MARGIN:
+        decision = "reject"
+    elif cheap_score > pass_score + CASCADE_MARGIN:
+        decision = "accept"
+    else:
+        decision = "judge"
+
+    if decision != "judge" and random.random() >= CASCADE_AUDIT_RATE:
+        record_evaluation_judge(CASCADE_MODEL)
+        return cheap
+
+    judged = await evaluate_post(post, brand_brief, topic, brief_type)
+    record_agreement(CASCADE_MODEL, EVALUATION_MODEL, decision, cheap_score, judged[0], pass_score)
+    return judged
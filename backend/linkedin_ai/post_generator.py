@@ -1,9 +1,12 @@
 from asyncio.log import logger
-from .client import client
+from typing import Callable, Optional
+from metrics import timed_stage
+from .client import complete, stream_completion
 
 FT_MODEL = "ft:gpt-4o-mini-2024-07-18:personal::BRu3BO2w"
 
-async def generate_post(topic: str, brand_brief: str, brief_type: str = "personal") -> dict:
+@timed_stage("generate_post")
+async def generate_post(topic: str, brand_brief: str, brief_type: str = "personal", on_chunk: Optional[Callable[[str], None]] = None) -> dict:
     if brief_type == "personal":
         prompt = f"""
         You are an expert LinkedIn content strategist working for a top-tier personal brand. Your task is to write a professional, compelling, and original post for LinkedIn.
@@ -59,12 +62,18 @@ async def generate_post(topic: str, brand_brief: str, brief_type: str = "persona
 
 
     try:
-        response = await client.chat.completions.create(
-            model=FT_MODEL,
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        post = response.choices[0].message.content.strip()
+        messages = [{"role": "user", "content": prompt}]
+        # Streaming mode hands tokens to on_chunk as they arrive but still returns the full post
+        if on_chunk:
+            post = (await stream_completion(on_chunk, stage="generate_post", model=FT_MODEL, messages=messages)).strip()
+        else:
+            response = await complete(
+                "generate_post",
+                model=FT_MODEL,
+                messages=messages
+            )
+
+            post = response.choices[0].message.content.strip()
 
         return {
             "post": post
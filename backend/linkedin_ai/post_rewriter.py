@@ -1,9 +1,32 @@
+import os
+import asyncio
 from venv import logger
-from .client import client
+from typing import Callable, Optional
+from metrics import timed_stage, record_rewrite_mode
+from .client import complete, stream_completion
+from .post_edits import edit_post, EditError
 
 FT_MODEL = "ft:gpt-4o-mini-2024-07-18:personal::BRu3BO2w"
+# "full": always regenerate; "edits": ask for targeted edits and fall back to a full rewrite when they don't apply
+REWRITE_MODE = os.getenv("REWRITE_MODE", "full")
+
+@timed_stage("rewrite_post")
+async def rewrite_post(post: str, feedback: str, topic: str, brand_brief: str,brief_type: str = "personal" , model_name: str = FT_MODEL, on_chunk: Optional[Callable[[str], None]] = None) -> str:
+    if REWRITE_MODE == "edits":
+        try:
+            edited = await edit_post(post, feedback, topic, brand_brief, brief_type)
+            record_rewrite_mode("edits")
+            if on_chunk:
+                # Edits arrive as a whole, so the edited post is reported as one chunk
+                on_chunk(edited)
+            return edited
+        except (EditError, ValueError, asyncio.TimeoutError) as e:
+            # Edits that don't apply, malformed JSON or a missed deadline; anything else is raised to the pipeline
+            logger.warning(f"Targeted edits failed, rewriting the whole post: {e!r}")
+            record_rewrite_mode("full_fallback")
+    else:
+        record_rewrite_mode("full")
 
-async def rewrite_post(post: str, feedback: str, topic: str, brand_brief: str,brief_type: str = "personal" , model_name: str = FT_MODEL) -> str:
     if brief_type == "personal":    
         prompt = f"""
             You are a senior brand copywriter at a top-tier creative agency for personal brands. Your task is to **rewrite a LinkedIn post** based on professional editorial feedback — ensuring it meets the highest standards for clarity, engagement, and brand alignment.
@@ -44,13 +67,15 @@ async def rewrite_post(post: str, feedback: str, topic: str, brand_brief: str,br
             - Notes or summaries
 
         """
-    try:
-        response = await client.chat.completions.create(
-            model=FT_MODEL,
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        logger.error(f"Failed to rewrite post using model {model_name}, Error: {e}")
-        return post
\ No newline at end of file
+    # API errors propagate in both modes; the pipeline logs them and keeps the best post so far
+    messages = [{"role": "user", "content": prompt}]
+    if on_chunk:
+        return (await stream_completion(on_chunk, stage="rewrite_post", model=FT_MODEL, messages=messages)).strip()
+
+    response = await complete(
+        "rewrite_post",
+        model=FT_MODEL,
+        messages=messages
+    )
+
+    return response.choices[0].message.content.strip()
\ No newline at end of file
@@ -0,0 +1,275 @@
+"""
+LLM backends behind linkedin_ai.client.
+
+OpenAIProvider sends requests to the API. FakeProvider answers locally with templated,
+reproducible outputs for every pipeline stage, and simulates latency, server errors and
+429s. It is meant for load-testing scheduling, concurrency and DB behaviour without an
+API key. Pick one with LLM_PROVIDER=openai|fake; recording and replaying real traffic
+(LLM_PROVIDER=replay) live in linkedin_ai.cassettes.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Optional, Union
+import openai
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+from .llm_cache import cache_key
+
+logger = logging.getLogger(__name__)
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")
+
+_openai_client: Optional[AsyncOpenAI] = None
+
+def openai_client() -> AsyncOpenAI:
+    """The process's OpenAI client, built on first use so fake and replay runs never need an API key."""
+    global _openai_client
+    if _openai_client is None:
+        # Retries are done by the rate limiter so it can back off for all callers
+        _openai_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'), max_retries=0)
+    return _openai_client
+
+class LLMProvider:
+    """Chat completion backend. `stream` returns an async iterator of text deltas once the response has started."""
+
+    name = "base"
+
+    async def complete(self, params: Dict[str, Any], stage: Optional[str] = None) -> ChatCompletion:
+        raise NotImplementedError
+
+    async def stream(self, params: Dict[str, Any], stage: Optional[str] = None) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(self, client):
+        self.client = client
+
+    async def complete(self, params: Dict[str, Any], stage: Optional[str] = None) -> ChatCompletion:
+        return await self.client.chat.completions.create(**params)
+
+    async def stream(self, params: Dict[str, Any], stage: Optional[str] = None) -> AsyncIterator[str]:
+        stream = await self.client.chat.completions.create(stream=True, **params)
+        return self._deltas(stream)
+
+    @staticmethod
+    async def _deltas(stream) -> AsyncIterator[str]:
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+
+class Latency:
+    """
+    Latency distribution parsed from "fixed:S", "uniform:MIN:MAX", "normal:MEAN:STD" or
+    "lognormal:MEDIAN:SIGMA" (seconds).
+    """
+
+    def __init__(self, spec: str):
+        kind, *args = spec.split(":")
+        values = [float(arg) for arg in args]
+        samplers = {
+            "fixed": lambda rng: values[0],
+            "uniform": lambda rng: rng.uniform(values[0], values[1]),
+            "normal": lambda rng: rng.gauss(values[0], values[1]),
+            "lognormal": lambda rng: values[0] * rng.lognormvariate(0, values[1]),
+        }
+        if kind not in samplers:
+            raise ValueError(f"Unknown latency distribution '{spec}'")
+        self.spec = spec
+        self._sample = samplers[kind]
+
+    def sample(self, rng: random.Random) -> float:
+        return max(0.0, self._sample(rng))
+
+# Word pools for fake posts; picked per request so different prompts give different posts
+_HOOKS = [
+    "Most teams get this wrong.",
+    "I changed one habit last year and it paid off every week since.",
+    "Here's the uncomfortable truth nobody tells you.",
+    "Three years ago I would have disagreed with this post.",
+    "Stop optimising the wrong metric.",
+]
+_PARAGRAPHS = [
+    "The best results came from small, boring changes repeated every day. Nobody noticed at first, but the numbers did.",
+    "We tried the obvious fix first. It failed, and the reason it failed taught us more than any success would have.",
+    "Clarity beats cleverness. When the whole team can explain the goal in one sentence, execution gets easier.",
+    "Customers rarely ask for features. They ask for outcomes, and the gap between the two is where good products live.",
+    "Feedback is only useful when it is specific, timely and given with the intent to help, not to judge.",
+    "Speed matters, but direction matters more. Moving fast toward the wrong target just gets you lost sooner.",
+]
+_CTAS = [
+    "What would you add to this list?",
+    "Have you seen the same thing in your team?",
+    "Agree or disagree? Tell me in the comments.",
+    "Save this for your next planning session.",
+]
+
+def _prompt_text(params: Dict[str, Any]) -> str:
+    return "\n".join(str(m.get("content") or "") for m in params.get("messages", []))
+
+def _fake_post(rng: random.Random, params: Dict[str, Any]) -> str:
+    paragraphs = rng.sample(_PARAGRAPHS, 3)
+    return "\n\n".join([rng.choice(_HOOKS), *paragraphs, rng.choice(_CTAS)])
+
+def _fake_topics(rng: random.Random, params: Dict[str, Any]) -> str:
+    return json.dumps({"topics": [f"Lessons from {rng.choice(['shipping', 'hiring', 'selling', 'failing', 'leading'])} #{i}" for i in range(1, 6)]})
+
+def _fake_scores(rng: random.Random, params: Dict[str, Any]) -> str:
+    # score_topics lists the candidates as a JSON array; score those when it can be found
+    topics = []
+    for line in _prompt_text(params).splitlines():
+        if line.strip().startswith("["):
+            try:
+                topics = json.loads(line.strip())
+                break
+            except ValueError:
+                continue
+    topics = topics or [f"Fake topic {i}" for i in range(1, 6)]
+    return json.dumps({"scores": [{"topic": topic, "score": rng.randint(5, 10)} for topic in topics]})
+
+def _fake_evaluation(rng: random.Random, params: Dict[str, Any]) -> str:
+    return json.dumps({
+        "score": rng.choices([5, 6, 7, 8, 9], weights=[1, 2, 4, 4, 2])[0],
+        "reasoning": "The post is clear and on-brand but the middle section is generic.",
+        "feedback": "Open with a sharper hook, add one concrete example and end with a direct question.",
+    })
+
+def _fake_edits(rng: random.Random, params: Dict[str, Any]) -> str:
+    edits = [{"op": "replace_hook", "text": rng.choice(_HOOKS)}]
+    if rng.random() < 0.5:
+        edits.append({"op": "replace_cta", "text": rng.choice(_CTAS)})
+    return json.dumps({"edits": edits})
+
+# Stage -> template; a template is a string, a list of strings (one is picked) or fn(rng, params) -> str
+DEFAULT_TEMPLATES: Dict[str, Any] = {
+    "generate_best_topic": _fake_topics,
+    "score_topics": _fake_scores,
+    "generate_post": _fake_post,
+    "rewrite_post": _fake_post,
+    "rewrite_post_edits": _fake_edits,
+    "evaluate_post": _fake_evaluation,
+    "evaluate_post_cheap": _fake_evaluation,
+    "generate_punchline": ["Small habits, big results", "Clarity beats cleverness", "Outcomes over features"],
+    "brief_digest": "Identity: fake brand\nVoice & tone: direct, friendly\nAudience: founders\nThemes: leadership, product",
+}
+
+class FakeProvider(LLMProvider):
+    """
+    Local stand-in for the API. Output depends only on the seed and the request, so runs are
+    reproducible; latency and injected errors come from a seeded generator shared by all calls.
+    """
+
+    name = "fake"
+
+    def __init__(self, seed: int = 0, latency: Union[str, Latency] = "fixed:0",
+                 stage_latency: Optional[Dict[str, Union[str, Latency]]] = None,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, requests_per_minute: Optional[float] = None,
+                 templates: Optional[Dict[str, Any]] = None, token_delay: float = 0.0):
+        self.seed = seed
+        self.latency = latency if isinstance(latency, Latency) else Latency(latency)
+        self.stage_latency = {stage: l if isinstance(l, Latency) else Latency(l) for stage, l in (stage_latency or {}).items()}
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        # Server-side limit: requests over it in any 60s window get a 429
+        self.requests_per_minute = requests_per_minute
+        self.templates = {**DEFAULT_TEMPLATES, **(templates or {})}
+        self.token_delay = token_delay
+        self._rng = random.Random(seed)
+        self._recent = deque()
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls) -> "FakeProvider":
+        templates = None
+        if os.getenv("LLM_FAKE_RESPONSES"):
+            with open(os.getenv("LLM_FAKE_RESPONSES")) as f:
+                templates = json.load(f)
+        stage_latency = json.loads(os.getenv("LLM_FAKE_STAGE_LATENCY", "{}"))
+        rpm = os.getenv("LLM_FAKE_RPM")
+        return cls(
+            seed=int(os.getenv("LLM_FAKE_SEED", 0)),
+            latency=os.getenv("LLM_FAKE_LATENCY", "lognormal:0.5:0.4"),
+            stage_latency=stage_latency,
+            error_rate=float(os.getenv("LLM_FAKE_ERROR_RATE", 0)),
+            rate_limit_rate=float(os.getenv("LLM_FAKE_429_RATE", 0)),
+            requests_per_minute=float(rpm) if rpm else None,
+            templates=templates,
+            token_delay=float(os.getenv("LLM_FAKE_TOKEN_DELAY", 0)),
+        )
+
+    def _text(self, params: Dict[str, Any], stage: Optional[str]) -> str:
+        template = self.templates.get(stage, "Fake response")
+        rng = random.Random(f"{self.seed}:{cache_key(params)}")
+        if callable(template):
+            return template(rng, params)
+        if isinstance(template, list):
+            return rng.choice(template)
+        return template
+
+    @staticmethod
+    def _error(error_class, status_code: int, message: str, headers: Dict[str, str] = None):
+        response = SimpleNamespace(status_code=status_code, headers=headers or {}, request=None)
+        return error_class(message, response=response, body={"code": None, "message": message})
+
+    async def _respond(self, params: Dict[str, Any], stage: Optional[str]) -> str:
+        self.calls += 1
+        latency = self.stage_latency.get(stage, self.latency).sample(self._rng)
+        roll = self._rng.random()
+
+        if self.requests_per_minute:
+            now = time.monotonic()
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.requests_per_minute:
+                retry_after = 60 - (now - self._recent[0])
+                raise self._error(openai.RateLimitError, 429, "Fake rate limit reached", {"retry-after": f"{retry_after:.2f}"})
+            self._recent.append(now)
+
+        if roll < self.rate_limit_rate:
+            await asyncio.sleep(min(latency, 0.05))
+            raise self._error(openai.RateLimitError, 429, "Injected rate limit", {"retry-after": "1"})
+        await asyncio.sleep(latency)
+        if roll < self.rate_limit_rate + self.error_rate:
+            raise self._error(openai.InternalServerError, 500, "Injected server error")
+        return self._text(params, stage)
+
+    async def complete(self, params: Dict[str, Any], stage: Optional[str] = None) -> ChatCompletion:
+        text = await self._respond(params, stage)
+        prompt_tokens = len(_prompt_text(params)) // 4
+        completion_tokens = len(text) // 4
+        return ChatCompletion.model_validate({
+            "id": f"fake-{self.calls}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": params.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    async def stream(self, params: Dict[str, Any], stage: Optional[str] = None) -> AsyncIterator[str]:
+        text = await self._respond(params, stage)
+        return self._words(text)
+
+    async def _words(self, text: str) -> AsyncIterator[str]:
+        for i, word in enumerate(text.split(" ")):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            yield word if i == 0 else " " + word
+
+def create_provider(name: str = LLM_PROVIDER) -> LLMProvider:
+    if name == "openai":
+        return OpenAIProvider(openai_client())
+    if name == "fake":
+        logger.warning("Using the fake LLM provider; no real model is called")
+        return FakeProvider.from_env()
+    raise ValueError(f"Unknown LLM provider '{name}'")
@@ -1,9 +1,64 @@
+import os
+import re
 import logging
-from .client import client
+from typing import Tuple
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+from metrics import timed_stage, record_punchline_source
+from .client import complete
+from .heuristic_scorer import CTA_PHRASES
 
 logger = logging.getLogger(__name__)
 
+# "extractive" picks a line from the post locally and only asks the LLM when unsure; "llm" always asks
+PUNCHLINE_MODE = os.getenv("PUNCHLINE_MODE", "extractive")
+# Extractive picks scoring below this (0-1) go to the LLM instead
+MIN_CONFIDENCE = float(os.getenv("PUNCHLINE_MIN_CONFIDENCE", 0.6))
+MAX_WORDS = 10
+MIN_WORDS = 3
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_sentiment = SentimentIntensityAnalyzer()
+
+def _score_candidate(text: str, line_index: int) -> float:
+    words = len(text.split())
+    # Generated posts open with a short standalone hook, so early lines count most
+    position = 1 / (1 + 0.35 * line_index)
+    length = 1.0 if 4 <= words <= 8 else 0.7
+    intensity = abs(_sentiment.polarity_scores(text)["compound"])
+    punctuation = 1.0 if text[-1] in ".!?" else 0.5
+
+    score = 0.35 * position + 0.25 * length + 0.25 * intensity + 0.15 * punctuation
+    # Lead-ins ("A bold truth:"), quoted dialogue and calls to action don't stand on their own
+    if text.endswith((":", ",", "...", "…")) or text[0] in "\"'“‘" or not text[0].isupper():
+        score -= 0.4
+    if any(phrase in text.lower() for phrase in CTA_PHRASES):
+        score -= 0.3
+    return max(0.0, min(1.0, score))
+
+def extract_punchline(post: str) -> Tuple[str, float]:
+    """Best standalone line or sentence of 3-10 words in the post, with a 0-1 confidence; ("", 0) if none qualifies."""
+    best, best_score = "", 0.0
+    lines = [line.strip() for line in (post or "").splitlines() if line.strip()]
+    for index, line in enumerate(lines):
+        for candidate in {line, *SENTENCE_END.split(line)}:
+            candidate = candidate.strip()
+            if not candidate or not MIN_WORDS <= len(candidate.split()) <= MAX_WORDS:
+                continue
+            score = _score_candidate(candidate, index)
+            if score > best_score:
+                best, best_score = candidate, score
+    return best.rstrip("."), best_score
+
+@timed_stage("generate_punchline")
 async def generate_punchline(post: str) -> str:
+    extracted, confidence = ("", 0.0)
+    if PUNCHLINE_MODE == "extractive":
+        extracted, confidence = extract_punchline(post)
+        if confidence >= MIN_CONFIDENCE:
+            record_punchline_source("extractive")
+            return extracted
+        logger.info(f"Extractive punchline not confident enough ({confidence:.2f}), asking the LLM")
+
     prompt = f"""
     You are an expert visual content strategist. Your task is to read a LinkedIn post and extract a single, powerful "punchline" or "hook" from it. This punchline will be used as the main text on a visual (e.g., an image or a carousel card).
 
@@ -20,13 +75,16 @@ async def generate_punchline(post: str) -> str:
     """
 
     try:
-        response = await client.chat.completions.create(
+        response = await complete(
+            "generate_punchline",
             model="gpt-4o-mini", # Or any model you prefer for this
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
         )
         punchline = response.choices[0].message.content.strip().replace('"', '') # Clean up quotes
+        record_punchline_source("llm")
         return punchline
     except Exception as e:
         logger.error(f"Failed to generate punchline. Error: {e}")
-        return "" # Return empty string on failure
\ No newline at end of file
+        # The low-confidence local pick beats no punchline at all
+        return extracted
\ No newline at end of file
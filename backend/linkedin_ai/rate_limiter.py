@@ -0,0 +1,355 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+import openai
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from database import db_manager
+from models import RateLimitBucket
+from metrics import record_llm_retry, record_limiter_wait, record_limiter_contention
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes
+INTERACTIVE = "interactive"  # manual-topic runs a user is waiting on
+BATCH = "batch"              # scheduled cron runs and background jobs
+
+# Limits of the OpenAI key, per minute
+REQUESTS_PER_MINUTE = float(os.getenv("OPENAI_RPM", 500))
+TOKENS_PER_MINUTE = float(os.getenv("OPENAI_TPM", 200000))
+# Share of both buckets that batch callers may not use, kept free for interactive runs
+INTERACTIVE_RESERVE = float(os.getenv("LLM_INTERACTIVE_RESERVE", 0.2))
+# Retries on 429, 5xx and connection errors, with full-jitter exponential backoff
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 5))
+RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", 1))
+RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", 60))
+# AIMD: a 429 halves the refill rate, every success gives back RATE_RECOVERY of it
+MIN_RATE_FACTOR = float(os.getenv("LLM_MIN_RATE_FACTOR", 0.1))
+RATE_RECOVERY = float(os.getenv("LLM_RATE_RECOVERY", 0.05))
+# Requests and tokens a process leases from the shared bucket at once and then spends in memory,
+# so the database is touched about once per LLM_LEASE_REQUESTS calls instead of on every call
+LEASE_REQUESTS = float(os.getenv("LLM_LEASE_REQUESTS", 10))
+LEASE_TOKENS = float(os.getenv("LLM_LEASE_TOKENS", 20000))
+# A lease with fewer requests left than this share of LEASE_REQUESTS is topped up in the background
+LEASE_REFRESH_AT = 0.5
+# Compare-and-set attempts per lease before backing off
+CAS_ATTEMPTS = 5
+# Seconds batch leases are held back in every process after an interactive caller had to wait
+INTERACTIVE_HOLD = float(os.getenv("LLM_INTERACTIVE_HOLD", 1))
+# Completion tokens assumed when a request doesn't set max_tokens
+DEFAULT_COMPLETION_TOKENS = 800
+
+_lane: ContextVar[str] = ContextVar("llm_priority_lane", default=INTERACTIVE)
+
+@contextmanager
+def priority(lane: str):
+    """Run LLM calls made inside the block (and tasks it starts) in the given lane."""
+    token = _lane.set(lane)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+def current_lane() -> str:
+    return _lane.get()
+
+def estimate_tokens(params: Dict[str, Any]) -> int:
+    """Rough prompt + completion token count of a chat request (~4 characters per token)."""
+    chars = sum(len(str(m.get("content") or "")) for m in params.get("messages", []))
+    completion = params.get("max_tokens") or params.get("max_completion_tokens") or DEFAULT_COMPLETION_TOKENS
+    return chars // 4 + completion
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Seconds the API asked us to wait, from the Retry-After(-ms) headers."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        if response.headers.get("retry-after-ms"):
+            return float(response.headers["retry-after-ms"]) / 1000
+        if response.headers.get("retry-after"):
+            return float(response.headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, openai.RateLimitError):
+        # An exhausted quota won't come back by waiting
+        return getattr(error, "code", None) != "insufficient_quota"
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+class RateLimiter:
+    """
+    Token buckets for requests and LLM tokens, kept in rate_limit_buckets so every API and
+    worker process draws from the same budget. Each process leases LLM_LEASE_REQUESTS requests
+    (and LLM_LEASE_TOKENS tokens) at a time and spends the lease in memory, topping it up in the
+    background before it runs out, so calls don't wait on the database. Falls back to
+    process-local buckets when the database can't be used.
+
+    Batch leases can only take what is above INTERACTIVE_RESERVE, and are held back for a
+    moment whenever an interactive caller in any process is waiting, so manual runs go first
+    when the key is saturated.
+    """
+
+    def __init__(self, name: str = "openai", requests_per_minute: float = REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = TOKENS_PER_MINUTE, reserve: float = INTERACTIVE_RESERVE):
+        self.name = name
+        self.request_capacity = requests_per_minute
+        self.token_capacity = tokens_per_minute
+        self.reserve = reserve
+        self.shared = True
+        # Process-local state, used when shared is off; its rate_factor mirrors the shared one otherwise
+        self._local = {"requests": requests_per_minute, "tokens": tokens_per_minute, "rate_factor": 1.0, "updated_at": time.time()}
+        # What this process may still spend without going back to the bucket
+        self._lease = {"requests": 0.0, "tokens": 0.0}
+        self._refreshing: Optional[asyncio.Task] = None
+        # Rate recovered since the last lease, written to the shared bucket with the next one
+        self._pending_recovery = 0.0
+        self._interactive_waiting = 0
+        self._throttled_at = 0.0
+
+    def _refill(self, state: Dict[str, float], now: float) -> Tuple[float, float]:
+        elapsed = max(0.0, now - state["updated_at"])
+        factor = state["rate_factor"]
+        requests = min(self.request_capacity, state["requests"] + elapsed * self.request_capacity / 60 * factor)
+        tokens = min(self.token_capacity, state["tokens"] + elapsed * self.token_capacity / 60 * factor)
+        return requests, tokens
+
+    # Take at least `need` and up to `want` (requests, tokens) from a bucket. Returns the wait in
+    # seconds before `need` is available (0 if it was taken), the bucket's new state and what was taken.
+    def _take(self, state: Dict[str, float], now: float, need: Tuple[float, float], want: Tuple[float, float],
+              lane: str) -> Tuple[float, Optional[Dict[str, float]], Tuple[float, float]]:
+        requests, tokens = self._refill(state, now)
+        floor = self.reserve if lane == BATCH else 0.0
+        spare_requests = requests - floor * self.request_capacity
+        spare_tokens = tokens - floor * self.token_capacity
+        if spare_requests >= need[0] and spare_tokens >= need[1]:
+            taken = (max(need[0], min(want[0], spare_requests)), max(need[1], min(want[1], spare_tokens)))
+            new_state = {"requests": requests - taken[0], "tokens": tokens - taken[1], "rate_factor": state["rate_factor"], "updated_at": now}
+            return 0.0, new_state, taken
+
+        factor = state["rate_factor"]
+        wait = max((need[0] - spare_requests) * 60 / (self.request_capacity * factor),
+                   (need[1] - spare_tokens) * 60 / (self.token_capacity * factor))
+        return wait, None, (0.0, 0.0)
+
+    def _create_shared_bucket(self):
+        try:
+            with db_manager.get_session() as session:
+                session.add(RateLimitBucket(name=self.name, requests=self.request_capacity, tokens=self.token_capacity,
+                                            rate_factor=1.0, updated_at=time.time()))
+        except IntegrityError:
+            # Another process created the bucket row first
+            pass
+
+    def _lease_shared(self, need: Tuple[float, float], lane: str) -> float:
+        want = (LEASE_REQUESTS, max(LEASE_TOKENS, need[1]))
+        for _ in range(CAS_ATTEMPTS):
+            now = time.time()
+            with db_manager.get_session() as session:
+                bucket = session.query(RateLimitBucket).filter(RateLimitBucket.name == self.name).first()
+                if not bucket:
+                    self._create_shared_bucket()
+                    continue
+
+                self._local["rate_factor"] = bucket.rate_factor
+                if lane == BATCH and (bucket.interactive_until or 0) > now:
+                    return bucket.interactive_until - now
+
+                state = {"requests": bucket.requests, "tokens": bucket.tokens, "rate_factor": bucket.rate_factor, "updated_at": bucket.updated_at}
+                wait, new_state, taken = self._take(state, now, need, want, lane)
+                if new_state is not None:
+                    values = dict(new_state, rate_factor=min(1.0, bucket.rate_factor + self._pending_recovery))
+                elif lane == INTERACTIVE and need[0] > 0:
+                    # Hold batch leases back in every process until this caller has had its turn
+                    values = {"interactive_until": now + min(wait, 5.0) + INTERACTIVE_HOLD}
+                else:
+                    return wait
+
+                # Compare-and-set on version so two processes can't lease the same tokens
+                res = session.execute(
+                    update(RateLimitBucket)
+                    .where(RateLimitBucket.name == self.name, RateLimitBucket.version == bucket.version)
+                    .values(version=bucket.version + 1, **values)
+                    .execution_options(synchronize_session=False)
+                )
+                if res.rowcount != 1:
+                    # Another process wrote in between; read the bucket again
+                    continue
+
+            if new_state is None:
+                return wait
+            self._local["rate_factor"] = values["rate_factor"]
+            self._pending_recovery = 0.0
+            self._grant(taken)
+            return 0.0
+
+        # Lost every compare-and-set to other processes; back off for a moment
+        record_limiter_contention(self.name)
+        return random.uniform(0.01, 0.05)
+
+    def _lease_local(self, need: Tuple[float, float], lane: str) -> float:
+        want = (LEASE_REQUESTS, max(LEASE_TOKENS, need[1]))
+        wait, new_state, taken = self._take(self._local, time.time(), need, want, lane)
+        if new_state is None:
+            return wait
+        self._local = new_state
+        self._grant(taken)
+        return 0.0
+
+    def _grant(self, taken: Tuple[float, float]):
+        self._lease["requests"] += taken[0]
+        self._lease["tokens"] += taken[1]
+
+    def _lease_more(self, need: Tuple[float, float], lane: str) -> float:
+        """Add to this process's lease; returns the wait before `need` can be leased, 0 once it was."""
+        if self.shared:
+            try:
+                return self._lease_shared(need, lane)
+            except Exception as e:
+                logger.warning(f"Shared rate limit bucket unavailable, limiting this process only: {e}")
+                self.shared = False
+        return self._lease_local(need, lane)
+
+    async def _refresh_lease(self, need: Tuple[float, float], lane: str) -> float:
+        return self._lease_more(need, lane)
+
+    def _start_refresh(self, need: Tuple[float, float], lane: str) -> asyncio.Task:
+        # One lease refresh at a time per process; callers that need it meanwhile wait for that one
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._refresh_lease(need, lane))
+        return self._refreshing
+
+    def _spend(self, cost: float) -> bool:
+        if self._lease["requests"] >= 1 and self._lease["tokens"] >= cost:
+            self._lease["requests"] -= 1
+            self._lease["tokens"] -= cost
+            return True
+        return False
+
+    async def acquire(self, cost: int, lane: Optional[str] = None):
+        """Wait until one request and `cost` tokens are available in the caller's lane."""
+        lane = lane or current_lane()
+        # A single request larger than the reserved-off bucket must still be able to run eventually
+        cost = min(cost, self.token_capacity * (1 - self.reserve))
+        started = time.monotonic()
+        if lane == INTERACTIVE:
+            self._interactive_waiting += 1
+        try:
+            while True:
+                if lane == BATCH and self._interactive_waiting:
+                    await asyncio.sleep(0.05)
+                    continue
+                if self._spend(cost):
+                    # Top the lease up in the background before the next callers run out
+                    if self._lease["requests"] < LEASE_REQUESTS * LEASE_REFRESH_AT:
+                        self._start_refresh((0.0, 0.0), lane)
+                    break
+                need = (max(0.0, 1 - self._lease["requests"]), max(0.0, cost - self._lease["tokens"]))
+                wait = await asyncio.shield(self._start_refresh(need, lane))
+                if wait > 0:
+                    # Jitter so waiters across processes don't all retry at the same instant
+                    await asyncio.sleep(min(wait, 5.0) * random.uniform(1.0, 1.2))
+        finally:
+            if lane == INTERACTIVE:
+                self._interactive_waiting -= 1
+        record_limiter_wait(lane, time.monotonic() - started)
+
+    def settle(self, estimated: int, actual: Optional[int]):
+        """Give back (or charge) the difference between the estimated and the reported token usage."""
+        if actual is None or actual == estimated:
+            return
+        # Settled against the lease, so the bucket sees it with the next lease instead of on every call
+        self._lease["tokens"] += estimated - actual
+
+    def _throttle_shared(self):
+        for _ in range(CAS_ATTEMPTS):
+            now = time.time()
+            with db_manager.get_session() as session:
+                bucket = session.query(RateLimitBucket).filter(RateLimitBucket.name == self.name).first()
+                if not bucket:
+                    return
+                state = {"requests": bucket.requests, "tokens": bucket.tokens, "rate_factor": bucket.rate_factor, "updated_at": bucket.updated_at}
+                # Refill at the old rate up to now first, so moving updated_at doesn't drop the tokens earned meanwhile
+                _, tokens = self._refill(state, now)
+                factor = max(MIN_RATE_FACTOR, bucket.rate_factor / 2)
+                res = session.execute(
+                    update(RateLimitBucket)
+                    .where(RateLimitBucket.name == self.name, RateLimitBucket.version == bucket.version)
+                    .values(version=bucket.version + 1, rate_factor=factor, requests=0.0, tokens=tokens, updated_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+                if res.rowcount == 1:
+                    self._local["rate_factor"] = factor
+                    return
+        record_limiter_contention(self.name)
+        logger.warning(f"Could not record throttling of {self.name} in the shared bucket")
+
+    def throttle(self):
+        """Multiplicative decrease after a 429; the requests are also emptied so callers back off immediately."""
+        # Concurrent calls usually get their 429s together; count them as one signal
+        if time.monotonic() - self._throttled_at < 1.0:
+            return
+        self._throttled_at = time.monotonic()
+        self._pending_recovery = 0.0
+        self._lease["requests"] = min(self._lease["requests"], 0.0)
+        if self.shared:
+            try:
+                self._throttle_shared()
+            except Exception as e:
+                logger.warning(f"Failed to update shared rate limit bucket: {e}")
+        else:
+            now = time.time()
+            _, tokens = self._refill(self._local, now)
+            factor = max(MIN_RATE_FACTOR, self._local["rate_factor"] / 2)
+            self._local.update(rate_factor=factor, requests=0.0, tokens=tokens, updated_at=now)
+        logger.warning(f"Rate limited by {self.name}, refill rate now {self._local['rate_factor']:.0%} of the configured limit")
+
+    def recover(self):
+        """Additive increase after a successful call; the shared rate picks it up with the next lease."""
+        factor = self._local["rate_factor"] + self._pending_recovery
+        if factor >= 1.0:
+            return
+        if self.shared:
+            self._pending_recovery += RATE_RECOVERY
+        else:
+            self._local["rate_factor"] = min(1.0, factor + RATE_RECOVERY)
+
+    async def call(self, create: Callable[[], Awaitable[Any]], params: Dict[str, Any], stage: str = None) -> Any:
+        """Run create() within the rate limits, retrying transient errors with jittered backoff."""
+        cost = estimate_tokens(params)
+        for attempt in range(MAX_RETRIES + 1):
+            await self.acquire(cost)
+            try:
+                response = await create()
+            except Exception as e:
+                if not _is_retryable(e) or attempt == MAX_RETRIES:
+                    raise
+                if isinstance(e, openai.RateLimitError):
+                    self.throttle()
+                    reason = "rate_limit"
+                else:
+                    reason = "server_error"
+                record_llm_retry(stage or "unknown", reason)
+
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                delay = max(delay, _retry_after(e) or 0)
+                logger.warning(f"{stage or 'LLM'} call failed ({type(e).__name__}), retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            self.recover()
+            usage = getattr(response, "usage", None)
+            self.settle(cost, getattr(usage, "total_tokens", None))
+            return response
+
+# Global instance
+rate_limiter = RateLimiter()
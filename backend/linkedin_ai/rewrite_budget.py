@@ -0,0 +1,93 @@
+"""
+When to stop rewriting.
+
+The rewrite loop is the most expensive serial part of a run. Each loop is one rewrite call
+and one evaluate call. rewrite_budget caps the loops per user. It estimates from the user's
+recent GeneratedPost rows how often reaching a given loop still ended in a passing post.
+ConvergenceCheck stops the loop early when scores plateau or a rewrite barely changes the text.
+"""
+import os
+import random
+import logging
+from typing import List, Optional
+from thefuzz import fuzz
+from database import db_manager
+from models import GeneratedPost
+from metrics import record_rewrite_stop
+
+logger = logging.getLogger(__name__)
+
+# Recent posts per user looked at when sizing the budget, and the fewest needed to trust them
+HISTORY_SIZE = int(os.getenv("REWRITE_HISTORY_SIZE", 30))
+HISTORY_MIN_POSTS = int(os.getenv("REWRITE_HISTORY_MIN_POSTS", 5))
+# A loop stays in the budget while at least this share of runs that reached it ended up passing
+MIN_LOOP_SUCCESS_RATE = float(os.getenv("REWRITE_MIN_LOOP_SUCCESS_RATE", 0.15))
+# Share of runs given the full budget anyway, so later loops keep being measured
+EXPLORE_RATE = float(os.getenv("REWRITE_EXPLORE_RATE", 0.1))
+# Rewrites in a row without beating the best score before the loop gives up
+PATIENCE = int(os.getenv("REWRITE_PATIENCE", 1))
+# fuzz.ratio between consecutive versions at or above which the rewrite has converged
+CONVERGED_RATIO = int(os.getenv("REWRITE_CONVERGED_RATIO", 97))
+
+def rewrite_budget(user_id: str, max_loops: int, min_score: float) -> int:
+    """Number of rewrite loops worth spending on this user's next post (between 1 and max_loops)."""
+    if max_loops <= 1 or random.random() < EXPLORE_RATE:
+        return max_loops
+    try:
+        with db_manager.get_session() as session:
+            history = session.query(GeneratedPost.generation_loops, GeneratedPost.score)\
+                .filter(GeneratedPost.user_id == user_id)\
+                .order_by(GeneratedPost.created_at.desc())\
+                .limit(HISTORY_SIZE).all()
+    except Exception as e:
+        logger.warning(f"Could not load rewrite history for user {user_id}: {e}")
+        return max_loops
+
+    if len(history) < HISTORY_MIN_POSTS:
+        return max_loops
+
+    budget = 1
+    for loop in range(2, max_loops + 1):
+        reached = [score for loops, score in history if (loops or 0) >= loop]
+        if len(reached) < HISTORY_MIN_POSTS:
+            # Too little evidence about this loop to cut it
+            budget = loop
+            continue
+        # Runs stop rewriting once they pass, so a passing score after reaching `loop` came from it or a later loop
+        success_rate = sum(1 for score in reached if score >= min_score) / len(reached)
+        if success_rate < MIN_LOOP_SUCCESS_RATE:
+            break
+        budget = loop
+
+    if budget < max_loops:
+        logger.info(f"Rewrite budget for user {user_id} is {budget} of {max_loops} loops based on {len(history)} recent posts")
+    return budget
+
+class ConvergenceCheck:
+    """Tracks scores across the rewrite loop and says when further rewrites are unlikely to help."""
+
+    def __init__(self, initial_score: float, patience: int = PATIENCE, converged_ratio: int = CONVERGED_RATIO):
+        self.best_score = initial_score
+        self.scores: List[float] = [initial_score]
+        self.patience = patience
+        self.converged_ratio = converged_ratio
+        self.stale = 0
+
+    def update(self, previous_post: str, post: str, score: float) -> Optional[str]:
+        """Record a rewrite and its score; return why the loop should stop, or None to carry on."""
+        self.scores.append(score)
+        if score > self.best_score:
+            self.best_score = score
+            self.stale = 0
+        else:
+            self.stale += 1
+
+        reason = None
+        if fuzz.ratio(previous_post, post) >= self.converged_ratio:
+            reason = "converged"
+        elif self.stale >= self.patience:
+            reason = "plateau"
+        if reason:
+            record_rewrite_stop(reason)
+            logger.info(f"Stopping rewrites early ({reason}); scores so far {self.scores}")
+        return reason
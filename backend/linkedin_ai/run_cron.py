@@ -1,17 +1,35 @@
+import os
+import argparse
 import logging
 import traceback
-from datetime import datetime, timezone, time
+from datetime import datetime, timezone, time, timedelta
 import asyncio
+from sqlalchemy import or_, and_
 from dotenv import load_dotenv
 load_dotenv()
 from app import app
 from database import db_manager
-from models import User, GeneratedPost 
+from models import User, GeneratedPost, PipelineRun, LLMBatchRequest
 from linkedin_ai.pipeline import run_pipeline
+from linkedin_ai.rate_limiter import priority, BATCH
+from linkedin_ai.client import get_provider
+from linkedin_ai.batch import BatchCollector, create_batch_provider
+from linkedin_ai.topic_generator import refill_topic_pool
+from linkedin_ai.usage import rollup_day
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
 logger = logging.getLogger(__name__)
 
+# Run scheduled pipelines through the provider's batch API instead of real-time calls
+CRON_BATCH_MODE = os.getenv("CRON_BATCH_MODE", "false").lower() == "true"
+# Attempts after which a failed scheduled run is left alone
+RESUME_MAX_ATTEMPTS = 3
+# Seconds after which a "running" scheduled run nobody has touched is treated as abandoned (e.g. the
+# cron process was killed); runs waiting on a batch are touched every LLM_BATCH_RUN_HEARTBEAT seconds
+RESUME_STALE_AFTER = int(os.getenv("CRON_RESUME_STALE_AFTER", 15 * 60))
+# Users whose topic pools are refilled at the same time
+TOPIC_POOL_REFILL_CONCURRENCY = int(os.getenv("TOPIC_POOL_REFILL_CONCURRENCY", 5))
+
 def is_due(session, user: User, now_utc: datetime) -> bool:
     try:
         frequency = user.scheduler_frequency.lower()
@@ -64,16 +82,40 @@ def is_due(session, user: User, now_utc: datetime) -> bool:
         logger.error(f"Error checking 'is_due' for user {user.id}: {e}")
         return False
 
-async def run_pipeline_with_context(user_id: str):
+def find_resumable_runs(session, batch: bool = CRON_BATCH_MODE, stale_after: int = RESUME_STALE_AFTER):
+    """
+    Unfinished scheduled runs to resume from their checkpoints: failed ones, and "running" ones whose
+    process went away without marking them (not touched for `stale_after` seconds).
+
+    In batch mode these are the runs that already sent requests to a batch; in real-time mode, the
+    scheduled runs (not started by a queued job, which its retries resume).
+    """
+    stale_before = datetime.utcnow() - timedelta(seconds=stale_after)
+    query = session.query(PipelineRun)
+    if batch:
+        query = query.join(LLMBatchRequest, LLMBatchRequest.run_id == PipelineRun.id)
+    else:
+        query = query.filter(PipelineRun.job_id.is_(None), PipelineRun.manual_topic.is_(None))
+    return query\
+        .filter(
+            or_(PipelineRun.status == "failed",
+                and_(PipelineRun.status == "running", PipelineRun.updated_at < stale_before)),
+            PipelineRun.attempts < RESUME_MAX_ATTEMPTS,
+        )\
+        .distinct()\
+        .all()
+
+async def run_pipeline_with_context(user_id: str, run_id: str = None):
     try:
-        with app.app_context():
-            await run_pipeline(user_id=user_id, manual_topic=None)
+        # Scheduled runs share the OpenAI key with manual runs and give way to them
+        with app.app_context(), priority(BATCH):
+            await run_pipeline(user_id=user_id, manual_topic=None, run_id=run_id)
     except Exception as e:
         logger.error(f"Error during run_pipeline_with_context for user {user_id}: {e}")
         raise e
 
-async def run_jobs():
-    logger.info("Cron job started: Checking for due users...")
+async def run_jobs(batch: bool = CRON_BATCH_MODE):
+    logger.info(f"Cron job started ({'batch' if batch else 'real-time'} mode): Checking for due users...")
     now_utc = datetime.now(timezone.utc)
     
     tasks_to_run = []
@@ -96,6 +138,14 @@ async def run_jobs():
                         logger.info(f"User {user.id} is due. Adding to task queue.")
                         tasks_to_run.append(run_pipeline_with_context(user_id=user.id))
                         user_ids_to_run.append(user.id)
+
+                for run in find_resumable_runs(session, batch=batch):
+                    if run.user_id in user_ids_to_run:
+                        # The user's new run this time round is enough; the old one is retried next time
+                        continue
+                    logger.info(f"Resuming pipeline run {run.id} for user {run.user_id}.")
+                    tasks_to_run.append(run_pipeline_with_context(user_id=run.user_id, run_id=run.id))
+                    user_ids_to_run.append(run.user_id)
             
             if not tasks_to_run:
                 logger.info("No users are due in the current time window.")
@@ -103,23 +153,60 @@ async def run_jobs():
 
             logger.info(f"Running pipelines for {len(tasks_to_run)} users: {user_ids_to_run}")
             
-            results = await asyncio.gather(*tasks_to_run, return_exceptions=True)
+            if batch:
+                # Each stage's prompts from all users go out as one batch; pipelines advance as batches finish
+                async with BatchCollector(create_batch_provider(get_provider())):
+                    results = await asyncio.gather(*tasks_to_run, return_exceptions=True)
+            else:
+                results = await asyncio.gather(*tasks_to_run, return_exceptions=True)
             
             logger.info("Async gather finished. Checking results...")
 
             for user_id, result in zip(user_ids_to_run, results):
                 if isinstance(result, Exception):
-                    logger.error(f"--- PIPELINE FAILED for User: {user.id} ---")
+                    logger.error(f"--- PIPELINE FAILED for User: {user_id} ---")
                     logger.error(f"Error Type: {type(result).__name__}")
                     logger.error(f"Error Message: {result}")
                     traceback.print_exception(type(result), result, result.__traceback__)
                 else:
-                    logger.info(f"Pipeline for User: {user.id} completed successfully.")
+                    logger.info(f"Pipeline for User: {user_id} completed successfully.")
 
         except Exception as e:
             logger.critical(f"FATAL: Cron job failed during main user query. {e}")
             logger.critical(traceback.format_exc())
 
+async def refill_topic_pools():
+    """Top up the topic pool of every scheduled user. Meant to run off-peak, e.g. nightly."""
+    with db_manager.get_session() as session:
+        user_ids = [user_id for (user_id,) in session.query(User.id).filter(User.scheduler_active == True).all()]
+    logger.info(f"Refilling topic pools for {len(user_ids)} scheduled users")
+
+    semaphore = asyncio.Semaphore(TOPIC_POOL_REFILL_CONCURRENCY)
+
+    async def refill(user_id: str):
+        async with semaphore:
+            with priority(BATCH):
+                return await refill_topic_pool(user_id)
+
+    results = await asyncio.gather(*[refill(user_id) for user_id in user_ids], return_exceptions=True)
+    for user_id, result in zip(user_ids, results):
+        if isinstance(result, Exception):
+            logger.error(f"Topic pool refill failed for user {user_id}: {result}")
+    logger.info(f"Topic pools refilled: {sum(r for r in results if isinstance(r, int))} topics added")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline for every user who is due")
+    parser.add_argument("--batch", action="store_true", default=CRON_BATCH_MODE,
+                        help="Send LLM calls through the batch API (cheaper, results within hours)")
+    parser.add_argument("--refill-topic-pools", action="store_true",
+                        help="Refill every scheduled user's topic pool instead of running pipelines (schedule off-peak)")
+    parser.add_argument("--rollup-llm-usage", action="store_true",
+                        help="Roll yesterday's (UTC) LLM usage up into llm_usage_daily instead of running pipelines (schedule daily)")
+    args = parser.parse_args()
     with app.app_context():
-        asyncio.run(run_jobs())
\ No newline at end of file
+        if args.refill_topic_pools:
+            asyncio.run(refill_topic_pools())
+        elif args.rollup_llm_usage:
+            rollup_day(datetime.utcnow().date() - timedelta(days=1))
+        else:
+            asyncio.run(run_jobs(batch=args.batch))
\ No newline at end of file
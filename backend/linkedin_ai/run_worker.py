@@ -0,0 +1,205 @@
+import os
+import time
+import signal
+import socket
+import asyncio
+import logging
+import traceback
+from dotenv import load_dotenv
+load_dotenv()
+from app import app
+from job_queue import job_queue
+from brand_brief_service import brand_brief_service
+from linkedin_ai.pipeline import run_pipeline, deliver_post
+from linkedin_ai.brief_digest import get_brief_digest, brief_hash
+from linkedin_ai.topic_generator import refill_topic_pool
+from linkedin_ai.rate_limiter import priority, BATCH
+from linkedin_ai.usage import current_user
+from linkedin_ai.checkpoints import RESUMABLE_STATUSES
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+# How many pipelines this worker process runs at once
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", 4))
+# Seconds to sleep when the queue is empty
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", 2))
+# Seconds between lock renewals; must stay well below JOB_VISIBILITY_TIMEOUT
+HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", job_queue.visibility_timeout / 3))
+# Seconds of streamed tokens merged into a single *_chunk event
+CHUNK_FLUSH_INTERVAL = float(os.getenv("WORKER_CHUNK_FLUSH_INTERVAL", 0.25))
+
+class JobEventWriter:
+    """Progress callback that stores job events, merging streamed *_chunk events so tokens don't become one row each."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.pending = None
+        self.pending_since = 0.0
+
+    def __call__(self, stage: str, data: dict):
+        if stage.endswith("_chunk"):
+            if self.pending and self._stream_key(stage, data) == self._stream_key(*self.pending):
+                self.pending[1]["text"] += data.get("text", "")
+            else:
+                self.flush()
+                self.pending = (stage, dict(data))
+                self.pending_since = time.monotonic()
+
+            if time.monotonic() - self.pending_since >= CHUNK_FLUSH_INTERVAL:
+                self.flush()
+            return
+
+        self.flush()
+        job_queue.add_event(self.job_id, stage, data)
+
+    # Chunks belong to the same stream when everything but the text matches (stage, loop, candidate)
+    @staticmethod
+    def _stream_key(stage: str, data: dict):
+        return stage, sorted((k, v) for k, v in data.items() if k != "text")
+
+    def flush(self):
+        if self.pending:
+            stage, data = self.pending
+            self.pending = None
+            job_queue.add_event(self.job_id, stage, data)
+
+async def run_manual_pipeline_job(job: dict, progress) -> dict:
+    payload = job["payload"]
+    return await run_pipeline(
+        user_id=job["user_id"],
+        manual_topic=payload.get("topic"),
+        brief_type=payload.get("brief_type", "active"),
+        progress=progress,
+        stream_tokens=payload.get("stream", False),
+        # Retries of the job resume its pipeline run from the last checkpoint
+        job_id=job["id"],
+    )
+
+async def run_brief_digest_job(job: dict, progress) -> dict:
+    # Queued when a brief changes so the first pipeline run doesn't pay for the digest
+    brief = brand_brief_service.get_brand_brief(job["user_id"], job["payload"].get("brief_type", "active"))
+    if not brief:
+        return {"status": "failure", "message": "No brand brief to digest"}
+    # Nobody is waiting on it, so it yields to manual runs at the rate limiter
+    with priority(BATCH):
+        digest = await get_brief_digest(brief)
+    return {"status": "success", "message": "Brief digest ready", "content_hash": brief_hash(brief), "digest_chars": len(digest)}
+
+async def run_topic_pool_refill_job(job: dict, progress) -> dict:
+    # Queued when a brief changes; nobody is waiting on it either
+    with priority(BATCH):
+        added = await refill_topic_pool(job["user_id"], job["payload"].get("brief_type", "active"))
+    return {"status": "success", "message": "Topic pool refilled", "added": added}
+
+async def run_deliver_post_job(job: dict, progress) -> dict:
+    # Queued when Notion or Make was down; a target that is still down raises and one that refuses the
+    # post gives an error status, so either way the job is retried with backoff
+    payload = job["payload"]
+    delivered = await deliver_post(payload["post_id"], payload["target"], payload.get("is_manual", False))
+    if not delivered:
+        return {"status": "error", "message": f"{payload['target']} rejected the post"}
+    return {"status": "success", "message": f"Post delivered to {payload['target']}"}
+
+# Job kind -> coroutine(job, progress) that runs it and returns the pipeline result
+JOB_HANDLERS = {
+    "manual_pipeline": run_manual_pipeline_job,
+    "brief_digest": run_brief_digest_job,
+    "topic_pool_refill": run_topic_pool_refill_job,
+    "deliver_post": run_deliver_post_job,
+}
+
+async def _heartbeat(job_id: str, worker_id: str, work: asyncio.Future) -> bool:
+    """Renew the job's lock while it runs; once the lock is lost, cancel the work and return True."""
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        if not job_queue.heartbeat(job_id, worker_id):
+            # Another worker may already have claimed the job; carrying on would run it (and post it) twice
+            logger.warning(f"Lost lock on job {job_id}, cancelling it")
+            work.cancel()
+            return True
+
+async def process_job(job: dict, worker_id: str):
+    job_id = job["id"]
+    handler = JOB_HANDLERS.get(job["kind"])
+    if not handler:
+        job_queue.fail(job_id, worker_id, f"Unknown job kind: {job['kind']}", retry=False)
+        return
+
+    # Stage events are stored per job and streamed by GET /api/jobs/<id>/events
+    progress = JobEventWriter(job_id)
+    current_user.set(job.get("user_id"))
+
+    progress("job_started", {"attempt": job["attempts"], "max_attempts": job["max_attempts"]})
+    async def run_in_app():
+        # Held around the await, so the handler runs inside a live app context
+        with app.app_context():
+            return await handler(job, progress)
+
+    work = asyncio.ensure_future(run_in_app())
+    heartbeat = asyncio.create_task(_heartbeat(job_id, worker_id, work))
+    try:
+        result = await work
+
+        progress("finished", {"status": result.get("status"), "message": result.get("message")})
+        # The pipeline reports crashes and failed deliveries as a status instead of raising; failing
+        # the job retries it, and the retry resumes the run from its checkpoints
+        if result.get("status") in RESUMABLE_STATUSES:
+            job_queue.fail(job_id, worker_id, result.get("message", "Pipeline error"), result=result)
+        else:
+            job_queue.complete(job_id, worker_id, result)
+        logger.info(f"Job {job_id} finished with status: {result.get('status')}")
+
+    except asyncio.CancelledError:
+        if heartbeat.done() and not heartbeat.cancelled() and heartbeat.result():
+            # The job belongs to whichever worker holds its lock now
+            logger.warning(f"Job {job_id} stopped after losing its lock")
+            return
+        raise
+    except Exception as e:
+        logger.error(f"Job {job_id} crashed: {e}")
+        logger.error(traceback.format_exc())
+        progress("finished", {"status": "error", "message": str(e)})
+        job_queue.fail(job_id, worker_id, str(e))
+    finally:
+        heartbeat.cancel()
+
+async def run_worker():
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stopping = asyncio.Event()
+    in_flight = set()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    logger.info(f"Worker {worker_id} started with concurrency {WORKER_CONCURRENCY}")
+
+    while not stopping.is_set():
+        free_slots = WORKER_CONCURRENCY - len(in_flight)
+        jobs = []
+        if free_slots > 0:
+            try:
+                jobs = job_queue.claim(worker_id, limit=free_slots)
+            except Exception as e:
+                logger.error(f"Failed to claim jobs: {e}")
+
+        for job in jobs:
+            task = asyncio.create_task(process_job(job, worker_id))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+        if not jobs:
+            try:
+                await asyncio.wait_for(stopping.wait(), timeout=POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    # Let running pipelines finish; anything killed mid-run is recovered by the visibility timeout
+    if in_flight:
+        logger.info(f"Worker {worker_id} shutting down, waiting for {len(in_flight)} running jobs")
+        await asyncio.gather(*in_flight, return_exceptions=True)
+    logger.info(f"Worker {worker_id} stopped")
+
+if __name__ == "__main__":
+    asyncio.run(run_worker())
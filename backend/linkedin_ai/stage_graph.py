@@ -0,0 +1,162 @@
+import time
+import asyncio
+import inspect
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Error policies
+RAISE = "raise"  # abort the whole graph
+SKIP = "skip"    # use the stage's default outputs and keep going
+
+class StageError(Exception):
+    """Raised when a stage with the 'raise' error policy fails or times out"""
+    def __init__(self, stage: str, error: Exception):
+        super().__init__(f"Stage '{stage}' failed: {error}")
+        self.stage = stage
+        self.error = error
+
+class Stage:
+    """
+    One node of a StageGraph.
+
+    `func` is called with the stage's inputs as keyword arguments. A stage with one output
+    returns its value directly; a stage with several outputs returns a dict keyed by output name.
+    `when` is an optional predicate on the inputs; when it returns False the stage is skipped.
+
+    When the graph runs with checkpoints, outputs that are all falsy (False, None, "", ...) are not
+    checkpointed, so a stage that reports failure by returning False runs again on resume.
+    """
+
+    def __init__(self, name: str, func: Callable, inputs: Iterable[str] = (), outputs: Iterable[str] = (),
+                 timeout: Optional[float] = None, on_error: str = RAISE, default: Any = None,
+                 when: Optional[Callable[..., bool]] = None):
+        if on_error not in (RAISE, SKIP):
+            raise ValueError(f"Unknown error policy '{on_error}' for stage {name}")
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.timeout = timeout
+        self.on_error = on_error
+        self.default = default
+        self.when = when
+
+    def default_outputs(self) -> Dict[str, Any]:
+        if isinstance(self.default, dict) and len(self.outputs) > 1:
+            return {name: self.default.get(name) for name in self.outputs}
+        return {name: self.default for name in self.outputs}
+
+    async def run(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        kwargs = {name: values[name] for name in self.inputs}
+        if inspect.iscoroutinefunction(self.func):
+            result = await asyncio.wait_for(self.func(**kwargs), timeout=self.timeout)
+        else:
+            # Sync stages (DB writes) are short and run inline on the event loop
+            result = self.func(**kwargs)
+
+        if len(self.outputs) == 1:
+            return {self.outputs[0]: result}
+        if not self.outputs:
+            return {}
+        return {name: result.get(name) for name in self.outputs}
+
+class StageGraph:
+    """Runs stages as soon as their inputs are available, so independent stages run concurrently."""
+
+    def __init__(self, stages: List[Stage], initial: Iterable[str] = ()):
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError("Stage names must be unique")
+        self._validate(set(initial))
+
+    def _validate(self, initial: set):
+        producers = {}
+        for stage in self.stages.values():
+            for output in stage.outputs:
+                if output in producers or output in initial:
+                    raise ValueError(f"Output '{output}' of stage {stage.name} is produced more than once")
+                producers[output] = stage.name
+
+        # Resolving stages in dependency order also catches cycles and missing inputs
+        available = set(initial)
+        remaining = dict(self.stages)
+        while remaining:
+            ready = [name for name, stage in remaining.items() if all(i in available for i in stage.inputs)]
+            if not ready:
+                missing = {i for stage in remaining.values() for i in stage.inputs if i not in available and i not in producers}
+                if missing:
+                    raise ValueError(f"No stage produces inputs: {sorted(missing)}")
+                raise ValueError(f"Stage graph has a cycle between: {sorted(remaining)}")
+            for name in ready:
+                available.update(remaining.pop(name).outputs)
+
+    async def run(self, context: Dict[str, Any],
+                  on_stage_done: Optional[Callable[[str, str, Dict[str, Any]], None]] = None,
+                  checkpoints=None) -> Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]:
+        """
+        Run every stage and return (values, report).
+
+        `values` holds the initial context plus every stage output. `report` maps stage name to
+        {"status": "ok" | "cached" | "skipped" | "failed" | "timeout", "seconds": float}.
+        With `checkpoints` (see linkedin_ai.checkpoints.RunCheckpoints), successful stage outputs
+        are stored under the stage name and stages that already have one are not run again.
+        Outputs that are all falsy (e.g. a delivery stage returning False) are not stored, so
+        those stages run again when the run is resumed.
+        """
+        values = dict(context)
+        report: Dict[str, Dict[str, Any]] = {}
+        pending = dict(self.stages)
+        running: Dict[asyncio.Task, Tuple[Stage, float]] = {}
+
+        def finish(stage: Stage, status: str, outputs: Dict[str, Any], started: float):
+            values.update(outputs)
+            report[stage.name] = {"status": status, "seconds": round(time.monotonic() - started, 3)}
+            if on_stage_done:
+                on_stage_done(stage.name, status, outputs)
+
+        try:
+            while pending or running:
+                progressed = False
+                for name, stage in list(pending.items()):
+                    if not all(i in values for i in stage.inputs):
+                        continue
+                    del pending[name]
+                    progressed = True
+                    started = time.monotonic()
+                    if checkpoints and checkpoints.has(name):
+                        finish(stage, "cached", checkpoints.get(name), started)
+                        continue
+                    if stage.when and not stage.when(**{i: values[i] for i in stage.inputs}):
+                        finish(stage, "skipped", stage.default_outputs(), started)
+                        continue
+                    running[asyncio.create_task(stage.run(values))] = (stage, started)
+
+                if not running:
+                    if not progressed:
+                        raise ValueError(f"Stages {sorted(pending)} are missing inputs from the context")
+                    continue
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    stage, started = running.pop(task)
+                    try:
+                        outputs = task.result()
+                        if checkpoints and (not stage.outputs or any(outputs.values())):
+                            checkpoints.save(stage.name, outputs)
+                        finish(stage, "ok", outputs, started)
+                    except Exception as e:
+                        status = "timeout" if isinstance(e, asyncio.TimeoutError) else "failed"
+                        logger.warning(f"Stage {stage.name} {status} after {time.monotonic() - started:.2f}s: {e!r}")
+                        if stage.on_error == RAISE:
+                            report[stage.name] = {"status": status, "seconds": round(time.monotonic() - started, 3)}
+                            raise StageError(stage.name, e) from e
+                        finish(stage, status, stage.default_outputs(), started)
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+
+        return values, report
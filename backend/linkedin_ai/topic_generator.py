@@ -2,11 +2,26 @@ import asyncio
 import json
 import logging
 from typing import List, Optional, Dict, Any, Tuple
-from .client import client
+from metrics import timed_stage
+from brand_brief_service import brand_brief_service
+from .client import complete
+from .topic_index import topic_index
+from .brief_digest import brief_hash
+from .brief_sections import brief_for_stage
+from .usage import current_user
+from . import topic_pool
 
 logger = logging.getLogger(__name__)
 
-async def get_topic(brand_brief: str, manual_topic: Optional[str] = None, brief_type: str = "personal") -> Dict[str, Any]:
+@timed_stage("get_topic")
+async def get_topic(brand_brief: str, manual_topic: Optional[str] = None, brief_type: str = "personal", user_id: Optional[str] = None,
+                    pool_hash: Optional[str] = None) -> Dict[str, Any]:
+    """
+    The topic for a run: the manual one, the best pooled topic or a freshly generated one.
+
+    `pool_hash` is brief_hash() of the raw brief the pool was filled for; brand_brief may be a
+    digest or a cut-down brief, which differs from run to run (e.g. when the digest fails).
+    """
     if manual_topic:
         return {
             "topic": manual_topic,
@@ -14,11 +29,28 @@ async def get_topic(brand_brief: str, manual_topic: Optional[str] = None, brief_
             "score": None,
             "brief_type": brief_type # track brief type for post
                 }
+
+    if user_id:
+        # Topics generated and scored off-peak save both LLM calls below
+        pooled = await topic_pool.pop_topic(user_id, brief_type, pool_hash or brief_hash(brand_brief))
+        if pooled:
+            logger.info(f"Using pooled topic for user {user_id}: {pooled['topic']}")
+            return {
+                "topic": pooled["topic"],
+                "source": "pool",
+                "score": pooled["score"],
+                "brief_type": brief_type
+            }
+
     try:
         topics = await generate_best_topic(brand_brief, brief_type)
         if not topics:
             raise ValueError("No topics were generated")
 
+        if user_id:
+            # Don't spend a scoring call (or a whole pipeline) on topics the user already covered
+            topics = await topic_index.filter_new(user_id, topics)
+
         scored = await score_topics(topics, brand_brief, brief_type)
         if not scored:
             raise ValueError("No topics were scored")
@@ -45,6 +77,46 @@ async def get_topic(brand_brief: str, manual_topic: Optional[str] = None, brief_
         "brief_type": brief_type
     }
 
+# Topics asked for per generate call while refilling the pool, and calls allowed per refill
+REFILL_BATCH = 10
+REFILL_MAX_ROUNDS = 3
+
+async def refill_topic_pool(user_id: str, brief_type: str = "active") -> int:
+    """Top the user's topic pool up to POOL_SIZE unused topics for their current brief; returns how many were added."""
+    current_user.set(user_id)
+    if brief_type == "active":
+        brief_type = brand_brief_service.get_brand_brief_info(user_id).get("active_brand_brief", "personal")
+    brief = brand_brief_service.get_brand_brief(user_id, brief_type)
+    if not brief:
+        return 0
+
+    # Keyed by the raw brief, so a run whose digest fails still finds the pool
+    content_hash = brief_hash(brief)
+    prompt_brief = await brief_for_stage(brief, "get_topic")
+    topic_pool.invalidate(user_id, brief_type, content_hash)
+
+    pooled = topic_pool.unused_topics(user_id, brief_type, content_hash)
+    seen = {topic.strip().lower() for topic in pooled}
+    added = 0
+    for _ in range(REFILL_MAX_ROUNDS):
+        missing = topic_pool.POOL_SIZE - len(pooled) - added
+        if missing <= 0:
+            break
+        topics = await generate_best_topic(prompt_brief, brief_type, num=REFILL_BATCH)
+        topics = [topic for topic in topics if topic.strip().lower() not in seen]
+        topics = await topic_index.filter_new(user_id, topics, keep_one=False)
+        if not topics:
+            continue
+        scored = await score_topics(topics, prompt_brief, brief_type)
+        keep = sorted((s for s in scored if s.get("topic") and (s.get("score") or 0) >= topic_pool.POOL_MIN_SCORE),
+                      key=lambda s: s["score"], reverse=True)[:missing]
+        topic_pool.add_topics(user_id, brief_type, content_hash, keep)
+        seen.update(item["topic"].strip().lower() for item in keep)
+        added += len(keep)
+
+    logger.info(f"Added {added} topics to the {brief_type} topic pool of user {user_id} ({len(pooled) + added} unused)")
+    return added
+
 async def generate_best_topic(brief: str, brief_type: str = "personal", num: int = 5, model_name: str = "gpt-3.5-turbo-1106") -> List[str]:
 
     if brief_type == "personal":
@@ -103,7 +175,8 @@ async def generate_best_topic(brief: str, brief_type: str = "personal", num: int
         }}"""
 
     try:
-        response = await client.chat.completions.create(
+        response = await complete(
+            "generate_best_topic",
             model=model_name,
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"}
@@ -142,7 +215,11 @@ async def score_topics(topics: List[str], brief: str, brief_type: str = "persona
     }}
     """
     try:
-        response = await client.chat.completions.create(
+        # Scoring the same topics against the same brief gives the same answer, so it is cached
+        response = await complete(
+            "score_topics",
+            use_cache=True,
+            cache_validate=lambda r: json.loads(r.choices[0].message.content),
             model=model_name,
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"}
@@ -0,0 +1,182 @@
+"""
+Per-user index of topics already posted about, used to drop near-duplicate topic candidates
+before they are scored.
+
+Every past GeneratedPost.topic and ManualTopic.topic gets a MinHash signature of its word
+shingles. The signatures are stored once in topic_fingerprints and bucketed in memory by
+LSH bands. A lookup only compares candidates that share a band with the new topic, so it stays
+sub-millisecond however long the history is.
+"""
+import os
+import re
+import time
+import random
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy.exc import IntegrityError
+from database import db_manager
+from models import GeneratedPost, ManualTopic, TopicFingerprint
+
+logger = logging.getLogger(__name__)
+
+# Estimated Jaccard similarity of shingles at or above which a candidate repeats an old topic
+DUPLICATE_THRESHOLD = float(os.getenv("TOPIC_DUPLICATE_THRESHOLD", 0.5))
+# Users whose index is kept in memory, least recently used evicted first
+MAX_USERS = int(os.getenv("TOPIC_INDEX_MAX_USERS", 1000))
+
+# 16 bands of 4 rows put the LSH candidate threshold at roughly 0.5 Jaccard
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_perm_rng = random.Random(1)
+_PERMUTATIONS = [(_perm_rng.randrange(1, _PRIME), _perm_rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "of", "to", "in", "on", "for", "with", "at", "by", "from",
+    "is", "are", "was", "were", "be", "it", "its", "this", "that", "your", "you", "my", "our", "we",
+    "i", "how", "why", "what", "when", "about", "as", "into", "can", "will", "not", "no", "do", "does",
+}
+WORD = re.compile(r"[a-z0-9]+")
+
+def shingles(topic: str) -> Set[str]:
+    """Normalised words and word pairs of a topic, ignoring case, punctuation and stopwords."""
+    words = [w for w in WORD.findall(topic.lower()) if w not in STOPWORDS]
+    # Crude stemming so "hiring"/"hires" and "teams"/"team" match
+    words = [w[:-1] if len(w) > 3 and w.endswith("s") else w for w in words]
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+def minhash(topic: str) -> Optional[Tuple[int, ...]]:
+    tokens = shingles(topic)
+    if not tokens:
+        return None
+    hashes = [int.from_bytes(hashlib.blake2b(t.encode("utf-8"), digest_size=8).digest(), "big") for t in tokens]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+def similarity(sig_a: Tuple[int, ...], sig_b: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of the shingles behind two signatures."""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+def _bands(signature: Tuple[int, ...]):
+    for band in range(BANDS):
+        yield band, signature[band * ROWS:(band + 1) * ROWS]
+
+class _UserIndex:
+    def __init__(self):
+        self.topics: List[str] = []
+        self.signatures: List[Tuple[int, ...]] = []
+        self.buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+        self.last_id = 0  # highest topic_fingerprints.id loaded
+
+    def add(self, topic: str, signature: Tuple[int, ...]):
+        position = len(self.signatures)
+        self.topics.append(topic)
+        self.signatures.append(signature)
+        for key in _bands(signature):
+            self.buckets.setdefault(key, []).append(position)
+
+    def closest(self, signature: Tuple[int, ...]) -> Tuple[float, Optional[str]]:
+        candidates = {position for key in _bands(signature) for position in self.buckets.get(key, ())}
+        best, match = 0.0, None
+        for position in candidates:
+            score = similarity(signature, self.signatures[position])
+            if score > best:
+                best, match = score, self.topics[position]
+        return best, match
+
+class TopicIndex:
+    def __init__(self, threshold: float = DUPLICATE_THRESHOLD, max_users: int = MAX_USERS):
+        self.threshold = threshold
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _user(self, user_id: str) -> _UserIndex:
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                index = self._users[user_id] = _UserIndex()
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return index
+
+    def _fingerprint_new_topics(self, session, user_id: str):
+        """Store signatures for posts and manual topics that have none yet."""
+        indexed = session.query(TopicFingerprint.source_id).filter(TopicFingerprint.user_id == user_id)
+        sources = [
+            ("post", session.query(GeneratedPost.id, GeneratedPost.topic)
+                .filter(GeneratedPost.user_id == user_id, ~GeneratedPost.id.in_(indexed.filter(TopicFingerprint.source == "post")))),
+            ("manual", session.query(ManualTopic.id, ManualTopic.topic)
+                .filter(ManualTopic.user_id == user_id, ~ManualTopic.id.in_(indexed.filter(TopicFingerprint.source == "manual")))),
+        ]
+        added = 0
+        for source, query in sources:
+            for source_id, topic in query.all():
+                signature = minhash(topic or "")
+                if signature is None:
+                    continue
+                session.add(TopicFingerprint(user_id=user_id, source=source, source_id=source_id, topic=topic,
+                                             signature=",".join(map(str, signature))))
+                added += 1
+        if added:
+            session.flush()
+            logger.info(f"Fingerprinted {added} new topics for user {user_id}")
+
+    def refresh(self, user_id: str):
+        """Fingerprint topics saved since the last refresh and load every fingerprint not yet in memory."""
+        index = self._user(user_id)
+        try:
+            with db_manager.get_session() as session:
+                self._fingerprint_new_topics(session, user_id)
+        except IntegrityError:
+            # Another process fingerprinted the same rows first; theirs get loaded below
+            pass
+        except Exception as e:
+            logger.warning(f"Could not fingerprint topic history for user {user_id}: {e}")
+
+        with db_manager.get_session() as session:
+            rows = session.query(TopicFingerprint.id, TopicFingerprint.topic, TopicFingerprint.signature)\
+                .filter(TopicFingerprint.user_id == user_id, TopicFingerprint.id > index.last_id)\
+                .order_by(TopicFingerprint.id).all()
+        with self._lock:
+            for row_id, topic, signature in rows:
+                if row_id > index.last_id:
+                    index.add(topic, tuple(int(value) for value in signature.split(",")))
+                    index.last_id = row_id
+
+    def closest(self, user_id: str, topic: str) -> Tuple[float, Optional[str]]:
+        """(estimated similarity, past topic) of the user's most similar past topic, from memory only."""
+        signature = minhash(topic)
+        if signature is None:
+            return 0.0, None
+        return self._user(user_id).closest(signature)
+
+    async def filter_new(self, user_id: str, topics: List[str], keep_one: bool = True) -> List[str]:
+        """
+        Drop candidates that repeat a topic the user already posted about. If every candidate is a
+        repeat, the least similar one is kept (unless keep_one is False) so the run can still go ahead.
+        """
+        try:
+            self.refresh(user_id)
+        except Exception as e:
+            logger.warning(f"Topic history unavailable for user {user_id}, keeping all candidates: {e}")
+            return topics
+
+        started = time.perf_counter()
+        checked = [(topic, *self.closest(user_id, topic)) for topic in topics]
+        fresh = [topic for topic, score, _ in checked if score < self.threshold]
+        for topic, score, match in checked:
+            if score >= self.threshold:
+                logger.info(f"Dropping topic candidate '{topic}' for user {user_id}: {score:.2f} similar to '{match}'")
+        logger.debug(f"Checked {len(topics)} topic candidates in {(time.perf_counter() - started) * 1000:.2f}ms")
+
+        if not fresh and checked and keep_one:
+            fresh = [min(checked, key=lambda item: item[1])[0]]
+            logger.warning(f"Every topic candidate repeats past topics for user {user_id}; keeping the least similar")
+        return fresh
+
+topic_index = TopicIndex()
@@ -0,0 +1,79 @@
+"""
+Pre-generated, pre-scored topics per user and brief.
+
+Scheduled runs used to spend two serial LLM calls (generate + score) to pick one topic out of
+five and throw the rest away. topic_generator.refill_topic_pool fills the pool off the hot path
+(nightly from run_cron --refill-topic-pools, or from a job when a brief changes), and get_topic
+pops the best unused entry. Entries are tied to a hash of the brief they were scored against, so editing
+the brief makes them unusable straight away.
+"""
+import os
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from database import db_manager
+from models import TopicPool
+from job_queue import job_queue
+
+logger = logging.getLogger(__name__)
+
+# Unused topics kept per user and brief; a week of daily posts by default
+POOL_SIZE = int(os.getenv("TOPIC_POOL_SIZE", 7))
+# Scored topics below this are not worth keeping
+POOL_MIN_SCORE = float(os.getenv("TOPIC_POOL_MIN_SCORE", 6))
+
+def _pop(user_id: str, brief_type: str, content_hash: str) -> Optional[Dict[str, Any]]:
+    with db_manager.get_session() as session:
+        for _ in range(3):
+            entry = session.query(TopicPool)\
+                .filter(TopicPool.user_id == user_id, TopicPool.brief_type == brief_type,
+                        TopicPool.brief_hash == content_hash, TopicPool.used_at.is_(None))\
+                .order_by(TopicPool.score.desc(), TopicPool.created_at)\
+                .first()
+            if not entry:
+                return None
+            # Conditional update, so two runs for the same user can't take the same topic
+            taken = session.query(TopicPool)\
+                .filter(TopicPool.id == entry.id, TopicPool.used_at.is_(None))\
+                .update({TopicPool.used_at: datetime.utcnow()}, synchronize_session=False)
+            if taken:
+                return {"topic": entry.topic, "score": entry.score}
+            session.expire_all()
+    return None
+
+async def pop_topic(user_id: str, brief_type: str, content_hash: str) -> Optional[Dict[str, Any]]:
+    """Take the best unused pooled topic for the brief with this brief_hash(), or None if the pool is empty."""
+    try:
+        return _pop(user_id, brief_type, content_hash)
+    except Exception as e:
+        logger.warning(f"Topic pool unavailable for user {user_id}: {e}")
+        return None
+
+def invalidate(user_id: str, brief_type: str, keep_hash: Optional[str] = None) -> int:
+    """Delete unused entries for a brief, except those scored against `keep_hash`."""
+    with db_manager.get_session() as session:
+        query = session.query(TopicPool)\
+            .filter(TopicPool.user_id == user_id, TopicPool.brief_type == brief_type, TopicPool.used_at.is_(None))
+        if keep_hash:
+            query = query.filter(TopicPool.brief_hash != keep_hash)
+        deleted = query.delete(synchronize_session=False)
+    if deleted:
+        logger.info(f"Invalidated {deleted} pooled {brief_type} topics for user {user_id}")
+    return deleted
+
+def queue_refill(user_id: str, brief_type: str) -> str:
+    return job_queue.enqueue(user_id, "topic_pool_refill", {"brief_type": brief_type})
+
+def unused_topics(user_id: str, brief_type: str, content_hash: str) -> List[str]:
+    with db_manager.get_session() as session:
+        rows = session.query(TopicPool.topic)\
+            .filter(TopicPool.user_id == user_id, TopicPool.brief_type == brief_type,
+                    TopicPool.brief_hash == content_hash, TopicPool.used_at.is_(None))\
+            .all()
+    return [row.topic for row in rows]
+
+def add_topics(user_id: str, brief_type: str, content_hash: str, scored: List[Dict[str, Any]]):
+    with db_manager.get_session() as session:
+        for item in scored:
+            session.add(TopicPool(user_id=user_id, brief_type=brief_type, brief_hash=content_hash,
+                                  topic=item["topic"], score=item["score"], reason=item.get("reason")))
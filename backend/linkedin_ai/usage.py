@@ -0,0 +1,241 @@
+"""
+LLM usage ledger.
+
+Every completion billed through client.complete / stream_completion is stored in llm_usage with
+its stage, model, token counts, cost and latency, tagged with the user and pipeline run it was made
+for. Once the run's post is saved its rows are linked to the GeneratedPost. Cache hits cost
+nothing and aren't recorded. rollup_day folds a finished day into llm_usage_daily
+(run_cron --rollup-llm-usage) and prunes raw rows older than LLM_USAGE_RETENTION_DAYS.
+"""
+import os
+import json
+import logging
+import statistics
+from contextvars import ContextVar
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import func
+from database import db_manager
+from models import GeneratedPost, LLMUsage, LLMUsageDaily
+from metrics import record_llm_usage
+from .checkpoints import current_run
+
+logger = logging.getLogger(__name__)
+
+LEDGER_ENABLED = os.getenv("LLM_USAGE_LEDGER", "true").lower() == "true"
+# Raw rows older than this are deleted once their day is rolled up
+RETENTION_DAYS = int(os.getenv("LLM_USAGE_RETENTION_DAYS", 30))
+
+# USD per million (prompt, completion) tokens, matched by longest model prefix
+DEFAULT_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "ft:gpt-4o-mini": (0.30, 1.20),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+# JSON object of model prefix -> [prompt, completion] USD per million tokens overriding the table above
+PRICES = {**DEFAULT_PRICES, **{k: tuple(v) for k, v in json.loads(os.getenv("LLM_PRICES", "{}")).items()}}
+# The batch API bills half the real-time price
+BATCH_DISCOUNT = 0.5
+
+# Id of the user the current task works for; set with the pipeline run, by jobs and by topic pool refills
+current_user: ContextVar[Optional[str]] = ContextVar("current_llm_user", default=None)
+
+def price(model: Optional[str]) -> Tuple[float, float]:
+    matches = [prefix for prefix in PRICES if (model or "").startswith(prefix)]
+    if not matches:
+        return (0.0, 0.0)
+    return PRICES[max(matches, key=len)]
+
+def cost_usd(model: Optional[str], prompt_tokens: int, completion_tokens: int, source: str = "api") -> float:
+    prompt_price, completion_price = price(model)
+    cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+    return cost * BATCH_DISCOUNT if source == "batch" else cost
+
+def record_usage(stage: Optional[str], model: Optional[str], prompt_tokens: int, completion_tokens: int,
+                 seconds: float, source: str = "api", estimated: bool = False):
+    """Store one billed completion; never raises, a ledger problem must not fail the LLM call."""
+    stage = stage or "unknown"
+    cost = cost_usd(model, prompt_tokens, completion_tokens, source)
+    record_llm_usage(stage, model or "unknown", prompt_tokens, completion_tokens, cost)
+    if not LEDGER_ENABLED:
+        return
+    try:
+        with db_manager.get_session() as session:
+            session.add(LLMUsage(
+                user_id=current_user.get(),
+                run_id=current_run.get(),
+                stage=stage,
+                model=model,
+                source=source,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                estimated=estimated,
+                cost_usd=cost,
+                latency_ms=int(seconds * 1000),
+            ))
+    except Exception as e:
+        logger.warning(f"Failed to record LLM usage for {stage}: {e}")
+
+def record_response(stage: Optional[str], params: Dict[str, Any], response: Any, seconds: float, source: str = "api"):
+    usage = getattr(response, "usage", None)
+    record_usage(stage, getattr(response, "model", None) or params.get("model"),
+                 getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0,
+                 seconds, source=source, estimated=usage is None)
+
+def record_stream(stage: Optional[str], params: Dict[str, Any], text: str, seconds: float):
+    prompt = "\n".join(str(m.get("content") or "") for m in params.get("messages", []))
+    # chars / 4, the same estimate the rate limiter uses
+    record_usage(stage, params.get("model"), len(prompt) // 4, len(text) // 4, seconds, source="stream", estimated=True)
+
+def link_run_to_post(run_id: str, post_id: str) -> int:
+    """Attach the usage of a pipeline run, resumed attempts included, to the post it produced."""
+    try:
+        with db_manager.get_session() as session:
+            return session.query(LLMUsage)\
+                .filter(LLMUsage.run_id == run_id, LLMUsage.post_id.is_(None))\
+                .update({LLMUsage.post_id: post_id}, synchronize_session=False)
+    except Exception as e:
+        logger.warning(f"Failed to link LLM usage of run {run_id} to post {post_id}: {e}")
+        return 0
+
+def _day_bounds(day: date) -> Tuple[datetime, datetime]:
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+def _aggregate(session, start: datetime, end: datetime, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    query = session.query(
+        LLMUsage.user_id, LLMUsage.stage, LLMUsage.model,
+        func.count(LLMUsage.id), func.sum(LLMUsage.prompt_tokens), func.sum(LLMUsage.completion_tokens),
+        func.sum(LLMUsage.cost_usd), func.sum(LLMUsage.latency_ms),
+    ).filter(LLMUsage.created_at >= start, LLMUsage.created_at < end)
+    if user_id:
+        query = query.filter(LLMUsage.user_id == user_id)
+    rows = query.group_by(LLMUsage.user_id, LLMUsage.stage, LLMUsage.model).all()
+    return [{
+        "user_id": row[0], "day": start.date(), "stage": row[1], "model": row[2], "calls": row[3],
+        "prompt_tokens": row[4] or 0, "completion_tokens": row[5] or 0,
+        "cost_usd": row[6] or 0.0, "latency_ms": row[7] or 0,
+    } for row in rows]
+
+def rollup_day(day: date) -> int:
+    """Replace the day's rows in llm_usage_daily with fresh totals and prune expired raw rows; returns rows written."""
+    start, end = _day_bounds(day)
+    with db_manager.get_session() as session:
+        totals = _aggregate(session, start, end)
+        session.query(LLMUsageDaily).filter(LLMUsageDaily.day == day).delete(synchronize_session=False)
+        for total in totals:
+            session.add(LLMUsageDaily(**total))
+        pruned = session.query(LLMUsage)\
+            .filter(LLMUsage.created_at < datetime.utcnow() - timedelta(days=RETENTION_DAYS))\
+            .delete(synchronize_session=False)
+    logger.info(f"Rolled up LLM usage for {day}: {len(totals)} rows, pruned {pruned} raw rows")
+    return len(totals)
+
+def daily_usage(days: int = 7, user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Usage per user, day and stage for the last `days` days. Finished days come from
+    llm_usage_daily where they have been rolled up; today and days not yet rolled up are summed
+    from the raw ledger.
+    """
+    today = datetime.utcnow().date()
+    first = today - timedelta(days=days - 1)
+    with db_manager.get_session() as session:
+        query = session.query(LLMUsageDaily).filter(LLMUsageDaily.day >= first, LLMUsageDaily.day < today)
+        if user_id:
+            query = query.filter(LLMUsageDaily.user_id == user_id)
+        rows = [{
+            "user_id": r.user_id, "day": r.day, "stage": r.stage, "model": r.model, "calls": r.calls,
+            "prompt_tokens": r.prompt_tokens, "completion_tokens": r.completion_tokens,
+            "cost_usd": r.cost_usd, "latency_ms": r.latency_ms,
+        } for r in query.all()]
+        rolled_up = {row["day"] for row in rows}
+        for offset in range(days):
+            day = first + timedelta(days=offset)
+            if day not in rolled_up:
+                rows.extend(_aggregate(session, *_day_bounds(day), user_id=user_id))
+
+    for row in rows:
+        row["day"] = row["day"].isoformat()
+    return sorted(rows, key=lambda row: (row["day"], row["user_id"] or "", row["stage"]))
+
+def _posts_per_user(start: datetime, end: datetime) -> Dict[str, int]:
+    with db_manager.get_session() as session:
+        rows = session.query(GeneratedPost.user_id, func.count(GeneratedPost.id))\
+            .filter(GeneratedPost.created_at >= start, GeneratedPost.created_at < end)\
+            .group_by(GeneratedPost.user_id).all()
+    return dict(rows)
+
+def cost_by_loops(days: int = 7) -> List[Dict[str, Any]]:
+    """Average LLM cost and latency of a post by the number of rewrite loops it took."""
+    start = datetime.utcnow() - timedelta(days=days)
+    with db_manager.get_session() as session:
+        per_post = session.query(
+            GeneratedPost.generation_loops.label("loops"),
+            func.sum(LLMUsage.cost_usd).label("cost"),
+            func.sum(LLMUsage.latency_ms).label("latency"),
+        ).join(LLMUsage, LLMUsage.post_id == GeneratedPost.id)\
+            .filter(GeneratedPost.created_at >= start)\
+            .group_by(GeneratedPost.id, GeneratedPost.generation_loops).subquery()
+        rows = session.query(per_post.c.loops, func.count(), func.avg(per_post.c.cost), func.avg(per_post.c.latency))\
+            .group_by(per_post.c.loops).order_by(per_post.c.loops).all()
+    return [{"loops": loops or 0, "posts": posts, "avg_cost_usd": round(cost or 0, 6), "avg_llm_ms": int(latency or 0)}
+            for loops, posts, cost, latency in rows]
+
+def find_outliers(days: int = 7, factor: float = 2.0) -> Dict[str, Any]:
+    """
+    Users and stages whose cost is out of line with their output.
+
+    A user is flagged when their cost per saved post is over `factor` times the median user's, or
+    when they spent without getting a post. A stage is flagged when its cost per post over the
+    last `days` days is over `factor` times what it was in the `days` before.
+    """
+    now = datetime.utcnow()
+    start, previous_start = now - timedelta(days=days), now - timedelta(days=2 * days)
+    with db_manager.get_session() as session:
+        user_costs = dict(session.query(LLMUsage.user_id, func.sum(LLMUsage.cost_usd))
+                          .filter(LLMUsage.created_at >= start, LLMUsage.user_id.isnot(None))
+                          .group_by(LLMUsage.user_id).all())
+        stage_rows = session.query(LLMUsage.stage, LLMUsage.created_at >= start, func.sum(LLMUsage.cost_usd),
+                                   func.count(LLMUsage.id), func.avg(LLMUsage.latency_ms))\
+            .filter(LLMUsage.created_at >= previous_start)\
+            .group_by(LLMUsage.stage, LLMUsage.created_at >= start).all()
+
+    posts = _posts_per_user(start, now)
+    per_post = {user: cost / posts[user] for user, cost in user_costs.items() if posts.get(user)}
+    median = statistics.median(per_post.values()) if per_post else 0.0
+    users = []
+    for user, cost in user_costs.items():
+        cost_per_post = per_post.get(user)
+        if cost_per_post is None or (median and cost_per_post > factor * median):
+            users.append({"user_id": user, "cost_usd": round(cost, 6), "posts": posts.get(user, 0),
+                          "cost_per_post": round(cost_per_post, 6) if cost_per_post is not None else None})
+    users.sort(key=lambda u: u["cost_usd"], reverse=True)
+
+    total_posts = sum(posts.values())
+    previous_posts = sum(_posts_per_user(previous_start, start).values())
+    current, previous = {}, {}
+    for stage, is_current, cost, calls, latency in stage_rows:
+        (current if is_current else previous)[stage] = {"cost_usd": cost or 0.0, "calls": calls, "avg_latency_ms": int(latency or 0)}
+    stages = []
+    for stage, usage in current.items():
+        cost_per_post = usage["cost_usd"] / total_posts if total_posts else None
+        before = previous.get(stage)
+        previous_per_post = before["cost_usd"] / previous_posts if before and previous_posts else None
+        entry = {"stage": stage, **usage, "cost_usd": round(usage["cost_usd"], 6),
+                 "cost_per_post": round(cost_per_post, 6) if cost_per_post is not None else None,
+                 "previous_cost_per_post": round(previous_per_post, 6) if previous_per_post is not None else None,
+                 "flagged": bool(cost_per_post and previous_per_post and cost_per_post > factor * previous_per_post)}
+        stages.append(entry)
+    stages.sort(key=lambda s: s["cost_usd"], reverse=True)
+
+    return {
+        "days": days,
+        "factor": factor,
+        "median_cost_per_post": round(median, 6),
+        "users": users,
+        "stages": stages,
+        "loops": cost_by_loops(days),
+    }
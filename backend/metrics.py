@@ -0,0 +1,249 @@
+"""
+Prometheus metrics for the pipeline.
+
+With several gunicorn workers (or the API plus linkedin_ai.run_worker) set
+PROMETHEUS_MULTIPROC_DIR to a shared, empty directory before start-up. Every
+process then writes its samples there and /metrics aggregates all of them.
+"""
+import os
+import time
+import inspect
+from functools import wraps
+from contextlib import contextmanager
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess,
+)
+
+# LLM calls take seconds; DB writes and webhooks are far quicker
+STAGE_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+PIPELINE_BUCKETS = (1, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+
+STAGE_DURATION = Histogram(
+    "relay_stage_duration_seconds",
+    "Duration of a pipeline stage (LLM call, DB save or integration call)",
+    ["stage", "outcome"],
+    buckets=STAGE_BUCKETS,
+)
+PIPELINE_DURATION = Histogram(
+    "relay_pipeline_duration_seconds",
+    "Duration of a full run_pipeline call",
+    ["status"],
+    buckets=PIPELINE_BUCKETS,
+)
+PIPELINE_RUNS = Counter(
+    "relay_pipeline_runs_total",
+    "Pipeline runs by final status",
+    ["status"],
+)
+PIPELINE_LOOPS = Counter(
+    "relay_pipeline_rewrite_loops_total",
+    "Pipeline runs by number of rewrite loops used",
+    ["loops"],
+)
+POST_SCORES = Counter(
+    "relay_post_scores_total",
+    "Final evaluation scores of generated posts, rounded down to an integer",
+    ["score"],
+)
+LLM_RETRIES = Counter(
+    "relay_llm_retries_total",
+    "LLM calls retried after a 429, 5xx or connection error",
+    ["stage", "reason"],
+)
+LIMITER_WAIT = Histogram(
+    "relay_llm_limiter_wait_seconds",
+    "Time an LLM call waited for the shared rate limiter",
+    ["lane"],
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+LIMITER_CONTENTION = Counter(
+    "relay_llm_limiter_contention_total",
+    "Rate limiter updates that lost every compare-and-set to other processes",
+    ["bucket"],
+)
+HEURISTIC_DECISIONS = Counter(
+    "relay_heuristic_decisions_total",
+    "Local pre-scorer decisions on drafts and rewrites",
+    ["decision"],
+)
+JUDGE_AGREEMENT = Counter(
+    "relay_judge_agreement_total",
+    "Cheap scorer verdicts compared with the LLM judge",
+    ["scorer", "agreed"],
+)
+LLM_HEDGES = Counter(
+    "relay_llm_hedges_total",
+    "Hedged LLM requests by which copy answered first",
+    ["stage", "winner"],
+)
+LLM_DEADLINES = Counter(
+    "relay_llm_deadline_exceeded_total",
+    "LLM calls that missed their stage deadline",
+    ["stage"],
+)
+CIRCUIT_STATE = Gauge(
+    "relay_circuit_state",
+    "Circuit breaker state per dependency (0 closed, 1 half-open, 2 open)",
+    ["dependency"],
+    multiprocess_mode="max",
+)
+CIRCUIT_REJECTIONS = Counter(
+    "relay_circuit_rejections_total",
+    "Calls failed fast because the dependency's circuit breaker was open",
+    ["dependency"],
+)
+EVALUATION_JUDGES = Counter(
+    "relay_evaluation_judge_total",
+    "Evaluations by the model whose score was used",
+    ["model"],
+)
+REWRITE_MODES = Counter(
+    "relay_rewrite_mode_total",
+    "Rewrites by how they were made: targeted edits, a full rewrite, or a full rewrite after edits failed",
+    ["mode"],
+)
+LLM_TOKENS = Counter(
+    "relay_llm_tokens_total",
+    "Tokens billed for LLM completions",
+    ["stage", "model", "kind"],
+)
+LLM_COST = Counter(
+    "relay_llm_cost_usd_total",
+    "Estimated USD cost of LLM completions",
+    ["stage", "model"],
+)
+BRIEF_TOKENS = Histogram(
+    "relay_brief_prompt_tokens",
+    "Estimated brief tokens per prompt after section selection",
+    ["stage"],
+    buckets=[100, 200, 400, 800, 1200, 2000, 4000, 8000],
+)
+BRIEF_TOKENS_SAVED = Counter(
+    "relay_brief_tokens_saved_total",
+    "Estimated brief tokens left out of prompts by section selection",
+    ["stage"],
+)
+PUNCHLINE_SOURCES = Counter(
+    "relay_punchline_source_total",
+    "Punchlines by how they were made: extracted locally or generated by the LLM",
+    ["source"],
+)
+REWRITE_STOPS = Counter(
+    "relay_rewrite_early_stops_total",
+    "Rewrite loops stopped before the budget ran out",
+    ["reason"],
+)
+PIPELINES_IN_FLIGHT = Gauge(
+    "relay_pipelines_in_flight",
+    "Pipelines currently running",
+    multiprocess_mode="livesum",
+)
+
+# Callbacks fn(stage, outcome, seconds) that see every raw stage timing, e.g. the benchmark suite
+_stage_observers = []
+
+def add_stage_observer(observer):
+    _stage_observers.append(observer)
+
+def remove_stage_observer(observer):
+    _stage_observers.remove(observer)
+
+@contextmanager
+def observe_stage(stage: str):
+    """Time a block as one execution of `stage`, labelled ok or error."""
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        STAGE_DURATION.labels(stage=stage, outcome=outcome).observe(seconds)
+        for observer in _stage_observers:
+            observer(stage, outcome, seconds)
+
+def timed_stage(stage: str):
+    """Decorator form of observe_stage for sync and async functions."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with observe_stage(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with observe_stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def record_evaluation_outcome(score: float, loops: int):
+    POST_SCORES.labels(score=str(int(score))).inc()
+    PIPELINE_LOOPS.labels(loops=str(loops)).inc()
+
+def record_pipeline_result(status: str, seconds: float):
+    PIPELINE_RUNS.labels(status=status).inc()
+    PIPELINE_DURATION.labels(status=status).observe(seconds)
+
+def record_llm_retry(stage: str, reason: str):
+    LLM_RETRIES.labels(stage=stage, reason=reason).inc()
+
+def record_limiter_wait(lane: str, seconds: float):
+    LIMITER_WAIT.labels(lane=lane).observe(seconds)
+
+def record_limiter_contention(bucket: str):
+    LIMITER_CONTENTION.labels(bucket=bucket).inc()
+
+def record_heuristic_decision(decision: str):
+    HEURISTIC_DECISIONS.labels(decision=decision).inc()
+
+def record_judge_agreement(scorer: str, agreed: bool):
+    JUDGE_AGREEMENT.labels(scorer=scorer, agreed=str(agreed).lower()).inc()
+
+def record_llm_hedge(stage: str, winner: str):
+    LLM_HEDGES.labels(stage=stage, winner=winner).inc()
+
+def record_llm_deadline(stage: str):
+    LLM_DEADLINES.labels(stage=stage).inc()
+
+CIRCUIT_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+
+def record_circuit_state(dependency: str, state: str):
+    CIRCUIT_STATE.labels(dependency=dependency).set(CIRCUIT_STATE_VALUES[state])
+
+def record_circuit_rejection(dependency: str):
+    CIRCUIT_REJECTIONS.labels(dependency=dependency).inc()
+
+def record_evaluation_judge(model: str):
+    EVALUATION_JUDGES.labels(model=model).inc()
+
+def record_rewrite_mode(mode: str):
+    REWRITE_MODES.labels(mode=mode).inc()
+
+def record_llm_usage(stage: str, model: str, prompt_tokens: int, completion_tokens: int, cost_usd: float):
+    LLM_TOKENS.labels(stage=stage, model=model, kind="prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(stage=stage, model=model, kind="completion").inc(completion_tokens)
+    LLM_COST.labels(stage=stage, model=model).inc(cost_usd)
+
+def record_brief_selection(stage: str, brief_tokens: int, selected_tokens: int):
+    BRIEF_TOKENS.labels(stage=stage).observe(selected_tokens)
+    BRIEF_TOKENS_SAVED.labels(stage=stage).inc(max(0, brief_tokens - selected_tokens))
+
+def record_punchline_source(source: str):
+    PUNCHLINE_SOURCES.labels(source=source).inc()
+
+def record_rewrite_stop(reason: str):
+    REWRITE_STOPS.labels(reason=reason).inc()
+
+def render_metrics():
+    """Return (body, content type) for the /metrics endpoint."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,5 +1,6 @@
+import json
 from datetime import datetime, timedelta
-from sqlalchemy import Column, String, Text, DateTime, Boolean, ForeignKey, Integer, Float, Index
+from sqlalchemy import Column, String, Text, Date, DateTime, Boolean, ForeignKey, Integer, Float, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.dialects.postgresql import UUID
@@ -61,21 +62,25 @@ class User(Base):
     def check_password(self, password):
         return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
 
-    # Update user's personal brand brief
-    def update_personal_brand_brief(self, content: str, original_filename: str = None):
+    # Update user's personal brand brief, returns True when the content changed
+    def update_personal_brand_brief(self, content: str, original_filename: str = None) -> bool:
+        changed = content.strip() != (self.personal_brand_brief_content or "")
         self.personal_brand_brief_content = content.strip()
         if original_filename:
             self.personal_brand_original_filename = original_filename
         self.personal_brand_updated_at = datetime.utcnow()
         self.updated_at = datetime.utcnow()
+        return changed
     
-    # Update user's company brand brief
-    def update_company_brand_brief(self, content: str, original_filename: str = None):
+    # Update user's company brand brief, returns True when the content changed
+    def update_company_brand_brief(self, content: str, original_filename: str = None) -> bool:
+        changed = content.strip() != (self.company_brand_brief_content or "")
         self.company_brand_brief_content = content.strip()
         if original_filename:
             self.company_brand_original_filename = original_filename
         self.company_brand_updated_at = datetime.utcnow()
         self.updated_at = datetime.utcnow()
+        return changed
     
     # Set which brand brief to use for generation
     def set_active_brand_brief(self, brief_type: str):
@@ -197,4 +202,314 @@ class ManualTopic(Base):
             'id': self.id,
             'topic': self.topic,
             'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+class PipelineJob(Base):
+    __tablename__ = "pipeline_jobs"
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    # What to run
+    kind = Column(String(50), nullable=False, default="manual_pipeline")
+    payload = Column(Text, default="{}")  # JSON encoded job arguments
+
+    # Queue state
+    status = Column(String(20), nullable=False, default="queued", index=True)  # "queued", "running", "succeeded" or "failed"
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    run_after = Column(DateTime, default=datetime.utcnow, index=True)
+
+    # Visibility timeout: a running job whose lock expires is picked up again
+    locked_by = Column(String(100))
+    locked_until = Column(DateTime, index=True)
+
+    # Outcome
+    result = Column(Text)  # JSON encoded pipeline result
+    error = Column(Text)
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+class PipelineJobEvent(Base):
+    __tablename__ = "pipeline_job_events"
+
+    # Autoincrement id doubles as the SSE event id, so clients can resume with Last-Event-ID
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String(36), ForeignKey('pipeline_jobs.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    stage = Column(String(50), nullable=False)
+    data = Column(Text, default="{}")  # JSON encoded stage output
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'stage': self.stage,
+            'data': json.loads(self.data or "{}"),
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class PipelineRun(Base):
+    __tablename__ = "pipeline_runs"
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Set when the run was started by a queued job, so retries of the job resume this run
+    job_id = Column(String(36), ForeignKey('pipeline_jobs.id', ondelete='SET NULL'), index=True)
+
+    manual_topic = Column(Text)
+    brief_type = Column(String(20), default="active")
+
+    status = Column(String(20), nullable=False, default="running")  # "running", "completed" or "failed"
+    attempts = Column(Integer, default=1, nullable=False)
+    result = Column(Text)  # JSON encoded pipeline result
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Relationship
+    stages = relationship("PipelineRunStage", back_populates="run", cascade="all, delete-orphan", order_by="PipelineRunStage.id")
+
+
+class PipelineRunStage(Base):
+    __tablename__ = "pipeline_run_stages"
+    __table_args__ = (UniqueConstraint('run_id', 'stage', name='uq_pipeline_run_stage'),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(String(36), ForeignKey('pipeline_runs.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    # e.g. "topic", "draft", "evaluate:0", "rewrite:1", "punchline", "save_post"
+    stage = Column(String(50), nullable=False)
+    output = Column(Text, nullable=False)  # JSON encoded stage output
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Relationship
+    run = relationship("PipelineRun", back_populates="stages")
+
+
+class BriefDigest(Base):
+    __tablename__ = "brief_digests"
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    # SHA-256 of the brief content, so a digest is shared by every user with the same brief
+    content_hash = Column(String(64), unique=True, nullable=False, index=True)
+    digest = Column(Text, nullable=False)
+    model = Column(String(100))
+
+    source_chars = Column(Integer)
+    digest_chars = Column(Integer)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class BriefSection(Base):
+    __tablename__ = "brief_sections"
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    # SHA-256 of the whole brief, like brief_digests; sections are shared by identical briefs
+    content_hash = Column(String(64), nullable=False, index=True)
+    position = Column(Integer, nullable=False)
+    heading = Column(String(255))
+    # voice, audience, goals, banned, themes, identity or other
+    kind = Column(String(20), nullable=False)
+    content = Column(Text, nullable=False)
+    tokens = Column(Integer)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (UniqueConstraint('content_hash', 'position', name='uq_brief_section_position'),)
+
+
+class LLMCacheEntry(Base):
+    __tablename__ = "llm_cache_entries"
+
+    # SHA-256 over model, parameters and prompt
+    key = Column(String(64), primary_key=True)
+    stage = Column(String(50), index=True)
+    model = Column(String(100))
+    response = Column(Text, nullable=False)  # JSON encoded ChatCompletion
+
+    hits = Column(Integer, default=0, nullable=False)
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+
+    # One row per upstream API key, shared by every API and worker process
+    name = Column(String(64), primary_key=True)
+
+    requests = Column(Float, nullable=False)  # request tokens currently available
+    tokens = Column(Float, nullable=False)    # LLM token budget currently available
+    rate_factor = Column(Float, default=1.0, nullable=False)  # adaptive share of the configured rate
+    interactive_until = Column(Float, default=0.0, nullable=False)  # epoch seconds until which batch leases wait for interactive callers
+
+    updated_at = Column(Float, nullable=False)  # epoch seconds of the last refill
+    version = Column(Integer, default=0, nullable=False)  # bumped on every write, for compare-and-set
+
+
+class LLMBatch(Base):
+    __tablename__ = "llm_batches"
+
+    id = Column(String(36), primary_key=True, default=generate_uuid)
+    provider = Column(String(50), nullable=False)  # "openai" or "local"
+    external_id = Column(String(255), index=True)  # the provider's batch id, set once submitted
+
+    status = Column(String(20), nullable=False, default="submitted")  # "submitted", "completed" or "failed"
+    request_count = Column(Integer, default=0, nullable=False)
+    error = Column(Text)
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime)
+
+    # Relationship
+    requests = relationship("LLMBatchRequest", back_populates="batch", cascade="all, delete-orphan")
+
+
+class LLMBatchRequest(Base):
+    __tablename__ = "llm_batch_requests"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    batch_id = Column(String(36), ForeignKey('llm_batches.id', ondelete='CASCADE'), nullable=False, index=True)
+    # Pipeline run that made the request, so an interrupted batch cron run can be resumed
+    run_id = Column(String(36), ForeignKey('pipeline_runs.id', ondelete='SET NULL'), index=True)
+
+    # SHA-256 of run, request and occurrence; the same request from a resumed run maps to the same id
+    custom_id = Column(String(64), nullable=False, index=True)
+    stage = Column(String(50))
+    params = Column(Text, nullable=False)  # JSON encoded chat completion request
+
+    status = Column(String(20), nullable=False, default="pending")  # "pending", "done" or "failed"
+    response = Column(Text)  # JSON encoded ChatCompletion
+    error = Column(Text)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Relationship
+    batch = relationship("LLMBatch", back_populates="requests")
+
+
+class JudgeAgreement(Base):
+    __tablename__ = "judge_agreements"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    run_id = Column(String(36), ForeignKey('pipeline_runs.id', ondelete='SET NULL'), index=True)
+
+    # The cheap scorer being calibrated ("heuristic", or a small model) and the LLM judge it is compared with
+    scorer = Column(String(100), nullable=False, index=True)
+    judge = Column(String(100), nullable=False)
+    decision = Column(String(20), nullable=False)  # what the scorer would have done: "reject", "accept" or "judge"
+
+    scorer_score = Column(Float)
+    judge_score = Column(Float)
+    agreed = Column(Boolean, nullable=False)  # both sides of the pass score agree
+
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class TopicFingerprint(Base):
+    __tablename__ = "topic_fingerprints"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    # Row the topic came from: "post" (generated_posts) or "manual" (manual_topics)
+    source = Column(String(20), nullable=False)
+    source_id = Column(String(36), nullable=False)
+    topic = Column(Text, nullable=False)
+    signature = Column(Text, nullable=False)  # comma separated MinHash values
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (UniqueConstraint('source', 'source_id', name='uq_topic_fingerprint_source'),)
+
+
+class TopicPool(Base):
+    __tablename__ = "topic_pool"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+
+    # Brief the topic was generated and scored against; entries for an older brief are never used
+    brief_type = Column(String(20), nullable=False)
+    brief_hash = Column(String(64), nullable=False)
+
+    topic = Column(Text, nullable=False)
+    score = Column(Float)
+    reason = Column(Text)
+
+    used_at = Column(DateTime)  # set when a pipeline run takes the topic
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (Index('ix_topic_pool_lookup', 'user_id', 'brief_type', 'brief_hash', 'used_at'),)
+
+
+class LLMUsage(Base):
+    __tablename__ = "llm_usage"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Null for calls made outside a user's work (e.g. benchmarks)
+    user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), index=True)
+    run_id = Column(String(36), index=True)
+    # Filled in once the run's post is saved
+    post_id = Column(String(36), ForeignKey('generated_posts.id', ondelete='SET NULL'), index=True)
+
+    stage = Column(String(50), nullable=False)
+    model = Column(String(100))
+    source = Column(String(10), nullable=False)  # "api", "batch" or "stream"
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    # Streams don't report usage, so their tokens are estimated from the text
+    estimated = Column(Boolean, default=False, nullable=False)
+    cost_usd = Column(Float, default=0, nullable=False)
+    latency_ms = Column(Integer)
+
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (Index('ix_llm_usage_user_created', 'user_id', 'created_at'),)
+
+
+class LLMUsageDaily(Base):
+    __tablename__ = "llm_usage_daily"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String(36), ForeignKey('users.id', ondelete='CASCADE'), index=True)
+    day = Column(Date, nullable=False, index=True)
+    stage = Column(String(50), nullable=False)
+    model = Column(String(100))
+
+    calls = Column(Integer, default=0, nullable=False)
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    cost_usd = Column(Float, default=0, nullable=False)
+    latency_ms = Column(Integer, default=0, nullable=False)  # summed over the calls
+
+    __table_args__ = (Index('ix_llm_usage_daily_user_day', 'user_id', 'day'),)
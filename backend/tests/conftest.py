@@ -0,0 +1,34 @@
+import os
+import sys
+import tempfile
+
+# Configure the app before anything imports it: a throwaway SQLite database and no real LLM calls
+_db_dir = tempfile.mkdtemp(prefix="relay-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+os.environ.setdefault("LLM_PROVIDER", "fake")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+# Integrations are required at import; nothing listens on these
+os.environ.setdefault("MAKE_WEBHOOK_URL", "http://127.0.0.1:9/make")
+os.environ.setdefault("NOTION_API_KEY", "test")
+os.environ.setdefault("NOTION_DATABASE_ID", "test")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from database import db_manager
+
+if db_manager.engine is None:
+    db_manager.init_db()
+    db_manager.engine.echo = False
+
+@pytest.fixture
+def user_id():
+    import uuid
+    from models import User
+    with db_manager.get_session() as session:
+        user = User(email=f"{uuid.uuid4().hex}@example.com", password_hash="x",
+                    personal_brand_brief_content="We write about AI for small teams.")
+        session.add(user)
+        session.flush()
+        return user.id
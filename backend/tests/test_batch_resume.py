@@ -0,0 +1,132 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+from openai.types.chat import ChatCompletion
+from database import db_manager
+from models import LLMBatch, LLMBatchRequest, PipelineRun
+from linkedin_ai.batch import BatchCollector, LocalFileBatchProvider
+from linkedin_ai.checkpoints import current_run
+from linkedin_ai.run_cron import find_resumable_runs
+
+PARAMS = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "Pick a topic"}]}
+
+def _completion(content: str) -> ChatCompletion:
+    return ChatCompletion.model_validate({
+        "id": "batch-test", "object": "chat.completion", "created": 0, "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    })
+
+class CountingResponder:
+    def __init__(self):
+        self.calls = 0
+
+    async def __call__(self, body, stage):
+        self.calls += 1
+        return _completion(f"answer {self.calls}")
+
+def _new_run(user_id: str, status: str = "running", age: timedelta = timedelta(0)) -> str:
+    with db_manager.get_session() as session:
+        run = PipelineRun(user_id=user_id, status=status)
+        session.add(run)
+        session.flush()
+        run.updated_at = datetime.utcnow() - age
+        return run.id
+
+async def _request(collector: BatchCollector, run_id: str) -> ChatCompletion:
+    current_run.set(run_id)
+    return await collector.request(PARAMS, stage="get_topic")
+
+def test_submit_poll_and_reuse_after_restart(user_id, tmp_path):
+    run_id = _new_run(user_id)
+    responder = CountingResponder()
+
+    async def first_cron():
+        async with BatchCollector(LocalFileBatchProvider(responder, directory=str(tmp_path)), collect_idle=0.05) as collector:
+            return await _request(collector, run_id)
+
+    response = asyncio.run(first_cron())
+    assert response.choices[0].message.content == "answer 1"
+    with db_manager.get_session() as session:
+        request = session.query(LLMBatchRequest).filter(LLMBatchRequest.run_id == run_id).one()
+        assert request.status == "done"
+        assert request.batch.status == "completed"
+
+    # The resumed run asks the same question again and gets the stored answer without a new batch
+    async def second_cron():
+        async with BatchCollector(LocalFileBatchProvider(responder, directory=str(tmp_path)), collect_idle=0.05) as collector:
+            return await _request(collector, run_id)
+
+    assert asyncio.run(second_cron()).choices[0].message.content == "answer 1"
+    assert responder.calls == 1
+
+def test_resume_picks_up_batch_submitted_before_crash(user_id, tmp_path, monkeypatch):
+    monkeypatch.setattr("linkedin_ai.batch.BATCH_RUN_HEARTBEAT", 0)
+    run_id = _new_run(user_id, age=timedelta(hours=1))
+    responder = CountingResponder()
+
+    class NeverFinishes(LocalFileBatchProvider):
+        async def status(self, external_id):
+            return "in_progress"
+
+    # The cron process dies after submitting, while the batch is still running
+    async def interrupted_cron():
+        async with BatchCollector(NeverFinishes(responder, directory=str(tmp_path)), collect_idle=0.05) as collector:
+            task = asyncio.create_task(_request(collector, run_id))
+            await asyncio.sleep(0.5)
+            task.cancel()
+
+    asyncio.run(interrupted_cron())
+    with db_manager.get_session() as session:
+        assert session.query(LLMBatchRequest).filter(LLMBatchRequest.run_id == run_id).one().status == "pending"
+        # Touched while its batch was being polled, so the cron doesn't take it for abandoned
+        assert session.get(PipelineRun, run_id).updated_at > datetime.utcnow() - timedelta(minutes=1)
+        batches = session.query(LLMBatch).count()
+
+    async def next_cron():
+        async with BatchCollector(LocalFileBatchProvider(responder, directory=str(tmp_path)), collect_idle=0.05) as collector:
+            return await _request(collector, run_id)
+
+    assert asyncio.run(next_cron()).choices[0].message.content == "answer 1"
+    with db_manager.get_session() as session:
+        # Polled the batch submitted before the crash instead of submitting a new one
+        assert session.query(LLMBatch).count() == batches
+        assert session.query(LLMBatchRequest).filter(LLMBatchRequest.run_id == run_id).one().status == "done"
+
+def _add_batch_request(run_id: str):
+    with db_manager.get_session() as session:
+        batch = LLMBatch(provider="local", external_id="local_batch_test", request_count=1)
+        session.add(batch)
+        session.flush()
+        session.add(LLMBatchRequest(batch_id=batch.id, run_id=run_id, custom_id=f"{run_id}-0",
+                                    stage="get_topic", params=json.dumps(PARAMS)))
+
+def test_find_resumable_batch_runs(user_id):
+    failed = _new_run(user_id, status="failed")
+    abandoned = _new_run(user_id, age=timedelta(hours=1))
+    live = _new_run(user_id)
+    completed = _new_run(user_id, status="completed", age=timedelta(hours=1))
+    without_batch = _new_run(user_id, status="failed")
+    for run_id in (failed, abandoned, live, completed):
+        _add_batch_request(run_id)
+
+    with db_manager.get_session() as session:
+        found = {run.id for run in find_resumable_runs(session, batch=True, stale_after=15 * 60)}
+
+    assert {failed, abandoned} <= found
+    assert not {live, completed, without_batch} & found
+
+def test_find_resumable_realtime_runs(user_id):
+    failed = _new_run(user_id, status="failed")
+    abandoned = _new_run(user_id, age=timedelta(hours=1))
+    live = _new_run(user_id)
+    with db_manager.get_session() as session:
+        from_job = PipelineRun(user_id=user_id, status="failed", job_id=None, manual_topic="From a manual job")
+        session.add(from_job)
+        session.flush()
+        manual = from_job.id
+
+    with db_manager.get_session() as session:
+        found = {run.id for run in find_resumable_runs(session, batch=False, stale_after=15 * 60)}
+
+    assert {failed, abandoned} <= found
+    assert not {live, manual} & found
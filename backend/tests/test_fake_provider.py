@@ -0,0 +1,119 @@
+import asyncio
+import json
+import random
+import time
+import openai
+import pytest
+from linkedin_ai import providers
+from linkedin_ai.providers import FakeProvider, Latency, create_provider
+
+def _params(content: str = "Write a post about hiring") -> dict:
+    return {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": content}]}
+
+def _complete(provider: FakeProvider, stage: str, params: dict = None):
+    return asyncio.run(provider.complete(params or _params(), stage=stage))
+
+def test_same_seed_and_request_give_the_same_text():
+    first = _complete(FakeProvider(seed=3), "generate_post").choices[0].message.content
+    again = _complete(FakeProvider(seed=3), "generate_post").choices[0].message.content
+    other = _complete(FakeProvider(seed=3), "generate_post", _params("Write a post about selling")).choices[0].message.content
+    assert first == again
+    assert first != other
+
+def test_default_templates_give_parseable_stage_outputs():
+    provider = FakeProvider()
+    evaluation = json.loads(_complete(provider, "evaluate_post").choices[0].message.content)
+    assert evaluation["score"] in range(5, 10)
+    assert evaluation["feedback"]
+    assert len(json.loads(_complete(provider, "generate_best_topic").choices[0].message.content)["topics"]) == 5
+    scores = json.loads(_complete(provider, "score_topics", _params('Score these:\n["A", "B"]')).choices[0].message.content)
+    assert [s["topic"] for s in scores["scores"]] == ["A", "B"]
+
+def test_custom_templates():
+    provider = FakeProvider(templates={
+        "generate_punchline": "Fixed punchline",
+        "generate_post": ["one", "two"],
+        "rewrite_post": lambda rng, params: params["messages"][0]["content"].upper(),
+    })
+    assert _complete(provider, "generate_punchline").choices[0].message.content == "Fixed punchline"
+    assert _complete(provider, "generate_post").choices[0].message.content in ("one", "two")
+    assert _complete(provider, "rewrite_post", _params("shout")).choices[0].message.content == "SHOUT"
+    assert _complete(provider, "unknown_stage").choices[0].message.content == "Fake response"
+
+def test_usage_is_reported():
+    usage = _complete(FakeProvider(), "generate_post").usage
+    assert usage.completion_tokens > 0
+    assert usage.total_tokens == usage.prompt_tokens + usage.completion_tokens
+
+def test_streams_the_completion_text():
+    provider = FakeProvider(seed=1)
+
+    async def collect():
+        deltas = await provider.stream(_params(), stage="generate_post")
+        return "".join([delta async for delta in deltas])
+
+    assert asyncio.run(collect()) == _complete(FakeProvider(seed=1), "generate_post").choices[0].message.content
+
+@pytest.mark.parametrize("spec, low, high", [
+    ("fixed:0.2", 0.2, 0.2),
+    ("uniform:0.1:0.3", 0.1, 0.3),
+    ("lognormal:0.5:0", 0.5, 0.5),
+])
+def test_latency_distributions(spec, low, high):
+    rng = random.Random(0)
+    samples = [Latency(spec).sample(rng) for _ in range(50)]
+    assert all(low <= s <= high for s in samples)
+
+def test_latency_is_never_negative():
+    rng = random.Random(0)
+    assert min(Latency("normal:0:1").sample(rng) for _ in range(100)) == 0.0
+
+def test_unknown_latency_distribution():
+    with pytest.raises(ValueError):
+        Latency("gamma:1:2")
+
+def test_stage_latency_overrides_the_default():
+    provider = FakeProvider(latency="fixed:0", stage_latency={"generate_post": "fixed:0.2"})
+    started = time.monotonic()
+    _complete(provider, "evaluate_post")
+    assert time.monotonic() - started < 0.1
+    started = time.monotonic()
+    _complete(provider, "generate_post")
+    assert time.monotonic() - started >= 0.2
+
+def test_injected_server_errors():
+    provider = FakeProvider(error_rate=1.0)
+    with pytest.raises(openai.InternalServerError) as error:
+        _complete(provider, "generate_post")
+    assert error.value.status_code == 500
+
+def test_injected_rate_limits_carry_retry_after():
+    provider = FakeProvider(rate_limit_rate=1.0)
+    with pytest.raises(openai.RateLimitError) as error:
+        _complete(provider, "generate_post")
+    assert error.value.response.headers["retry-after"] == "1"
+
+def test_error_rate_is_roughly_respected():
+    provider = FakeProvider(seed=7, error_rate=0.3)
+
+    async def run():
+        outcomes = await asyncio.gather(*(provider.complete(_params(str(i)), stage="generate_post") for i in range(200)),
+                                        return_exceptions=True)
+        return sum(isinstance(o, openai.InternalServerError) for o in outcomes)
+
+    assert 30 <= asyncio.run(run()) <= 90
+
+def test_requests_per_minute_limit():
+    provider = FakeProvider(requests_per_minute=2)
+    _complete(provider, "generate_post")
+    _complete(provider, "generate_post")
+    with pytest.raises(openai.RateLimitError) as error:
+        _complete(provider, "generate_post")
+    assert float(error.value.response.headers["retry-after"]) > 0
+
+def test_fake_provider_never_builds_an_openai_client(monkeypatch):
+    monkeypatch.setattr(providers, "_openai_client", None)
+    assert create_provider("fake").name == "fake"
+    assert providers._openai_client is None
+    with pytest.raises(ValueError):
+        create_provider("nope")
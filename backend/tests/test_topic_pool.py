@@ -0,0 +1,17 @@
+import asyncio
+from linkedin_ai import topic_pool
+from linkedin_ai.brief_digest import brief_hash
+from linkedin_ai.topic_generator import get_topic
+
+BRIEF = "We write about AI for small teams."
+
+def test_pool_is_keyed_by_the_raw_brief(user_id):
+    topic_pool.add_topics(user_id, "personal", brief_hash(BRIEF), [{"topic": "Pooled topic", "score": 9}])
+
+    # The prompt brief is a digest (or the raw brief when the digest failed); either way the pool is found
+    topic = asyncio.run(get_topic("Identity: a digest of the brief", brief_type="personal", user_id=user_id,
+                                  pool_hash=brief_hash(BRIEF)))
+
+    assert topic["source"] == "pool"
+    assert topic["topic"] == "Pooled topic"
+    assert topic_pool.unused_topics(user_id, "personal", brief_hash(BRIEF)) == []